@@ -48,7 +48,6 @@ from objects import matchList
 from objects import osuToken
 from objects import slot
 from objects import stream_messages
-from objects import tokenList
 from objects.redisLock import redisLock
 
 """
@@ -245,7 +244,11 @@ async def addbn(fro: str, chan: str, message: list[str]) -> str:
     await user_utils.set_privileges(targetID, new_privileges)
     target_tokens = await osuToken.get_all_tokens_by_user_id(targetID)
     for token in target_tokens:
-        await osuToken.update_token(token["token_id"], privileges=new_privileges)
+        await osuToken.update_token(
+            token["token_id"],
+            privileges=new_privileges,
+            return_token=False,
+        )
     await user_utils.add_user_badge(targetID, badges.BEATMAP_NOMINATION)
     await user_utils.set_absolute_donor_expiry_time(targetID, 2147483647)
     return f"{fro} has given BN to {username}."
@@ -277,7 +280,11 @@ async def removebn(fro: str, chan: str, message: list[str]) -> str:
     await user_utils.set_absolute_donor_expiry_time(targetID, 0)
     target_tokens = await osuToken.get_all_tokens_by_user_id(targetID)
     for token in target_tokens:
-        await osuToken.update_token(token["token_id"], privileges=new_privileges)
+        await osuToken.update_token(
+            token["token_id"],
+            privileges=new_privileges,
+            return_token=False,
+        )
     return f"{fro} has removed BN from {username}."
 
 
@@ -758,7 +765,7 @@ async def systemMaintenance(fro: str, chan: str, message: list[str]) -> str:
         who = []
 
         # Disconnect everyone but mod/admins
-        for value in await osuToken.get_tokens():
+        async for value in osuToken.iter_token_fields(["user_id", "privileges"]):
             if not osuToken.is_staff(value["privileges"]):
                 who.append(value["user_id"])
 
@@ -774,7 +781,11 @@ async def systemMaintenance(fro: str, chan: str, message: list[str]) -> str:
             ),
         )
 
-        await tokenList.multipleEnqueue(serverPackets.loginError, who)
+        await stream_messages.multicast_data(
+            "main",
+            serverPackets.loginError,
+            included_user_ids=who,
+        )
         msg = "The server is now in maintenance mode!"
     else:
         # We have turned off maintenance mode
@@ -1014,6 +1025,7 @@ async def tillerinoNp(fro: str, chan: str, message: list[str]) -> str | None:
             "mods": mods_int,
             "accuracy": -1.0,
         },
+        return_token=False,
     )
 
     # Send back pp values only if this is a DM (not a public channel)
@@ -1072,7 +1084,11 @@ async def tillerinoMods(fro: str, chan: str, message: list[str]) -> str | None:
 
     # Set mods
     token["last_np"]["mods"] = _mods
-    await osuToken.update_token(token["token_id"], last_np=token["last_np"])
+    await osuToken.update_token(
+        token["token_id"],
+        last_np=token["last_np"],
+        return_token=False,
+    )
 
     # Return tillerino message for that beatmap with mods
     return await getPPMessage(token["user_id"])
@@ -1155,6 +1171,7 @@ async def tillerinoLast(fro: str, chan: str, message: list[str]) -> str | None:
                     "mods": data["mods"],
                     "accuracy": data["accuracy"],
                 },
+                return_token=False,
             )
             oppaiData = await getPPMessage(token["user_id"], just_data=True)
             if isinstance(oppaiData, str):
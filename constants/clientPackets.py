@@ -9,7 +9,7 @@ from helpers import packetHelper
 """ Protocol v20 """
 
 
-def changeProtocolVersion(stream: bytes) -> dict[str, Any]:
+def changeProtocolVersion(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("version", dataTypes.UINT32),))["data"]
 
 
@@ -26,15 +26,15 @@ ACTION_CHANGE_FMT = (
 """ Users listing packets """
 
 
-def userActionChange(stream: bytes) -> dict[str, Any]:
+def userActionChange(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, ACTION_CHANGE_FMT)["data"]
 
 
-def userStatsRequest(stream: bytes) -> dict[str, Any]:
+def userStatsRequest(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("users", dataTypes.INT_LIST),))["data"]
 
 
-def userPanelRequest(stream: bytes) -> dict[str, Any]:
+def userPanelRequest(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("users", dataTypes.INT_LIST),))["data"]
 
 
@@ -46,7 +46,7 @@ PUBLIC_MSG_FMT = (
 )
 
 
-def sendPublicMessage(stream: bytes) -> dict[str, Any]:
+def sendPublicMessage(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, PUBLIC_MSG_FMT)["data"]
 
 
@@ -58,30 +58,30 @@ PRIVATE_MSG_FMT = (
 )
 
 
-def sendPrivateMessage(stream: bytes) -> dict[str, Any]:
+def sendPrivateMessage(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, PRIVATE_MSG_FMT)["data"]
 
 
-def setAwayMessage(stream: bytes) -> dict[str, Any]:
+def setAwayMessage(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(
         stream,
         (("unknown", dataTypes.STRING), ("awayMessage", dataTypes.STRING)),
     )["data"]
 
 
-def blockDM(stream: bytes) -> dict[str, Any]:
+def blockDM(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("value", dataTypes.UINT32),))["data"]
 
 
-def channelJoin(stream: bytes) -> dict[str, Any]:
+def channelJoin(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("channel", dataTypes.STRING),))["data"]
 
 
-def channelPart(stream: bytes) -> dict[str, Any]:
+def channelPart(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("channel", dataTypes.STRING),))["data"]
 
 
-def addRemoveFriend(stream: bytes) -> dict[str, Any]:
+def addRemoveFriend(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("friendID", dataTypes.SINT32),))[
         "data"
     ]
@@ -90,7 +90,7 @@ def addRemoveFriend(stream: bytes) -> dict[str, Any]:
 """ Spectator packets """
 
 
-def startSpectating(stream: bytes) -> dict[str, Any]:
+def startSpectating(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("userID", dataTypes.SINT32),))["data"]
 
 
@@ -118,7 +118,7 @@ MATCH_SETTINGS_FMT_SECOND = (
 MATCH_SETTINGS_FMT_THIRD = (*[(f"slot{i}Mods", dataTypes.UINT32) for i in range(16)],)
 
 
-def matchSettings(stream: bytes) -> dict[str, Any]:
+def matchSettings(stream: memoryview) -> dict[str, Any]:
     # Data to return, will be merged later
     data = {}
 
@@ -140,63 +140,59 @@ def matchSettings(stream: bytes) -> dict[str, Any]:
     struct.extend(MATCH_SETTINGS_FMT_SECOND)
 
     # Read second part
-    result = packetHelper.readPacketData(
-        stream[start:],
-        tuple(struct),
-        has_packet_header=False,
-    )
+    result = packetHelper.readPacketData(stream, tuple(struct), offset=start)
     data.update(result["data"])
 
     if data["freeMods"] == 0:
         return data
 
     # Next part's start
-    start += result["end"]
+    start = result["end"]
 
     # Read third (final) part
     data.update(
         packetHelper.readPacketData(
-            stream[start:],
+            stream,
             MATCH_SETTINGS_FMT_THIRD,
-            has_packet_header=False,
+            offset=start,
         )["data"],
     )
 
     return data
 
 
-def createMatch(stream: bytes) -> dict[str, Any]:
+def createMatch(stream: memoryview) -> dict[str, Any]:
     return matchSettings(stream)
 
 
-def changeMatchSettings(stream: bytes) -> dict[str, Any]:
+def changeMatchSettings(stream: memoryview) -> dict[str, Any]:
     return matchSettings(stream)
 
 
-def changeSlot(stream: bytes) -> dict[str, Any]:
+def changeSlot(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("slotID", dataTypes.UINT32),))["data"]
 
 
-def joinMatch(stream: bytes) -> dict[str, Any]:
+def joinMatch(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(
         stream,
         (("matchID", dataTypes.UINT32), ("password", dataTypes.STRING)),
     )["data"]
 
 
-def changeMods(stream: bytes) -> dict[str, Any]:
+def changeMods(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("mods", dataTypes.UINT32),))["data"]
 
 
-def lockSlot(stream: bytes) -> dict[str, Any]:
+def lockSlot(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("slotID", dataTypes.UINT32),))["data"]
 
 
-def transferHost(stream: bytes) -> dict[str, Any]:
+def transferHost(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("slotID", dataTypes.UINT32),))["data"]
 
 
-def matchInvite(stream: bytes) -> dict[str, Any]:
+def matchInvite(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("userID", dataTypes.UINT32),))["data"]
 
 
@@ -219,17 +215,17 @@ MATCH_FRAMES_FMT = (
 )
 
 
-def matchFrames(stream: bytes) -> dict[str, Any]:
+def matchFrames(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, MATCH_FRAMES_FMT)["data"]
 
 
-def tournamentMatchInfoRequest(stream: bytes) -> dict[str, Any]:
+def tournamentMatchInfoRequest(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("matchID", dataTypes.UINT32),))["data"]
 
 
-def tournamentJoinMatchChannel(stream: bytes) -> dict[str, Any]:
+def tournamentJoinMatchChannel(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("matchID", dataTypes.UINT32),))["data"]
 
 
-def tournamentLeaveMatchChannel(stream: bytes) -> dict[str, Any]:
+def tournamentLeaveMatchChannel(stream: memoryview) -> dict[str, Any]:
     return packetHelper.readPacketData(stream, (("matchID", dataTypes.UINT32),))["data"]
@@ -2,6 +2,9 @@
 
 from __future__ import annotations
 
+from collections.abc import Callable
+from typing import cast
+
 from common.constants import privileges
 from common.ripple import user_utils
 from constants import CHATBOT_USER_ID
@@ -12,6 +15,7 @@ from helpers import packetHelper
 from objects import glob
 from objects import match
 from objects import osuToken
+from objects import user_packet_cache
 
 # TODO: any packet using async/await should likely
 # be refactored to accept the data as a parameter
@@ -128,12 +132,8 @@ def friendList(userID: int, friends_list: list[int]) -> bytes:
 
 
 async def onlineUsers() -> bytes:
-    userIDs = []
-
-    # Create list with all connected (and not restricted) users
-    for value in await osuToken.get_tokens():
-        if not osuToken.is_restricted(value["privileges"]):
-            userIDs.append(value["user_id"])
+    # All connected (and not restricted) users
+    userIDs = list(await osuToken.get_online_user_ids())
 
     return packetHelper.buildPacket(
         packetIDs.server_userPresenceBundle,
@@ -159,15 +159,80 @@ BOT_PRESENCE = (
 )
 
 
+USER_PACKET_TOKEN_FIELDS = ["user_id", *sorted(user_packet_cache.PACKET_FIELDS)]
+
+
+async def _getUserPackets(
+    userIDs: list[int],
+    packetName: str,
+    buildPacket: Callable[[osuToken.Token], bytes],
+) -> dict[int, user_packet_cache.CachedPacket]:
+    """\
+    Get a packet for each online user, from the cache where possible,
+    and otherwise built from tokens fetched in a single batch.
+    """
+    packets: dict[int, user_packet_cache.CachedPacket] = {}
+    missingUserIDs: list[int] = []
+    for userID in userIDs:
+        cached = user_packet_cache.get(userID, packetName)
+        if cached is not None:
+            packets[userID] = cached
+        elif userID not in packets:
+            missingUserIDs.append(userID)
+
+    if missingUserIDs:
+        generation = user_packet_cache.get_generation()
+        tokens = await osuToken.get_token_fields_by_user_ids(
+            missingUserIDs,
+            USER_PACKET_TOKEN_FIELDS,
+        )
+        for userID, tokenFields in tokens.items():
+            # (only the fields the packets are built from)
+            userToken = cast(osuToken.Token, tokenFields)
+            cached = {
+                "packet_data": buildPacket(userToken),
+                "privileges": userToken["privileges"],
+                "tournament": userToken["tournament"],
+            }
+            user_packet_cache.store(userID, packetName, cached, generation=generation)
+            packets[userID] = cached
+
+    return packets
+
+
 async def userPanel(userID: int, force: bool = False) -> bytes:
-    if userID == CHATBOT_USER_ID:
-        return BOT_PRESENCE
+    return await bulkUserPanel([userID], force=force)
 
-    # Connected and restricted check
-    userToken = await osuToken.get_token_by_user_id(userID)
-    if not userToken or (osuToken.is_restricted(userToken["privileges"]) and not force):
-        return b""
 
+async def bulkUserPanel(userIDs: list[int], force: bool = False) -> bytes:
+    """Build the panels of many users into a single buffer."""
+    packets = await _getUserPackets(
+        [userID for userID in userIDs if userID != CHATBOT_USER_ID],
+        "userPanel",
+        _buildUserPanel,
+    )
+
+    panels: list[bytes] = []
+    for userID in userIDs:
+        if userID == CHATBOT_USER_ID:
+            panels.append(BOT_PRESENCE)
+            continue
+
+        # Connected check
+        cached = packets.get(userID)
+        if cached is None:
+            continue
+
+        # Restricted check
+        if osuToken.is_restricted(cached["privileges"]) and not force:
+            continue
+
+        panels.append(cached["packet_data"])
+
+    return b"".join(panels)
+
+
+def _buildUserPanel(userToken: osuToken.Token) -> bytes:
     # Get user data
     username = userToken["username"]
     timezone = 24 + userToken["utc_offset"]
@@ -198,7 +263,7 @@ async def userPanel(userID: int, force: bool = False) -> bytes:
     return packetHelper.buildPacket(
         packetIDs.server_userPanel,
         (
-            (userID, dataTypes.SINT32),
+            (userToken["user_id"], dataTypes.SINT32),
             (username, dataTypes.STRING),
             (timezone, dataTypes.BYTE),
             (country, dataTypes.BYTE),
@@ -221,18 +286,37 @@ BOT_STATS = (
 
 
 async def userStats(userID: int, force: bool = False) -> bytes:
-    if userID == CHATBOT_USER_ID:
-        return BOT_STATS
+    return await bulkUserStats([userID], force=force)
 
-    # Get userID's token from tokens list
-    userToken = await osuToken.get_token_by_user_id(userID)
-    if userToken is None:
-        return b""
 
-    if not force:
-        if osuToken.is_restricted(userToken["privileges"]) or userToken["tournament"]:
-            return b""
+async def bulkUserStats(userIDs: list[int], force: bool = False) -> bytes:
+    """Build the stats of many users into a single buffer."""
+    packets = await _getUserPackets(
+        [userID for userID in userIDs if userID != CHATBOT_USER_ID],
+        "userStats",
+        _buildUserStats,
+    )
+
+    stats: list[bytes] = []
+    for userID in userIDs:
+        if userID == CHATBOT_USER_ID:
+            stats.append(BOT_STATS)
+            continue
+
+        cached = packets.get(userID)
+        if cached is None:
+            continue
+
+        if not force:
+            if osuToken.is_restricted(cached["privileges"]) or cached["tournament"]:
+                continue
+
+        stats.append(cached["packet_data"])
+
+    return b"".join(stats)
+
 
+def _buildUserStats(userToken: osuToken.Token) -> bytes:
     # If our PP is over the osu client's cap (32768), we simply send
     # our pp value as ranked score instead, and send pp as 0.
     # The rank will not be affected as it is calculated
@@ -240,7 +324,7 @@ async def userStats(userID: int, force: bool = False) -> bytes:
     return packetHelper.buildPacket(
         packetIDs.server_userStats,
         (
-            (userID, dataTypes.UINT32),
+            (userToken["user_id"], dataTypes.UINT32),
             (userToken["action_id"], dataTypes.BYTE),
             (userToken["action_text"], dataTypes.STRING),
             (userToken["action_md5"], dataTypes.STRING),
@@ -362,7 +446,7 @@ def removeSpectator(userID: int) -> bytes:
     )
 
 
-def spectatorFrames(data: bytes) -> bytes:
+def spectatorFrames(data: bytes | memoryview) -> bytes:
     return packetHelper.buildPacket(
         packetIDs.server_spectateFrames,
         ((data, dataTypes.BBYTES),),
@@ -395,36 +479,29 @@ def fellowSpectatorLeft(userID: int) -> bytes:
 
 async def createMatch(match_id: int) -> bytes:
     # Get match binary data and build packet
-    multiplayer_match = await match.get_match(match_id)
-    if multiplayer_match is None:
+    matchData = await match.getEncodedMatchData(match_id, censored=True)
+    if matchData is None:
         return b""
 
-    matchData = await match.getMatchData(match_id, censored=True)
-    return packetHelper.buildPacket(packetIDs.server_newMatch, matchData)
+    return packetHelper.wrapPacketBody(packetIDs.server_newMatch, matchData)
 
 
 async def updateMatch(match_id: int, censored: bool = False) -> bytes | None:
     # Get match binary data and build packet
-    multiplayer_match = await match.get_match(match_id)
-    if multiplayer_match is None:
+    matchData = await match.getEncodedMatchData(match_id, censored=censored)
+    if matchData is None:
         return None
 
-    return packetHelper.buildPacket(
-        packetIDs.server_updateMatch,
-        await match.getMatchData(match_id, censored=censored),
-    )
+    return packetHelper.wrapPacketBody(packetIDs.server_updateMatch, matchData)
 
 
 async def matchStart(match_id: int) -> bytes:
     # Get match binary data and build packet
-    multiplayer_match = await match.get_match(match_id)
-    if multiplayer_match is None:
+    matchData = await match.getEncodedMatchData(match_id, censored=False)
+    if matchData is None:
         return b""
 
-    return packetHelper.buildPacket(
-        packetIDs.server_matchStart,
-        await match.getMatchData(match_id, censored=False),
-    )
+    return packetHelper.wrapPacketBody(packetIDs.server_matchStart, matchData)
 
 
 def disposeMatch(match_id: int) -> bytes:
@@ -436,14 +513,11 @@ def disposeMatch(match_id: int) -> bytes:
 
 async def matchJoinSuccess(match_id: int) -> bytes:
     # Get match binary data and build packet
-    multiplayer_match = await match.get_match(match_id)
-    if multiplayer_match is None:
+    matchData = await match.getEncodedMatchData(match_id, censored=False)
+    if matchData is None:
         return b""
 
-    return packetHelper.buildPacket(
-        packetIDs.server_matchJoinSuccess,
-        await match.getMatchData(match_id, censored=False),
-    )
+    return packetHelper.wrapPacketBody(packetIDs.server_matchJoinSuccess, matchData)
 
 
 matchJoinFail = packetHelper.buildPacket(packetIDs.server_matchJoinFail)
@@ -469,13 +543,13 @@ def playerSkipped(userID: int) -> bytes:
 allPlayersSkipped = packetHelper.buildPacket(packetIDs.server_matchSkip)
 
 
-def matchFrames(slotID: int, data: bytes) -> bytes:
+def matchFrames(slotID: int, data: bytes | memoryview) -> bytes:
     return packetHelper.buildPacket(
         packetIDs.server_matchScoreUpdate,
         (
-            (data[7:11], dataTypes.BBYTES),
+            (data[0:4], dataTypes.BBYTES),
             (slotID, dataTypes.BYTE),
-            (data[12:], dataTypes.BBYTES),
+            (data[5:], dataTypes.BBYTES),
         ),
     )
 
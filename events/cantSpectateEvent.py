@@ -7,12 +7,16 @@ from objects import osuToken
 from objects.osuToken import Token
 
 
-async def handle(token: Token, rawPacketData: bytes) -> None:
+async def handle(token: Token, rawPacketData: memoryview) -> None:
     try:
         # We don't have the beatmap, we can't spectate
         if (
             token["spectating_token_id"] is None
-            or token["spectating_token_id"] not in await osuToken.get_token_ids()
+            or token["spectating_user_id"] is None
+            or not await osuToken.is_user_token(
+                token["spectating_user_id"],
+                token["spectating_token_id"],
+            )
         ):
             raise exceptions.tokenNotFoundException()
 
@@ -4,13 +4,14 @@ from common.constants import actions
 from common.constants import mods
 from common.ripple import user_utils
 from constants import clientPackets
+from constants import packetIDs
 from constants import serverPackets
 from objects import osuToken
 from objects import stream_messages
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     # Make sure we are not banned
     # if await user_utils.isBanned(userID):
     # 	userToken.enqueue(serverPackets.loginBanned)
@@ -93,9 +94,13 @@ async def handle(userToken: Token, rawPacketData: bytes) -> None:
         await osuToken.updateCachedStats(userToken["token_id"])
 
     if not osuToken.is_restricted(userToken["privileges"]):
-        await stream_messages.broadcast_data(
+        await stream_messages.broadcast_latest_data(
             stream_name="main",
             data=await serverPackets.userStats(userToken["user_id"]),
+            coalesce_key=stream_messages.make_coalesce_key(
+                packetIDs.server_userStats,
+                userToken["user_id"],
+            ),
             excluded_token_ids=[userToken["token_id"]],
         )
 
@@ -11,7 +11,7 @@ from objects.osuToken import Token
 from objects.redisLock import redisLock
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     # Read new settings
     packetData = clientPackets.changeMatchSettings(rawPacketData)
 
@@ -86,16 +86,17 @@ async def handle(userToken: Token, rawPacketData: bytes) -> None:
             else:
                 # Central -> Freemods
                 # Move mods from match -> players.
-                for slot_id, _slot in enumerate(slots):
-                    if _slot["user_token"]:
-                        await slot.update_slot(
-                            multiplayer_match["match_id"],
-                            slot_id,
-                            # removing speed changing mods would seem more correct,
-                            # but that would mean switching back from freemods to central
-                            # would remove speed changing mods from the match?
-                            mods=multiplayer_match["mods"],
-                        )
+                await slot.update_slots(
+                    multiplayer_match["match_id"],
+                    {
+                        # removing speed changing mods would seem more correct,
+                        # but that would mean switching back from freemods to central
+                        # would remove speed changing mods from the match?
+                        slot_id: {"mods": multiplayer_match["mods"]}
+                        for slot_id, _slot in enumerate(slots)
+                        if _slot["user_token"]
+                    },
+                )
 
                 # Only keep speed-changing mods centralized.
                 await match.update_match(
@@ -5,7 +5,7 @@ from constants import clientPackets
 from objects import osuToken
 
 
-async def handle(userToken: osuToken.Token, rawPacketData: bytes) -> None:
+async def handle(userToken: osuToken.Token, rawPacketData: memoryview) -> None:
     """User is using Akatsuki's patcher and is trying to upgrade their connection."""
 
     initial_protocol_version = userToken["protocol_version"]
@@ -14,6 +14,7 @@ async def handle(userToken: osuToken.Token, rawPacketData: bytes) -> None:
     await osuToken.update_token(
         userToken["token_id"],
         protocol_version=userToken["protocol_version"],
+        return_token=False,
     )
 
     logger.info(
@@ -8,7 +8,10 @@ from objects import glob
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:  # Channel join packet
+async def handle(
+    userToken: Token,
+    rawPacketData: memoryview,
+) -> None:  # Channel join packet
     channel_name = clientPackets.channelJoin(rawPacketData)["channel"]
     await chat.join_channel(token_id=userToken["token_id"], channel_name=channel_name)
 
@@ -18,7 +18,7 @@ from objects.redisLock import redisLock
 class MatchCreationDisabledError(Exception): ...
 
 
-async def handle(token: osuToken.Token, rawPacketData: bytes) -> None:
+async def handle(token: osuToken.Token, rawPacketData: memoryview) -> None:
     try:
         # Read packet data
         packetData = clientPackets.createMatch(rawPacketData)
@@ -1,18 +1,16 @@
 from __future__ import annotations
 
-from constants import serverPackets
-from objects import match
+from objects import lobby_snapshot
 from objects import osuToken
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     # Add user to users in lobby
     await osuToken.joinStream(userToken["token_id"], "lobby")
 
     # Send matches data
-    for match_id in await match.get_match_ids():
-        await osuToken.enqueue(
-            userToken["token_id"],
-            await serverPackets.createMatch(match_id),
-        )
+    await osuToken.enqueue(
+        userToken["token_id"],
+        await lobby_snapshot.get_snapshot(),
+    )
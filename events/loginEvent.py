@@ -22,6 +22,7 @@ from common.ripple import user_utils
 from common.web.requestsManager import AsyncRequestHandler
 from constants import CHATBOT_USER_ID
 from constants import exceptions
+from constants import packetIDs
 from constants import serverPackets
 from helpers import chatHelper as chat
 from helpers import locationHelper
@@ -539,12 +540,12 @@ async def handle(web_handler: AsyncRequestHandler) -> tuple[str, bytes]:  # toke
             )
 
         # Send online users' panels
-        for token in await osuToken.get_tokens():
-            if not osuToken.is_restricted(token["privileges"]):
-                await osuToken.enqueue(
-                    userToken["token_id"],
-                    await serverPackets.userPanel(token["user_id"]),
-                )
+        await osuToken.enqueue(
+            userToken["token_id"],
+            await serverPackets.bulkUserPanel(
+                list(await osuToken.get_online_user_ids()),
+            ),
+        )
 
         # Get location and country from client ip address
         geolocation = await locationHelper.resolve_ip_geolocation(request_ip_address)
@@ -571,9 +572,13 @@ async def handle(web_handler: AsyncRequestHandler) -> tuple[str, bytes]:  # toke
 
         # Send to everyone our userpanel if we are not restricted or tournament
         if not osuToken.is_restricted(userToken["privileges"]):
-            await stream_messages.broadcast_data(
+            await stream_messages.broadcast_latest_data(
                 "main",
                 await serverPackets.userPanel(userID),
+                coalesce_key=stream_messages.make_coalesce_key(
+                    packetIDs.server_userPanel,
+                    userID,
+                ),
             )
 
         if glob.amplitude is not None:
@@ -632,6 +637,7 @@ async def handle(web_handler: AsyncRequestHandler) -> tuple[str, bytes]:  # toke
             )
 
         # Set reponse data to right value and reset our queue
+        await osuToken.flush_outbox()
         queued_token_data = await stream_messages.read_all_pending_data(
             userToken["token_id"],
         )
@@ -659,6 +665,7 @@ async def handle(web_handler: AsyncRequestHandler) -> tuple[str, bytes]:  # toke
     except exceptions.banchoMaintenanceException:
         # Bancho is in maintenance mode
         if userToken:
+            await osuToken.flush_outbox()
             queued_token_data = await stream_messages.read_all_pending_data(
                 userToken["token_id"],
             )
@@ -17,7 +17,7 @@ from objects.osuToken import Token
 
 async def handle(
     token: Token,
-    rawPacketData: bytes | None = None,
+    rawPacketData: memoryview | None = None,
     deleteToken: bool = True,
 ) -> None:
     # Big client meme here. If someone logs out and logs in right after,
@@ -52,6 +52,7 @@ async def handle(
         await osuToken.update_token(
             token["token_id"],
             kicked=True,
+            return_token=False,
         )
 
     # Change username if needed
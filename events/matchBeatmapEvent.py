@@ -11,7 +11,7 @@ from objects.redisLock import redisLock
 
 async def handle(
     userToken: Token,
-    rawPacketData: bytes,
+    rawPacketData: memoryview,
     *,
     has_beatmap: bool,
 ) -> None:
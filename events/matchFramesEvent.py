@@ -11,7 +11,7 @@ from objects import stream_messages
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     # Make sure we are in a match
     if userToken["match_id"] is None:
         return
@@ -8,7 +8,7 @@ from objects import osuToken
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     # Read packet data
     packetData = clientPackets.setAwayMessage(rawPacketData)
 
@@ -16,6 +16,7 @@ async def handle(userToken: Token, rawPacketData: bytes) -> None:
     await osuToken.update_token(
         userToken["token_id"],
         away_message=packetData["awayMessage"],
+        return_token=False,
     )
 
     # Send private message from Aika
@@ -5,8 +5,9 @@ from objects import osuToken
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     await osuToken.update_token(
         userToken["token_id"],
         block_non_friends_dm=clientPackets.blockDM(rawPacketData)["value"] != 0,
+        return_token=False,
     )
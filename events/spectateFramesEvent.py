@@ -6,12 +6,12 @@ from objects import stream_messages
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     # Send spectator frames to every spectator
     streamName = f"spect/{userToken['user_id']}"
     await stream_messages.broadcast_data(
         streamName,
-        serverPackets.spectatorFrames(rawPacketData[7:]),
+        serverPackets.spectatorFrames(rawPacketData),
         excluded_token_ids=[userToken["token_id"]],
     )
 
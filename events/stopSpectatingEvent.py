@@ -8,7 +8,7 @@ from objects import glob
 from objects import osuToken
 
 
-async def handle(userToken: osuToken.Token, rawPacketData: bytes) -> None:
+async def handle(userToken: osuToken.Token, rawPacketData: memoryview) -> None:
     try:
         # User must be spectating someone
         if userToken["spectating_user_id"] is None:
@@ -54,4 +54,5 @@ async def handle(userToken: osuToken.Token, rawPacketData: bytes) -> None:
             userToken["token_id"],
             spectating_token_id=None,
             spectating_user_id=None,
+            return_token=False,
         )
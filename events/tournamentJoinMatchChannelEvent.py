@@ -7,7 +7,7 @@ from objects import osuToken
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     packetData = clientPackets.tournamentJoinMatchChannel(rawPacketData)
     if (
         packetData["matchID"] not in await match.get_match_ids()
@@ -18,6 +18,7 @@ async def handle(userToken: Token, rawPacketData: bytes) -> None:
     await osuToken.update_token(
         userToken["token_id"],
         match_id=packetData["matchID"],
+        return_token=False,
     )
 
     await chat.join_channel(
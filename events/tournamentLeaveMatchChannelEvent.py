@@ -7,7 +7,7 @@ from objects import osuToken
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     packetData = clientPackets.tournamentLeaveMatchChannel(rawPacketData)
     if (
         packetData["matchID"] not in await match.get_match_ids()
@@ -24,4 +24,5 @@ async def handle(userToken: Token, rawPacketData: bytes) -> None:
     await osuToken.update_token(
         userToken["token_id"],
         match_id=None,
+        return_token=False,
     )
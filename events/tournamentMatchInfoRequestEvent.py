@@ -8,7 +8,7 @@ from objects.osuToken import Token
 from objects.redisLock import redisLock
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     packetData = clientPackets.tournamentMatchInfoRequest(rawPacketData)
 
     match_id = packetData["matchID"]
@@ -7,7 +7,7 @@ from objects import osuToken
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     # Read userIDs list
     packetData = clientPackets.userPanelRequest(rawPacketData)
 
@@ -22,7 +22,9 @@ async def handle(userToken: Token, rawPacketData: bytes) -> None:
         )
         return
 
-    for i in packetData["users"]:
-        # Enqueue userpanel packets relative to this user
-        logger.debug("Sending panel for user", extra={"user_slot_num": i})
-        await osuToken.enqueue(userToken["token_id"], await serverPackets.userPanel(i))
+    # Enqueue userpanel packets relative to these users
+    logger.debug("Sending panels for users", extra={"user_ids": packetData["users"]})
+    await osuToken.enqueue(
+        userToken["token_id"],
+        await serverPackets.bulkUserPanel(packetData["users"]),
+    )
@@ -7,7 +7,7 @@ from objects import osuToken
 from objects.osuToken import Token
 
 
-async def handle(userToken: Token, rawPacketData: bytes) -> None:
+async def handle(userToken: Token, rawPacketData: memoryview) -> None:
     # Read userIDs list
     packetData = clientPackets.userStatsRequest(rawPacketData)
 
@@ -16,15 +16,14 @@ async def handle(userToken: Token, rawPacketData: bytes) -> None:
         logger.warning("Received userStatsRequest with length > 32.")
         return
 
-    for userID in packetData["users"]:
-        logger.debug("Sending stats for user", extra={"user_id": userID})
+    # Skip our stats
+    userIDs = [
+        userID for userID in packetData["users"] if userID != userToken["user_id"]
+    ]
+    logger.debug("Sending stats for users", extra={"user_ids": userIDs})
 
-        # Skip our stats
-        if userID == userToken["user_id"]:
-            continue
-
-        # Enqueue stats packets relative to this user
-        await osuToken.enqueue(
-            userToken["token_id"],
-            await serverPackets.userStats(userID),
-        )
+    # Enqueue stats packets relative to these users
+    await osuToken.enqueue(
+        userToken["token_id"],
+        await serverPackets.bulkUserStats(userIDs),
+    )
@@ -4,7 +4,11 @@ from json import dumps
 from typing import Any
 
 from common.web.requestsManager import AsyncRequestHandler
+from helpers import compressionHelper
 from objects import glob
+from objects import match
+from objects import redisLock
+from objects import stream_watermarks
 
 
 class handler(AsyncRequestHandler):
@@ -15,6 +19,18 @@ class handler(AsyncRequestHandler):
             # Get online users count
             data["result"] = 1
 
+            # Client polls answered without reading from redis
+            data["stream_poll_stats"] = stream_watermarks.POLL_STATS
+
+            # Gzip compression of client poll responses
+            data["compression_stats"] = compressionHelper.COMPRESSION_STATS
+
+            # Match packets served without rebuilding them
+            data["match_data_cache_stats"] = match.MATCH_DATA_CACHE_STATS
+
+            # Contention of each recently used lock
+            data["lock_stats"] = redisLock.LOCK_STATS
+
             # Status code and message
             statusCode = 200
             data["message"] = "ok"
@@ -1,9 +1,7 @@
 from __future__ import annotations
 
 import asyncio
-import gzip
 import random
-import struct
 import time
 from collections.abc import Awaitable
 from collections.abc import Callable
@@ -61,16 +59,17 @@ from events import tournamentLeaveMatchChannelEvent
 from events import tournamentMatchInfoRequestEvent
 from events import userPanelRequestEvent
 from events import userStatsRequestEvent
+from helpers import compressionHelper
+from helpers import packetHelper
 from objects import glob
+from objects import match_actors
 from objects import osuToken
 from objects import stream_messages
 from objects import tokenList
 
-PACKET_PROTO = struct.Struct("<HxI")
-
 # Packet map of all bancho related
 # interactions with the osu! client.
-bancho_packets: dict[int, Callable[[osuToken.Token, bytes], Awaitable[None]]] = {
+bancho_packets: dict[int, Callable[[osuToken.Token, memoryview], Awaitable[None]]] = {
     packetIDs.client_changeAction: changeActionEvent.handle,
     packetIDs.client_logout: logoutEvent.handle,
     packetIDs.client_friendAdd: friendAddEvent.handle,
@@ -130,6 +129,26 @@ restricted_packets = {
     packetIDs.client_changeProtocolVersion,
 }
 
+# Packets applied to the user's current match, which are handled
+# by the process owning the match when match actors are enabled
+match_packets = {
+    packetIDs.client_matchChangeSlot,
+    packetIDs.client_matchChangeSettings,
+    packetIDs.client_matchChangePassword,
+    packetIDs.client_matchChangeMods,
+    packetIDs.client_matchReady,
+    packetIDs.client_matchNotReady,
+    packetIDs.client_matchLock,
+    packetIDs.client_matchStart,
+    packetIDs.client_matchLoadComplete,
+    packetIDs.client_matchSkipRequest,
+    packetIDs.client_matchComplete,
+    packetIDs.client_matchTransferHost,
+    packetIDs.client_matchFailed,
+    packetIDs.client_matchChangeTeam,
+    packetIDs.client_invite,
+}
+
 HTML_PAGE = (
     "<html><head><title>Welcome to Akatsuki!</title><style type='text/css'>body{width:30%;background:#222;color:#fff;}</style></head><body><pre>"
     "      _/_/    _/                    _/                          _/        _/   <br>"
@@ -176,7 +195,11 @@ class handler(AsyncRequestHandler):
 
         if requestTokenString is None:
             # No token, first request. Handle login.
-            responseTokenString, responseData = await loginEvent.handle(self)
+            outbox = osuToken.open_outbox()
+            try:
+                responseTokenString, responseData = await loginEvent.handle(self)
+            finally:
+                await osuToken.close_outbox(outbox)
         else:
             packetID: int | None = None
             # Make sure token is valid syntax
@@ -188,29 +211,26 @@ class handler(AsyncRequestHandler):
                 self.write(b"Invalid token")
                 return
 
-            userToken = None  # default value
+            session = None  # default value
+            outbox = None  # default value
             try:
                 # This is not the first packet, send response based on client's request
-                # Packet start position, used to read stacked packets
-                pos = 0
-
-                # Make sure the token exists
-                userToken = await osuToken.get_token(requestTokenString)
-                if userToken is None:
+                # Make sure the token exists, and load it into memory for
+                # the packet handlers to share for the rest of this request
+                session = await osuToken.open_session(requestTokenString)
+                if session is None:
                     raise exceptions.tokenNotFoundException()
 
+                userToken = session.token
+
+                # Hold any packets enqueued by the packet handlers,
+                # so that they can be written to redis all at once
+                outbox = osuToken.open_outbox()
+
                 doLogout = False
-                # Keep reading packets until everything has been read
-                requestDataLen = len(requestData)
-                while pos < requestDataLen:
+                # Read the stacked packets, without copying their data
+                for packetID, packetData in packetHelper.iterPackets(requestData):
                     st = time.perf_counter_ns()
-                    # Get packet from stack starting from new packet
-                    leftData = requestData[pos:]
-
-                    # Get packet ID, data length and data
-                    packetID, dataLength = PACKET_PROTO.unpack(leftData[:7])
-                    assert isinstance(packetID, int) and isinstance(dataLength, int)
-                    packetData = leftData[: dataLength + 7]
 
                     # Stop handling packets on logout
                     if packetID == 2:
@@ -224,7 +244,23 @@ class handler(AsyncRequestHandler):
                                 not osuToken.is_restricted(userToken["privileges"])
                                 or packetID in restricted_packets
                             ):
-                                await bancho_packets[packetID](userToken, packetData)
+                                if (
+                                    settings.APP_MATCH_ACTORS
+                                    and packetID in match_packets
+                                    and userToken["match_id"] is not None
+                                ):
+                                    await match_actors.handle_packet(
+                                        userToken,
+                                        userToken["match_id"],
+                                        packetID,
+                                        packetData,
+                                        bancho_packets[packetID],
+                                    )
+                                else:
+                                    await bancho_packets[packetID](
+                                        userToken,
+                                        packetData,
+                                    )
                         # else:
                         # 	#log.warning(f"Unhandled: {packetID}")
                     else:
@@ -250,11 +286,8 @@ class handler(AsyncRequestHandler):
                             ),
                         )
 
-                    # Update pos so we can read the next stacked packet
-                    # +7 because we add packet ID bytes, unused byte and data length bytes
-                    pos += dataLength + 7
-
                 # Token queue built, send it
+                await osuToken.flush_outbox()
                 responseTokenString = userToken["token_id"]
                 responseData = await stream_messages.read_all_pending_data(
                     userToken["token_id"],
@@ -263,7 +296,6 @@ class handler(AsyncRequestHandler):
                 # on logout event, delete the players token and everything belonging to it
                 if doLogout:
                     await tokenList.deleteToken(userToken["token_id"])
-                    userToken = None  # skip the check below
 
             except exceptions.tokenNotFoundException:
                 # Client thinks it's logged in when it's
@@ -272,25 +304,58 @@ class handler(AsyncRequestHandler):
                     "Server has restarted.",
                 ) + serverPackets.banchoRestart(0)
             finally:
-                if userToken is not None:
+                if outbox is not None:
+                    await osuToken.close_outbox(outbox)
+
+                if session is not None:
                     # Packet handlers may have updated session information, or may have
-                    # deleted the session (e.g. logout packet). Re-fetch it to ensure
-                    # we have the latest state in-memory
-                    userToken = await osuToken.get_token(requestTokenString)
-                    if userToken is not None:
+                    # deleted the session (e.g. logout packet). Write back any changes,
+                    # which also tells us whether the token was kicked meanwhile
+                    latestToken = await osuToken.close_session(
+                        session,
+                        return_fields=["kicked"],
+                    )
+                    if latestToken is not None:
                         # Delete token if kicked
-                        if userToken["kicked"]:
-                            await tokenList.deleteToken(userToken["token_id"])
+                        if latestToken["kicked"]:
+                            await tokenList.deleteToken(session.token["token_id"])
 
         # Send server's response to client
         # We don't use token object because we might not have a token (failed login)
+        compression = None
         if settings.APP_GZIP:
+            # Tiny responses (e.g. idle polls) aren't worth compressing
+            compression = await compressionHelper.compress_response(responseData)
+
+        if compression is not None:
             # First, write the gzipped response
-            self.write(gzip.compress(responseData, settings.APP_GZIP_LEVEL))
+            self.write(compression["data"])
 
             # Then, add gzip headers
             self.add_header("Vary", "Accept-Encoding")
             self.add_header("Content-Encoding", "gzip")
+
+            if glob.amplitude:
+                glob.amplitude.track(
+                    amplitude.BaseEvent(
+                        event_type="response_compressed",
+                        user_id="performance_testing",
+                        device_id=None,
+                        event_properties={
+                            "uncompressed_size": compression["uncompressed_size"],
+                            "compressed_size": compression["compressed_size"],
+                            "compression_ratio": (
+                                compression["compressed_size"]
+                                / compression["uncompressed_size"]
+                            ),
+                            "time_elapsed_ms": round(
+                                compression["compression_time_ms"],
+                                2,
+                            ),
+                            "offloaded": compression["offloaded"],
+                        },
+                    ),
+                )
         else:
             # First, write the response
             self.write(responseData)
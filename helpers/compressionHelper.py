@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict
+
+import settings
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS  # write a gzip header & trailer
+
+# a compressor which is never fed any data, copied for each response
+# so that its settings don't need to be set up from scratch every time
+_compressor_template = zlib.compressobj(
+    settings.APP_GZIP_LEVEL,
+    zlib.DEFLATED,
+    GZIP_WBITS,
+)
+
+_compression_executor: ThreadPoolExecutor | None = None
+
+COMPRESSION_STATS = {
+    "responses": 0,
+    "skipped": 0,
+    "offloaded": 0,
+    "uncompressed_bytes": 0,
+    "compressed_bytes": 0,
+    "compression_time_ms": 0.0,
+}
+
+
+class CompressionResult(TypedDict):
+    data: bytes
+    uncompressed_size: int
+    compressed_size: int
+    compression_time_ms: float
+    offloaded: bool
+
+
+def _get_compression_executor() -> ThreadPoolExecutor:
+    global _compression_executor
+    if _compression_executor is None:
+        _compression_executor = ThreadPoolExecutor(
+            max_workers=settings.APP_GZIP_THREAD_POOL_SIZE,
+            thread_name_prefix="gzip",
+        )
+    return _compression_executor
+
+
+def shutdown() -> None:
+    global _compression_executor
+    if _compression_executor is not None:
+        _compression_executor.shutdown(wait=False)
+        _compression_executor = None
+
+
+def gzip_compress(data: bytes) -> bytes:
+    compressor = _compressor_template.copy()
+    return compressor.compress(data) + compressor.flush()
+
+
+async def compress_response(data: bytes) -> CompressionResult | None:
+    """\
+    Gzip a response body, off of the event loop if it's large.
+    Returns None if the body is too small to be worth compressing.
+    """
+    COMPRESSION_STATS["responses"] += 1
+
+    if len(data) < settings.APP_GZIP_MIN_SIZE:
+        COMPRESSION_STATS["skipped"] += 1
+        return None
+
+    offloaded = len(data) >= settings.APP_GZIP_THREAD_POOL_MIN_SIZE
+
+    st = time.perf_counter_ns()
+    if offloaded:
+        loop = asyncio.get_running_loop()
+        compressed_data = await loop.run_in_executor(
+            _get_compression_executor(),
+            gzip_compress,
+            data,
+        )
+    else:
+        compressed_data = gzip_compress(data)
+    compression_time_ms = (time.perf_counter_ns() - st) / 1000 / 1000
+
+    COMPRESSION_STATS["offloaded"] += offloaded
+    COMPRESSION_STATS["uncompressed_bytes"] += len(data)
+    COMPRESSION_STATS["compressed_bytes"] += len(compressed_data)
+    COMPRESSION_STATS["compression_time_ms"] += compression_time_ms
+
+    return {
+        "data": compressed_data,
+        "uncompressed_size": len(data),
+        "compressed_size": len(compressed_data),
+        "compression_time_ms": compression_time_ms,
+        "offloaded": offloaded,
+    }
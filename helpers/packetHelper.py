@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import struct
+import sys
+from array import array
+from collections.abc import Iterator
 from typing import Any
 from typing import TypedDict
 
@@ -32,18 +35,19 @@ def uleb128Encode(num: int) -> bytearray:
     return arr
 
 
-def uleb128Decode(num: bytes) -> tuple[int, int]:
+def uleb128Decode(num: bytes | memoryview, offset: int = 0) -> tuple[int, int]:
     """
     Decode a uleb128 to int
 
-    :param num: encoded uleb128 int
+    :param num: buffer containing an encoded uleb128 int
+    :param offset: position of the encoded int in `num`
     :return: (value, length)
     """
     shift = 0
     arr = [0, 0]  # value, length
 
     while True:
-        b = num[arr[1]]
+        b = num[offset + arr[1]]
         arr[0] |= (b & 0b01111111) << shift
         arr[1] += 1
 
@@ -68,7 +72,86 @@ _default_packs = {
 }
 
 
-def packData(__data: Any, dataType: int) -> bytes:
+# Packet layouts are compiled on first use into a list of steps, where runs
+# of fixed-width fields are read or written all at once with a single struct,
+# and each variable-width field (strings, int lists, raw bytes) is its own step.
+# (struct, number of fields) for fixed-width runs, (None, data type) otherwise
+PacketLayout = list[tuple[struct.Struct | None, int]]
+
+MAX_COMPILED_LAYOUTS = 4096
+
+_compiled_layouts: dict[tuple[int, ...], PacketLayout] = {}
+
+
+def compileLayout(layout: tuple[int, ...]) -> PacketLayout:
+    """
+    Compile a sequence of data types into the steps needed to read or write it
+
+    :param layout: data types of each field in the packet
+    :return: compiled packet layout
+    """
+    cached = _compiled_layouts.get(layout)
+    if cached is not None:
+        return cached
+
+    compiled: PacketLayout = []
+    runFormat = ""
+    runLength = 0
+    for dataType in layout:
+        if dataType in _default_packs and dataType != dataTypes.STRING:
+            runFormat += _default_packs[dataType].format[1:]
+            runLength += 1
+            continue
+
+        if runLength:
+            compiled.append((struct.Struct("<" + runFormat), runLength))
+            runFormat = ""
+            runLength = 0
+
+        compiled.append((None, dataType))
+
+    if runLength:
+        compiled.append((struct.Struct("<" + runFormat), runLength))
+
+    # layouts are (almost always) static, but guard against unbounded growth
+    if len(_compiled_layouts) >= MAX_COMPILED_LAYOUTS:
+        del _compiled_layouts[next(iter(_compiled_layouts))]
+    _compiled_layouts[layout] = compiled
+    return compiled
+
+
+# (struct, field names, -1) for fixed-width runs,
+# (None, (field name,), data type) otherwise
+PacketReader = list[tuple[struct.Struct | None, tuple[str, ...], int]]
+
+# keyed by the structure's value, since some structures are built per
+# packet (e.g. the slots section of matchSettings), from a few variants
+_compiled_readers: dict[tuple[tuple[str, int], ...], PacketReader] = {}
+
+
+def _compileReader(structure: tuple[tuple[str, int], ...]) -> PacketReader:
+    cached = _compiled_readers.get(structure)
+    if cached is not None:
+        return cached
+
+    compiled: PacketReader = []
+    pos = 0
+    for fmt, arg in compileLayout(tuple([i[1] for i in structure])):
+        if fmt is not None:
+            names = tuple([i[0] for i in structure[pos : pos + arg]])
+            compiled.append((fmt, names, -1))
+            pos += arg
+        else:
+            compiled.append((None, (structure[pos][0],), arg))
+            pos += 1
+
+    if len(_compiled_readers) >= MAX_COMPILED_LAYOUTS:
+        del _compiled_readers[next(iter(_compiled_readers))]
+    _compiled_readers[structure] = compiled
+    return compiled
+
+
+def packData(__data: Any, dataType: int) -> bytes | memoryview:
     """
     Packs a single section of a packet.
 
@@ -77,7 +160,7 @@ def packData(__data: Any, dataType: int) -> bytes:
     :return: packed bytes
     """
     if dataType == dataTypes.BBYTES:
-        assert isinstance(__data, bytes)
+        assert isinstance(__data, (bytes, memoryview))
         return __data
 
     data = bytearray()  # data to return
@@ -85,9 +168,10 @@ def packData(__data: Any, dataType: int) -> bytes:
     # Get right pack Type
     if dataType == dataTypes.INT_LIST:
         # 2 bytes length, 4 bytes each element
-        data += len(__data).to_bytes(2, "little")
-        for i in __data:
-            data += i.to_bytes(4, "little", signed=True)
+        elements = array("i", __data)
+        if sys.byteorder != "little":
+            elements.byteswap()
+        return len(elements).to_bytes(2, "little") + elements.tobytes()
     elif dataType == dataTypes.STRING:
         if __data:
             # real string; \x0b[uleb][string]
@@ -105,8 +189,7 @@ def packData(__data: Any, dataType: int) -> bytes:
     return bytes(data)
 
 
-PKT_HDR_START = struct.Struct("<Hx")
-PKT_HDR_END = struct.Struct("<I")
+PKT_HDR = struct.Struct("<HxI")
 
 
 def buildPacket(
@@ -120,13 +203,29 @@ def buildPacket(
     :param __packetData: packet structure [[data, dataType], [data, dataType], ...]
     :return: packet bytes
     """
-    packetData = bytearray(PKT_HDR_START.pack(packet_id))
+    return wrapPacketBody(packet_id, buildPacketBody(packet_data))
 
-    for i in packet_data:
-        packetData += packData(i[0], i[1])
 
-    packetData[3:3] = PKT_HDR_END.pack(len(packetData) - 3)
-    return bytes(packetData)
+def wrapPacketBody(packet_id: int, body: bytes) -> bytes:
+    """Prefix an already encoded packet body with its packet header."""
+    return PKT_HDR.pack(packet_id, len(body)) + body
+
+
+def buildPacketBody(packet_data: tuple[tuple[Any, int], ...] = ()) -> bytes:
+    """Encode a packet's structure, without its header."""
+    layout = compileLayout(tuple([i[1] for i in packet_data]))
+
+    parts: list[bytes | memoryview] = []
+    pos = 0
+    for fmt, arg in layout:
+        if fmt is not None:
+            parts.append(fmt.pack(*[i[0] for i in packet_data[pos : pos + arg]]))
+            pos += arg
+        else:
+            parts.append(packData(packet_data[pos][0], arg))
+            pos += 1
+
+    return b"".join(parts)
 
 
 class PacketData(TypedDict):
@@ -134,55 +233,89 @@ class PacketData(TypedDict):
     end: int
 
 
+def iterPackets(
+    requestData: bytes | memoryview,
+) -> Iterator[tuple[int, memoryview]]:
+    """
+    Iterate over the packets stacked in a request body, without copying them
+
+    :param requestData: request body
+    :return: (packet ID, packet data) for each packet, where packet data
+            is a view into `requestData`, without the packet header
+    """
+    view = memoryview(requestData)
+    pos = 0
+    while pos < len(view):
+        packetID, dataLength = PKT_HDR.unpack_from(view, pos)
+        start = pos + PKT_HDR.size
+        pos = start + dataLength
+        yield packetID, view[start:pos]
+
+
 def readPacketData(
-    stream: bytes,
+    stream: bytes | memoryview,
     structure: tuple[tuple[str, int], ...],
     *,
-    has_packet_header: bool = True,
+    offset: int = 0,
 ) -> PacketData:
     """
     Read packet data from `stream` according to `structure`
-    :param stream: packet bytes
+    :param stream: packet data, without the packet header
     :param structure: packet structure: [[name, dataType], [name, dataType], ...]
-    :param has_packet_header: 	if True, `stream` has packetID and length bytes.
-                                if False, `stream` has only packet data. Default: True
-    :return: {data, end}
+    :param offset: position in `stream` to start reading from. Default: 0
+    :return: {data, end}, where `end` is a position in `stream`
     """
-    # Read packet ID (first 2 bytes)
     data: dict[str, Any] = {}
 
-    # Skip packet ID and packet length if needed
-    start = end = 7 if has_packet_header else 0
+    start = end = offset
 
     # Read packet
-    for i in structure:
+    for fmt, names, dataType in _compileReader(structure):
         start = end
-        if i[1] == dataTypes.INT_LIST:
+        if fmt is not None:
+            # a run of fixed-width fields
+            if len(names) == 1:
+                data[names[0]] = fmt.unpack_from(stream, start)[0]
+            else:
+                data.update(zip(names, fmt.unpack_from(stream, start)))
+            end = start + fmt.size
+            continue
+
+        name = names[0]
+        if dataType == dataTypes.INT_LIST:
             # 2 bytes length, 4 bytes each element
             length = int.from_bytes(stream[start : start + 2], "little")
 
-            data[i[0]] = []
-            for j in range(length):
-                offs = start + 2 + (4 * j)
-                data[i[0]].append(int.from_bytes(stream[offs : offs + 4], "little"))
+            rawElements = stream[start + 2 : start + 2 + (4 * length)]
+            wholeLength = len(rawElements) - (len(rawElements) % 4)
+
+            elements = array("I")
+            elements.frombytes(rawElements[:wholeLength])
+            if sys.byteorder != "little":
+                elements.byteswap()
+            data[name] = elements.tolist()
+
+            if len(data[name]) < length:
+                # truncated; read a partial element as-is and
+                # missing ones as zero, like we always have
+                data[name].append(int.from_bytes(rawElements[wholeLength:], "little"))
+                data[name].extend([0] * (length - len(data[name])))
 
             # Update end
             end = start + 2 + (4 * length)
-        elif i[1] == dataTypes.STRING:
+        elif dataType == dataTypes.STRING:
             # Check empty string
             if stream[start] != 0:
                 # real string; \x0b[uleb][string]
-                uleb_val, uleb_len = uleb128Decode(stream[start + 1 :])
+                uleb_val, uleb_len = uleb128Decode(stream, start + 1)
                 end = start + uleb_val + uleb_len + 1
 
-                data[i[0]] = stream[start + 1 + uleb_len : end].decode()
+                data[name] = str(stream[start + 1 + uleb_len : end], "utf-8")
             else:
                 # empty string; \x00
-                data[i[0]] = ""
+                data[name] = ""
                 end = start + 1
         else:
-            fmt = _default_packs[i[1]]
-            end = start + fmt.size
-            data[i[0]] = fmt.unpack(stream[start:end])[0]
+            raise ValueError(f"Cannot read packet data of type {dataType}")
 
     return {"data": data, "end": end}
@@ -27,10 +27,19 @@ from handlers import apiServerStatusHandler
 from handlers import apiVerifiedStatusHandler
 from handlers import healthHandler
 from handlers import mainHandler
+from helpers import compressionHelper
 from objects import channelList
 from objects import chatbot
 from objects import glob
+from objects import lobby_snapshot
+from objects import match_actors
+from objects import osuToken
+from objects import redisLock
+from objects import stream_messages
+from objects import stream_mirror
+from objects import stream_watermarks
 from objects import streamList
+from objects import user_packet_cache
 
 SHUTDOWN_EVENT: asyncio.Event | None = None
 
@@ -47,6 +56,13 @@ signal.signal(signal.SIGTERM, handle_shutdown_event)
 async def main() -> int:
     SHUTDOWN_EVENT = asyncio.Event()
     http_server: tornado.httpserver.HTTPServer | None = None
+    stream_notifications_task: asyncio.Task[None] | None = None
+    stream_mirror_task: asyncio.Task[None] | None = None
+    user_packet_cache_task: asyncio.Task[None] | None = None
+    lock_releases_task: asyncio.Task[None] | None = None
+    match_membership_task: asyncio.Task[None] | None = None
+    forwarded_packets_task: asyncio.Task[None] | None = None
+    forwarded_replies_task: asyncio.Task[None] | None = None
     try:
         # TODO: do we need this anymore now with stateless design?
         # (not using filesystem anymore for things like .data/)
@@ -61,6 +77,60 @@ async def main() -> int:
         await streamList.add("staff")
         await streamList.add("lobby")
 
+        # Move any sessions left in the legacy token layout to their own hashes
+        num_migrated_tokens = await osuToken.migrate_legacy_tokens()
+        if num_migrated_tokens:
+            logger.info(
+                "Migrated legacy tokens",
+                extra={"num_tokens": num_migrated_tokens},
+            )
+
+        # Make sure every match is listed for clients joining the lobby
+        await lobby_snapshot.rebuild()
+
+        # Track the latest message in each stream, so idle
+        # client polls can be answered without reading redis
+        stream_notifications_task = asyncio.create_task(
+            stream_watermarks.listen_for_notifications(),
+        )
+
+        # Cache users' presence & stats packets, dropping
+        # them whenever their tokens are updated
+        user_packet_cache_task = asyncio.create_task(
+            user_packet_cache.listen_for_invalidations(),
+        )
+
+        # Wake anyone waiting on a lock as soon as it's released
+        lock_releases_task = asyncio.create_task(
+            redisLock.listen_for_releases(),
+        )
+
+        if settings.APP_STREAM_MIRROR:
+            # Follow the busiest shared streams with a single reader,
+            # and serve client polls of them from memory
+            stream_mirror_task = asyncio.create_task(
+                stream_mirror.follow_streams(
+                    stream_keys=[
+                        stream_messages.make_key(stream_name)
+                        for stream_name in settings.APP_STREAM_MIRROR_STREAMS
+                    ],
+                    max_messages=settings.APP_STREAM_MIRROR_MAX_MESSAGES,
+                ),
+            )
+
+        if settings.APP_MATCH_ACTORS:
+            # Take ownership of a share of the matches, and apply
+            # packets forwarded to us by the other processes
+            match_membership_task = asyncio.create_task(
+                match_actors.maintain_membership(),
+            )
+            forwarded_packets_task = asyncio.create_task(
+                match_actors.process_forwarded_packets(mainHandler.bancho_packets),
+            )
+            forwarded_replies_task = asyncio.create_task(
+                match_actors.listen_for_replies(),
+            )
+
         logger.info(
             "Connecting the in-game chat bot",
             extra={"bot_name": CHATBOT_USER_NAME},
@@ -114,6 +184,30 @@ async def main() -> int:
 
             logger.info("Closed HTTP connections")
 
+        if stream_notifications_task is not None:
+            stream_notifications_task.cancel()
+
+        if stream_mirror_task is not None:
+            stream_mirror_task.cancel()
+
+        if user_packet_cache_task is not None:
+            user_packet_cache_task.cancel()
+
+        if lock_releases_task is not None:
+            lock_releases_task.cancel()
+
+        if match_membership_task is not None:
+            match_membership_task.cancel()
+            await match_actors.leave()
+
+        if forwarded_packets_task is not None:
+            forwarded_packets_task.cancel()
+
+        if forwarded_replies_task is not None:
+            forwarded_replies_task.cancel()
+
+        compressionHelper.shutdown()
+
         await lifecycle.shutdown()
 
         logger.info("Goodbye!")
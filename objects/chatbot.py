@@ -11,6 +11,7 @@ from common.constants import privileges
 from common.log import logger
 from constants import CHATBOT_USER_ID
 from constants import chatbotCommands
+from constants import packetIDs
 from constants import serverPackets
 from objects import channelList
 from objects import glob
@@ -42,14 +43,26 @@ async def connect() -> None:
         token = await tokenList.addToken(CHATBOT_USER_ID)
         assert token is not None
 
-        await osuToken.update_token(token["token_id"], action_id=actions.IDLE)
-        await stream_messages.broadcast_data(
+        await osuToken.update_token(
+            token["token_id"],
+            action_id=actions.IDLE,
+            return_token=False,
+        )
+        await stream_messages.broadcast_latest_data(
             "main",
             await serverPackets.userPanel(CHATBOT_USER_ID),
+            coalesce_key=stream_messages.make_coalesce_key(
+                packetIDs.server_userPanel,
+                CHATBOT_USER_ID,
+            ),
         )
-        await stream_messages.broadcast_data(
+        await stream_messages.broadcast_latest_data(
             "main",
             await serverPackets.userStats(CHATBOT_USER_ID),
+            coalesce_key=stream_messages.make_coalesce_key(
+                packetIDs.server_userStats,
+                CHATBOT_USER_ID,
+            ),
         )
 
         for channel_name in await channelList.getChannelNames():
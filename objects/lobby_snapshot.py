@@ -0,0 +1,132 @@
+"""\
+A prebuilt listing of every match, sent to clients as they join the lobby.
+
+Rather than building a packet for each match whenever someone opens the
+multiplayer screen, each match's (censored) newMatch packet is stored as it
+changes, so that joining the lobby takes a single read.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from common.log import logger
+from constants import packetIDs
+from helpers import packetHelper
+from objects import glob
+from objects import match
+from objects import match_state
+from objects import matchList
+
+if TYPE_CHECKING:
+    from redis.commands.core import AsyncScript
+
+# (hash[match_id, newMatch packet]) bancho:lobby:snapshot
+# (hash[match_id, packet version]) bancho:lobby:snapshot:versions
+
+
+def make_key() -> str:
+    return "bancho:lobby:snapshot"
+
+
+def make_versions_key() -> str:
+    return "bancho:lobby:snapshot:versions"
+
+
+# Store a match's packet, unless a packet built from a newer packet version
+# of the match is already stored, so that slower writers can't overwrite
+# newer packets, nor re-add matches which have since been disposed.
+# KEYS[1]: the lobby snapshot
+# KEYS[2]: the packet versions of the lobby snapshot's packets
+# KEYS[3]: the match's state
+# ARGV[1]: the match's id
+# ARGV[2]: the packet version of the match the packet was built from
+# ARGV[3]: the match's packet
+UPDATE_LOBBY_SNAPSHOT_SCRIPT = """
+if redis.call("EXISTS", KEYS[3]) == 0 then
+    return 0
+end
+local stored_version = redis.call("HGET", KEYS[2], ARGV[1])
+if stored_version and tonumber(stored_version) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call("HSET", KEYS[1], ARGV[1], ARGV[3])
+redis.call("HSET", KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+_update_lobby_snapshot_script: AsyncScript | None = None
+
+
+def _get_update_lobby_snapshot_script() -> AsyncScript:
+    global _update_lobby_snapshot_script
+    if _update_lobby_snapshot_script is None:
+        _update_lobby_snapshot_script = glob.redis.register_script(
+            UPDATE_LOBBY_SNAPSHOT_SCRIPT,
+        )
+    return _update_lobby_snapshot_script
+
+
+async def update_match(
+    match_id: int,
+    packet_version: int,
+    encoded_match_data: bytes,
+) -> None:
+    """Store a match's packet, built from its censored match data at `packet_version`."""
+    update_lobby_snapshot_script = _get_update_lobby_snapshot_script()
+    await update_lobby_snapshot_script(
+        keys=[make_key(), make_versions_key(), match_state.make_key(match_id)],
+        args=[
+            match_id,
+            packet_version,
+            packetHelper.wrapPacketBody(packetIDs.server_newMatch, encoded_match_data),
+        ],
+    )
+
+
+async def remove_match(match_id: int) -> None:
+    async with glob.redis.pipeline() as pipe:
+        await pipe.hdel(make_key(), match_id)  # type: ignore[arg-type]
+        await pipe.hdel(make_versions_key(), match_id)  # type: ignore[arg-type]
+        await pipe.execute()
+
+
+async def get_snapshot() -> bytes:
+    """Returns the newMatch packets of every match, as one buffer."""
+    packets: list[bytes] = await glob.redis.hvals(make_key())
+    return b"".join(packets)
+
+
+async def rebuild() -> None:
+    """Bring every existing match's packet up to date (migrating any legacy matches)."""
+    match_ids = await match.get_match_ids()
+
+    stale_match_ids: set[int] = set()
+    for raw_match_id in await glob.redis.hkeys(make_key()):
+        if int(raw_match_id) not in match_ids:
+            stale_match_ids.add(int(raw_match_id))
+    if stale_match_ids:
+        async with glob.redis.pipeline() as pipe:
+            await pipe.hdel(make_key(), *stale_match_ids)  # type: ignore[arg-type]
+            await pipe.hdel(make_versions_key(), *stale_match_ids)  # type: ignore[arg-type]
+            await pipe.execute()
+
+    for match_id in match_ids:
+        # convert any matches left over from before they were stored as
+        # hashes, disposing of those which can't be (see match_state)
+        if await match_state.is_legacy_match(match_id):
+            if not await match_state.migrate_legacy_match(match_id):
+                logger.warning(
+                    "Disposing of a legacy match which couldn't be migrated",
+                    extra={"match_id": match_id},
+                )
+                await match_state.delete_legacy_match(match_id)
+                await matchList.disposeMatch(match_id)
+                continue
+
+        versioned_match_data = await match.getVersionedMatchData(
+            match_id,
+            censored=True,
+        )
+        if versioned_match_data is not None:
+            await update_match(match_id, *versioned_match_data)
@@ -1,13 +1,12 @@
 from __future__ import annotations
 
+from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime
 from typing import Any
 from typing import TypedDict
 from typing import cast
 
-import orjson
-
 from common.log import logger
 from common.types import UNSET
 from common.types import Unset
@@ -16,25 +15,26 @@ from constants import dataTypes
 from constants import matchModModes
 from constants import matchTeams
 from constants import matchTeamTypes
+from constants import packetIDs
 from constants import serverPackets
 from constants import slotStatuses
 from constants.match_events import MatchEvents
 from helpers import chatHelper as chat
+from helpers import packetHelper
 from helpers.scoreHelper import calculate_accuracy
 from objects import channelList
 from objects import glob
+from objects import lobby_snapshot
 from objects import match
+from objects import match_state
 from objects import matchList
 from objects import osuToken
 from objects import slot
 from objects import stream_messages
 from objects import streamList
-from objects import tokenList
 
 # (set) bancho:matches
-# (json obj) bancho:matches:{match_id}
-# (set? list?) bancho:matches:{match_id}:slots
-# (json obj) bancho:matches:{match_id}:slots:{index}
+# (hash[field, json value]) bancho:matches:{match_id} (see match_state)
 # (set) bancho:matches:{match_id}:referees
 
 
@@ -67,8 +67,7 @@ class Match(TypedDict):
     # referees: set[int]
 
 
-def make_key(match_id: int) -> str:
-    return f"bancho:matches:{match_id}"
+MATCH_FIELDS = list(Match.__annotations__)
 
 
 def make_lock_key(match_id: int) -> str:
@@ -104,9 +103,6 @@ async def create_match(
     match_id = await insert_match(match_name, match_history_private)
     await insert_match_event(match_id, MatchEvents.MATCH_CREATION, user_id=host_user_id)
 
-    await glob.redis.sadd("bancho:matches", match_id)
-    for slot_id in range(16):
-        await slot.create_slot(match_id, slot_id)
     match: Match = {
         "match_id": match_id,
         "match_name": match_name,
@@ -130,7 +126,15 @@ async def create_match(
         "match_history_private": match_history_private,
         "current_game_id": current_game_id,
     }
-    await glob.redis.set(make_key(match_id), orjson.dumps(match))
+
+    # write the match & all of its slots at once
+    state: dict[str, Any] = dict(match)
+    for slot_id in range(slot.NUM_SLOTS):
+        for field, value in slot.make_default_slot().items():
+            state[match_state.make_slot_field(slot_id, field)] = value
+    await match_state.set_fields(match_id, state)
+
+    await glob.redis.sadd("bancho:matches", match_id)
     return match
 
 
@@ -140,11 +144,36 @@ async def get_match_ids() -> set[int]:
 
 
 async def get_match(match_id: int) -> Match | None:
-    raw_match = await glob.redis.get(make_key(match_id))
-    if raw_match is None:
+    fields = await match_state.get_fields(match_id, MATCH_FIELDS)
+    if fields is None:
+        return None
+
+    return cast(Match, fields)
+
+
+async def get_match_and_slots(match_id: int) -> tuple[Match, list[slot.Slot]] | None:
+    """Fetch a match along with all of its slots, in one round trip."""
+    match_and_slots = await _get_versioned_match_and_slots(match_id)
+    if match_and_slots is None:
+        return None
+
+    multiplayer_match, slots, _ = match_and_slots
+    return multiplayer_match, slots
+
+
+async def _get_versioned_match_and_slots(
+    match_id: int,
+) -> tuple[Match, list[slot.Slot], int] | None:
+    fields = await match_state.get_all_fields(match_id)
+    if fields is None:
         return None
 
-    return cast(Match, orjson.loads(raw_match))
+    multiplayer_match = cast(Match, {field: fields[field] for field in MATCH_FIELDS})
+    return (
+        multiplayer_match,
+        slot.get_slots_from_fields(fields),
+        fields["packet_version"],
+    )
 
 
 async def update_match(
@@ -170,65 +199,74 @@ async def update_match(
     creation_time: float | None = None,
     current_game_id: int | None | Unset = UNSET,
 ) -> Match | None:
-    match = await get_match(match_id)
-    if match is None:
-        return None
-
-    if match_name is not None and match["match_name"] != match_name:
-        await update_match_name(match_id, match_name)
+    changes: dict[str, Any] = {}
 
     if match_name is not None:
-        match["match_name"] = match_name
+        current_fields = await match_state.get_fields(match_id, ["match_name"])
+        if current_fields is None:
+            return None
+
+        if current_fields["match_name"] != match_name:
+            await update_match_name(match_id, match_name)
+
+        changes["match_name"] = match_name
     if match_password is not None:
-        match["match_password"] = match_password
+        changes["match_password"] = match_password
     if beatmap_id is not None:
-        match["beatmap_id"] = beatmap_id
+        changes["beatmap_id"] = beatmap_id
     if beatmap_name is not None:
-        match["beatmap_name"] = beatmap_name
+        changes["beatmap_name"] = beatmap_name
     if beatmap_md5 is not None:
-        match["beatmap_md5"] = beatmap_md5
+        changes["beatmap_md5"] = beatmap_md5
     if game_mode is not None:
-        match["game_mode"] = game_mode
+        changes["game_mode"] = game_mode
     if host_user_id is not None:
-        match["host_user_id"] = host_user_id
+        changes["host_user_id"] = host_user_id
     if mods is not None:
-        match["mods"] = mods
+        changes["mods"] = mods
     if match_scoring_type is not None:
-        match["match_scoring_type"] = match_scoring_type
+        changes["match_scoring_type"] = match_scoring_type
     if match_team_type is not None:
-        match["match_team_type"] = match_team_type
+        changes["match_team_type"] = match_team_type
     if match_mod_mode is not None:
-        match["match_mod_mode"] = match_mod_mode
+        changes["match_mod_mode"] = match_mod_mode
     if seed is not None:
-        match["seed"] = seed
+        changes["seed"] = seed
     if is_tourney is not None:
-        match["is_tourney"] = is_tourney
+        changes["is_tourney"] = is_tourney
     if is_locked is not None:
-        match["is_locked"] = is_locked
+        changes["is_locked"] = is_locked
     if is_starting is not None:
-        match["is_starting"] = is_starting
+        changes["is_starting"] = is_starting
     if is_timer_running is not None:
-        match["is_timer_running"] = is_timer_running
+        changes["is_timer_running"] = is_timer_running
     if is_in_progress is not None:
-        match["is_in_progress"] = is_in_progress
+        changes["is_in_progress"] = is_in_progress
     if creation_time is not None:
-        match["creation_time"] = creation_time
+        changes["creation_time"] = creation_time
     if not isinstance(current_game_id, Unset):
-        match["current_game_id"] = current_game_id
+        changes["current_game_id"] = current_game_id
 
-    await glob.redis.set(make_key(match_id), orjson.dumps(match))
-    return match
+    fields = await match_state.update_fields(
+        match_id,
+        changes,
+        return_fields=MATCH_FIELDS,
+    )
+    if fields is None:
+        return None
+
+    return cast(Match, fields)
 
 
 async def delete_match(match_id: int) -> None:
     # TODO: should we throw error when no match exists?
+    # the match's slots are stored alongside it
     async with glob.redis.pipeline() as pipe:
         await pipe.srem("bancho:matches", match_id)
-        await pipe.delete(make_key(match_id))
+        await pipe.delete(match_state.make_key(match_id))
         await pipe.execute()
 
-    # TODO: should devs have to do this separately?
-    await slot.delete_slots(match_id)
+    forget_encoded_match_data(match_id)
 
 
 def create_stream_name(match_id: int) -> str:
@@ -239,25 +277,19 @@ def create_playing_stream_name(match_id: int) -> str:
     return f"multi/{match_id}/playing"
 
 
-async def getMatchData(
-    match_id: int,
-    censored: bool = False,
+def _buildMatchData(
+    multiplayer_match: Match,
+    slots: list[slot.Slot],
+    online_token_ids: set[str],
+    censored: bool,
 ) -> tuple[tuple[object, int], ...]:
     """
     Return binary match data structure for packetHelper
 
-    :param match_id: Match ID
+    :param online_token_ids: which of the slots' tokens still exist
     :param censored: Whether to censor password
     :return:
     """
-    # General match info
-
-    multiplayer_match = await get_match(match_id)
-    assert multiplayer_match is not None
-
-    slots = await slot.get_slots(match_id)
-    assert len(slots) == 16
-
     struct: list[tuple[object, int]] = [
         (multiplayer_match["match_id"], dataTypes.UINT16),
         (int(multiplayer_match["is_in_progress"]), dataTypes.BYTE),
@@ -283,12 +315,9 @@ async def getMatchData(
 
     struct.extend(
         [
-            (await tokenList.getUserIDFromToken(slot["user_token"]), dataTypes.UINT32)
+            (slot["user_id"], dataTypes.UINT32)
             for slot in slots
-            if (
-                slot["user_token"]
-                and await osuToken.get_token(slot["user_token"]) is not None
-            )
+            if slot["user_token"] and slot["user_token"] in online_token_ids
         ],
     )
 
@@ -314,6 +343,88 @@ async def getMatchData(
     return tuple(struct)
 
 
+MAX_CACHED_MATCH_DATA = 4096
+
+# ((match id, censored) -> (match packet version, encoded match data))
+_encoded_match_data: OrderedDict[tuple[int, bool], tuple[int, bytes]] = OrderedDict()
+
+MATCH_DATA_CACHE_STATS = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+def _cache_encoded_match_data(
+    match_id: int,
+    censored: bool,
+    version: int,
+    encoded_match_data: bytes,
+) -> None:
+    _encoded_match_data[(match_id, censored)] = (version, encoded_match_data)
+    _encoded_match_data.move_to_end((match_id, censored))
+
+    if len(_encoded_match_data) > MAX_CACHED_MATCH_DATA:
+        _encoded_match_data.popitem(last=False)
+
+
+async def getEncodedMatchData(match_id: int, censored: bool = False) -> bytes | None:
+    """\
+    Return the encoded body of the match's packets, built at most once per
+    packet version of the match. Returns None if the match doesn't exist.
+    """
+    versioned_match_data = await getVersionedMatchData(match_id, censored)
+    if versioned_match_data is None:
+        return None
+    return versioned_match_data[1]
+
+
+async def getVersionedMatchData(
+    match_id: int,
+    censored: bool = False,
+) -> tuple[int, bytes] | None:
+    """Like getEncodedMatchData, along with the packet version it was built from."""
+    version = await match_state.get_packet_version(match_id)
+    if version is None:
+        return None
+
+    cached = _encoded_match_data.get((match_id, censored))
+    if cached is not None and cached[0] == version:
+        MATCH_DATA_CACHE_STATS["hits"] += 1
+        _encoded_match_data.move_to_end((match_id, censored))
+        return cached
+
+    MATCH_DATA_CACHE_STATS["misses"] += 1
+
+    match_and_slots = await _get_versioned_match_and_slots(match_id)
+    if match_and_slots is None:
+        return None
+
+    multiplayer_match, slots, version = match_and_slots
+    online_token_ids = await osuToken.get_existing_token_ids(
+        [slot["user_token"] for slot in slots if slot["user_token"]],
+    )
+
+    # both variants are usually needed together (e.g. in sendUpdates)
+    encoded_match_data: dict[bool, bytes] = {}
+    for _censored in (False, True):
+        encoded_match_data[_censored] = packetHelper.buildPacketBody(
+            _buildMatchData(multiplayer_match, slots, online_token_ids, _censored),
+        )
+        _cache_encoded_match_data(
+            match_id,
+            _censored,
+            version,
+            encoded_match_data[_censored],
+        )
+
+    return version, encoded_match_data[censored]
+
+
+def forget_encoded_match_data(match_id: int) -> None:
+    _encoded_match_data.pop((match_id, False), None)
+    _encoded_match_data.pop((match_id, True), None)
+
+
 async def setHost(match_id: int, new_host_id: int) -> bool:
     """
     Set room host to newHost and send him host packet
@@ -492,7 +603,10 @@ async def toggleSlotLocked(match_id: int, slot_id: int) -> None:
         newStatus = slotStatuses.LOCKED
 
     # Send updated settings to kicked user, so he returns to lobby
-    if _slot["user_token"] and _slot["user_token"] in await osuToken.get_token_ids():
+    if _slot["user_token"] and await osuToken.is_user_token(
+        _slot["user_id"],
+        _slot["user_token"],
+    ):
         packet_data = await serverPackets.updateMatch(match_id)
         if packet_data is None:
             # TODO: is this correct behaviour?
@@ -708,19 +822,23 @@ async def resetSlots(match_id: int) -> None:
     # TODO: make sure slot_id is right?
     # not sure about the order.
     # also not sure we start from 0.
-    for slot_id, _slot in enumerate(slots):
-        if _slot["user_token"] is not None and _slot["status"] == slotStatuses.PLAYING:
-            await slot.update_slot(
-                match_id,
-                slot_id,
-                status=slotStatuses.NOT_READY,
-                loaded=False,
-                skip=False,
-                complete=False,
-                score=0,
-                failed=False,
-                passed=True,
-            )
+    await slot.update_slots(
+        match_id,
+        {
+            slot_id: {
+                "status": slotStatuses.NOT_READY,
+                "loaded": False,
+                "skip": False,
+                "complete": False,
+                "score": 0,
+                "failed": False,
+                "passed": True,
+            }
+            for slot_id, _slot in enumerate(slots)
+            if _slot["user_token"] is not None
+            and _slot["status"] == slotStatuses.PLAYING
+        },
+    )
 
 
 async def getUserSlotID(match_id: int, user_id: int) -> int | None:
@@ -874,6 +992,7 @@ async def userLeft(match_id: int, token_id: str, disposeMatch: bool = True) -> N
         token_id,
         match_id=None,
         match_slot_id=None,
+        return_token=False,
     )
 
     await insert_match_event(
@@ -954,29 +1073,28 @@ async def userChangeSlot(match_id: int, user_id: int, new_slot_id: int) -> bool:
     # TODO: do we need to deepcopy this after the stateless refactor?
     old_data = deepcopy(slots[old_slot_id])
 
-    # Free old slot
-    await setSlot(
-        match_id,
-        old_slot_id,
-        status=slotStatuses.FREE,
-        team=0,
-        user_token=None,
-        mods=0,
-        loaded=False,
-        skip=False,
-        complete=False,
-        user_id=-1,
-    )
-
-    # Occupy new slot
-    await setSlot(
+    # Free old slot & occupy new slot
+    await slot.update_slots(
         match_id,
-        new_slot_id,
-        status=old_data["status"],
-        team=old_data["team"],
-        user_token=old_data["user_token"],
-        mods=old_data["mods"],
-        user_id=old_data["user_id"],
+        {
+            old_slot_id: {
+                "status": slotStatuses.FREE,
+                "team": 0,
+                "user_token": None,
+                "mods": 0,
+                "loaded": False,
+                "skip": False,
+                "complete": False,
+                "user_id": -1,
+            },
+            new_slot_id: {
+                "status": old_data["status"],
+                "team": old_data["team"],
+                "user_token": old_data["user_token"],
+                "mods": old_data["mods"],
+                "user_id": old_data["user_id"],
+            },
+        },
     )
 
     # Send updated match data
@@ -1061,9 +1179,9 @@ async def transferHost(match_id: int, slot_id: int) -> None:
     assert _slot is not None
 
     # Make sure there is someone in that slot
-    if (
-        not _slot["user_token"]
-        or _slot["user_token"] not in await osuToken.get_token_ids()
+    if not _slot["user_token"] or not await osuToken.is_user_token(
+        _slot["user_id"],
+        _slot["user_token"],
     ):
         return
 
@@ -1196,9 +1314,17 @@ async def sendUpdates(match_id: int) -> None:
         stream_name = create_stream_name(match_id)
         await stream_messages.broadcast_data(stream_name, uncensored_data)
 
-    censored_data = await serverPackets.updateMatch(match_id, censored=True)
+    censored_data = await getVersionedMatchData(match_id, censored=True)
     if censored_data is not None:
-        await stream_messages.broadcast_data("lobby", censored_data)
+        version, encoded_match_data = censored_data
+        await stream_messages.broadcast_data(
+            "lobby",
+            packetHelper.wrapPacketBody(
+                packetIDs.server_updateMatch,
+                encoded_match_data,
+            ),
+        )
+        await lobby_snapshot.update_match(match_id, version, encoded_match_data)
     else:
         logger.error(
             f"Failed to send updates to a multiplayer match",
@@ -1265,23 +1391,24 @@ async def start(match_id: int) -> bool:
     slots = await slot.get_slots(match_id)
     assert len(slots) == 16
 
+    playing_slot_changes: dict[int, dict[str, Any]] = {}
     for slot_id, _slot in enumerate(slots):
         if _slot["user_token"] is None:
             continue
 
         user_token = await osuToken.get_token(_slot["user_token"])
         if user_token is not None:
-            await slot.update_slot(
-                match_id,
-                slot_id,
-                status=slotStatuses.PLAYING,
-                loaded=False,
-                skip=False,
-                complete=False,
-            )
+            playing_slot_changes[slot_id] = {
+                "status": slotStatuses.PLAYING,
+                "loaded": False,
+                "skip": False,
+                "complete": False,
+            }
 
             await osuToken.joinStream(user_token["token_id"], playing_stream_name)
 
+    await slot.update_slots(match_id, playing_slot_changes)
+
     # Send match start packet
     await stream_messages.broadcast_data(
         playing_stream_name,
@@ -1360,32 +1487,45 @@ async def initializeTeams(match_id: int) -> None:
         matchTeamTypes.TAG_TEAM_VS,
     }:
         # Set teams
-        for slot_id in range(len(slots)):
-            new_team = matchTeams.RED if slot_id % 2 == 0 else matchTeams.BLUE
-            await slot.update_slot(match_id, slot_id, team=new_team)
+        await slot.update_slots(
+            match_id,
+            {
+                slot_id: {
+                    "team": matchTeams.RED if slot_id % 2 == 0 else matchTeams.BLUE,
+                }
+                for slot_id in range(len(slots))
+            },
+        )
     else:
         # Reset teams
-        for slot_id in range(len(slots)):
-            new_team = matchTeams.NO_TEAM
-            await slot.update_slot(match_id, slot_id, team=new_team)
+        await slot.update_slots(
+            match_id,
+            {slot_id: {"team": matchTeams.NO_TEAM} for slot_id in range(len(slots))},
+        )
 
 
 async def resetMods(match_id: int) -> None:
     slots = await slot.get_slots(match_id)
     assert len(slots) == 16
 
-    for slot_id in range(len(slots)):
-        await slot.update_slot(match_id, slot_id, mods=0)
+    await slot.update_slots(
+        match_id,
+        {slot_id: {"mods": 0} for slot_id in range(len(slots))},
+    )
 
 
 async def resetReady(match_id: int) -> None:
     slots = await slot.get_slots(match_id)
     assert len(slots) == 16
 
-    for slot_id, _slot in enumerate(slots):
-        if _slot["status"] == slotStatuses.READY:
-            new_status = slotStatuses.NOT_READY
-            await slot.update_slot(match_id, slot_id, status=new_status)
+    await slot.update_slots(
+        match_id,
+        {
+            slot_id: {"status": slotStatuses.NOT_READY}
+            for slot_id, _slot in enumerate(slots)
+            if _slot["status"] == slotStatuses.READY
+        },
+    )
 
 
 async def sendReadyStatus(match_id: int) -> None:
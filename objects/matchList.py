@@ -8,6 +8,7 @@ from constants import matchScoringTypes
 from constants import matchTeamTypes
 from constants import serverPackets
 from objects import channelList
+from objects import lobby_snapshot
 from objects import match
 from objects import osuToken
 from objects import slot
@@ -76,6 +77,17 @@ async def createMatch(
         instance=True,
     )
 
+    # List the match for anyone joining the lobby
+    versioned_match_data = await match.getVersionedMatchData(
+        multiplayer_match["match_id"],
+        censored=True,
+    )
+    if versioned_match_data is not None:
+        await lobby_snapshot.update_match(
+            multiplayer_match["match_id"],
+            *versioned_match_data,
+        )
+
     return multiplayer_match
 
 
@@ -90,13 +102,9 @@ async def disposeMatch(match_id: int) -> None:
     if match_id not in await match.get_match_ids():
         return
 
-    # Get match and disconnect all players
-    multiplayer_match = await match.get_match(match_id)
-    assert multiplayer_match is not None
-
+    # Disconnect all players (unless the match's state is already gone,
+    # e.g. for a legacy match which couldn't be migrated)
     slots = await slot.get_slots(match_id)
-    assert len(slots) == 16
-
     for _slot in slots:
         _token = await osuToken.get_token_by_user_id(_slot["user_id"])
         if _token is not None:
@@ -127,6 +135,9 @@ async def disposeMatch(match_id: int) -> None:
     await stream_messages.broadcast_data("lobby", serverPackets.disposeMatch(match_id))
     await match.delete_match(match_id)
 
+    # (after the match is deleted, so that it can't be re-listed)
+    await lobby_snapshot.remove_match(match_id)
+
 
 # deleting this code 2022-12-30 because
 # https://twitter.com/elonmusk/status/1606624671100997634?cxt=HHwWhMDUhYmo8MssAAAA
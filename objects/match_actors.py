@@ -0,0 +1,431 @@
+"""\
+Ownership of multiplayer matches by a single process ("match actor mode").
+
+Each match is owned by one of the live bancho-service processes, chosen by
+consistent hashing of its id over a ring of those processes. Packets applied
+to a match are forwarded to its owner (unless we are the owner), which
+applies each match's packets one at a time, in the order they arrived.
+
+Rather than taking the match's lock for every packet, the owner holds it
+for as long as it has packets for the match to apply, handing it over
+between packets whenever anything else is waiting for it (e.g. chat
+commands, which aren't forwarded, or a process with an outdated view of the
+ring). This keeps match state consistent even while ownership of a match is
+changing hands.
+
+Senders wait for the owner's reply over pubsub, and each forwarded packet
+can only be applied until it expires in redis (or its sender gives up on
+it), so that a sender which has stopped waiting can't have its packets
+applied out of order.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import time
+import uuid
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from typing import TypedDict
+
+import orjson
+
+from common.log import logger
+from objects import glob
+from objects import match
+from objects import osuToken
+from objects import redisLock
+from objects import stream_watermarks
+
+# (sorted set[process id, unix heartbeat time]) bancho:match_actors:processes
+# (list[json packet]) bancho:match_actors:{process_id}:inbox
+# (string) bancho:match_actors:forwarded:{reply_id}, while it may be applied
+# (channel[reply id]) bancho:match_actors:{process_id}:replies
+
+PROCESS_ID = uuid.uuid4().hex
+
+HEARTBEAT_INTERVAL = 5  # in seconds
+# how long a process may go without a heartbeat before it's considered dead
+PROCESS_EXPIRY = 15  # in seconds
+# points on the ring for each process, to spread matches evenly
+VIRTUAL_NODES = 100
+
+# how long to wait for the owner of a match to apply a forwarded packet
+FORWARD_TIMEOUT = 5  # in seconds
+INBOX_BLOCK_TIME = 1  # in seconds
+RECONNECT_DELAY = 1  # in seconds
+
+# how long to keep holding a match's lock after applying its last packet
+IDLE_RELEASE_DELAY = 0.1  # in seconds
+# how often to extend our hold of a match's lock
+LOCK_EXTEND_INTERVAL = 0.25  # in seconds
+
+PacketHandler = Callable[[osuToken.Token, memoryview], Awaitable[None]]
+
+
+class ForwardedPacket(TypedDict):
+    match_id: int
+    packet_id: int
+    token_id: str
+    packet_data: str  # hex
+    reply_id: str
+    reply_to: str  # process id
+
+
+def make_processes_key() -> str:
+    return "bancho:match_actors:processes"
+
+
+def make_inbox_key(process_id: str) -> str:
+    return f"bancho:match_actors:{process_id}:inbox"
+
+
+def make_forwarded_key(reply_id: str) -> str:
+    return f"bancho:match_actors:forwarded:{reply_id}"
+
+
+def make_replies_channel(process_id: str) -> str:
+    return f"bancho:match_actors:{process_id}:replies"
+
+
+# the ring
+
+# (hash, process id), sorted by hash
+_ring: list[tuple[int, str]] = []
+_ring_process_ids: list[str] = []
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(),
+        "big",
+    )
+
+
+def _build_ring(process_ids: list[str]) -> None:
+    global _ring, _ring_process_ids
+    _ring = sorted(
+        (_hash(f"{process_id}:{i}"), process_id)
+        for process_id in process_ids
+        for i in range(VIRTUAL_NODES)
+    )
+    _ring_process_ids = process_ids
+
+
+def get_owner(match_id: int) -> str | None:
+    """Returns the id of the process owning the match, if we know of any."""
+    if not _ring:
+        return None
+
+    i = bisect.bisect(_ring, (_hash(str(match_id)), ""))
+    return _ring[i % len(_ring)][1]
+
+
+async def maintain_membership() -> None:
+    """Keep us (and our view of the ring) alive, for the lifetime of the process."""
+    while True:
+        try:
+            now = time.time()
+            async with glob.redis.pipeline() as pipe:
+                await pipe.zadd(make_processes_key(), {PROCESS_ID: now})
+                await pipe.zremrangebyscore(
+                    make_processes_key(),
+                    "-inf",
+                    now - PROCESS_EXPIRY,
+                )
+                await pipe.zrange(make_processes_key(), 0, -1)
+                _, _, raw_process_ids = await pipe.execute()
+
+            process_ids = sorted(x.decode() for x in raw_process_ids)
+            if process_ids != _ring_process_ids:
+                logger.info(
+                    "Match owners changed",
+                    extra={"process_ids": process_ids},
+                )
+                _build_ring(process_ids)
+        except asyncio.CancelledError:
+            _build_ring([])
+            raise
+        except Exception:
+            logger.exception("Failed to update match owners")
+
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def leave() -> None:
+    """Stop owning matches, handing them over to the remaining processes."""
+    _build_ring([])
+    await glob.redis.zrem(make_processes_key(), PROCESS_ID)
+
+
+# owned matches
+
+
+class MatchActor:
+    """Applies a match's packets one at a time, while holding its lock."""
+
+    def __init__(self, match_id: int) -> None:
+        self.match_id = match_id
+        self.lock_key = match.make_lock_key(match_id)
+        self.pending = 0
+        self._turns = asyncio.Lock()
+        self._lock: redisLock.redisLock | None = None
+        self._lock_extended_at = 0.0
+        self._idle_release: asyncio.TimerHandle | None = None
+
+    @asynccontextmanager
+    async def turn(self) -> AsyncIterator[None]:
+        """Wait for our turn to apply something to the match."""
+        self.pending += 1
+        if self._idle_release is not None:
+            self._idle_release.cancel()
+            self._idle_release = None
+
+        try:
+            async with self._turns:
+                await self._hold_lock()
+                with redisLock.held(self.lock_key):
+                    yield
+        finally:
+            self.pending -= 1
+            if self.pending == 0:
+                self._idle_release = asyncio.get_running_loop().call_later(
+                    IDLE_RELEASE_DELAY,
+                    self._release_if_idle,
+                )
+
+    async def _hold_lock(self) -> None:
+        if self._lock is not None:
+            # let anyone else waiting for the match take their turn
+            if await self._lock.is_contended():
+                lock, self._lock = self._lock, None
+                await lock.release()
+            elif time.monotonic() - self._lock_extended_at >= LOCK_EXTEND_INTERVAL:
+                if not await self._lock.extend():
+                    lock, self._lock = self._lock, None
+                    await lock.release()
+                else:
+                    self._lock_extended_at = time.monotonic()
+
+        if self._lock is None:
+            lock = redisLock.redisLock(self.lock_key)
+            await lock.acquire()
+            self._lock = lock
+            self._lock_extended_at = time.monotonic()
+
+    def _release_if_idle(self) -> None:
+        self._idle_release = None
+        if self.pending:
+            return
+
+        _actors.pop(self.match_id, None)
+        if self._lock is not None:
+            lock, self._lock = self._lock, None
+            task = asyncio.create_task(lock.release())
+            _release_tasks.add(task)
+            task.add_done_callback(_release_tasks.discard)
+
+
+# (match id -> actor), for matches with packets being applied
+_actors: dict[int, MatchActor] = {}
+_release_tasks: set[asyncio.Task[None]] = set()
+
+
+# (reply id -> future set once the owner has applied the packet), for
+# packets we've forwarded
+_reply_futures: dict[str, asyncio.Future[None]] = {}
+
+_subscribed = False
+
+
+def _get_actor(match_id: int) -> MatchActor:
+    actor = _actors.get(match_id)
+    if actor is None:
+        actor = _actors[match_id] = MatchActor(match_id)
+    return actor
+
+
+async def handle_packet(
+    token: osuToken.Token,
+    match_id: int,
+    packet_id: int,
+    packet_data: memoryview,
+    handler: PacketHandler,
+) -> None:
+    """Apply a packet to a match, on the process which owns it."""
+    owner = get_owner(match_id)
+    # (without our replies channel, we'd have no way to know when the owner
+    # is done; the match's lock keeps it consistent if we apply it ourselves)
+    if owner is None or owner == PROCESS_ID or not _subscribed:
+        async with _get_actor(match_id).turn():
+            await handler(token, packet_data)
+        return
+
+    # the owner will read the token from redis, and send its packets directly
+    await osuToken.sync_session(token["token_id"])
+    await osuToken.flush_outbox()
+
+    reply_id = uuid.uuid4().hex
+    forwarded_packet: ForwardedPacket = {
+        "match_id": match_id,
+        "packet_id": packet_id,
+        "token_id": token["token_id"],
+        "packet_data": packet_data.hex(),
+        "reply_id": reply_id,
+        "reply_to": PROCESS_ID,
+    }
+    reply = _reply_futures[reply_id] = asyncio.get_running_loop().create_future()
+    try:
+        async with glob.redis.pipeline() as pipe:
+            # (measured by redis, rather than by our clock or the owner's)
+            await pipe.set(
+                make_forwarded_key(reply_id),
+                1,
+                px=FORWARD_TIMEOUT * 1000,
+            )
+            await pipe.rpush(make_inbox_key(owner), orjson.dumps(forwarded_packet))
+            await pipe.expire(make_inbox_key(owner), FORWARD_TIMEOUT)
+            await pipe.execute()
+
+        try:
+            await asyncio.wait_for(reply, FORWARD_TIMEOUT)
+        except asyncio.TimeoutError:
+            # stop the owner from applying it, if it hasn't already begun
+            cancelled = await glob.redis.delete(make_forwarded_key(reply_id))
+            logger.warning(
+                "Timed out forwarding a packet to the owner of a match",
+                extra={
+                    "match_id": match_id,
+                    "packet_id": packet_id,
+                    "owner": owner,
+                    "applying": cancelled == 0,
+                },
+            )
+    finally:
+        _reply_futures.pop(reply_id, None)
+
+    # pick up any changes the owner made to the token, and don't trust what
+    # we knew of its streams, since the owner's notifications may still be
+    # on their way to us
+    await osuToken.sync_session(token["token_id"])
+    stream_watermarks.forget_token(token["token_id"])
+
+
+async def _apply_forwarded_packet(
+    forwarded_packet: ForwardedPacket,
+    handler: PacketHandler,
+) -> None:
+    try:
+        async with _get_actor(forwarded_packet["match_id"]).turn():
+            # the sender has stopped waiting for us, and may have since sent
+            # the match more packets; applying this one now would reorder them
+            if not await glob.redis.delete(
+                make_forwarded_key(forwarded_packet["reply_id"]),
+            ):
+                logger.warning(
+                    "Dropped a forwarded match packet which had expired",
+                    extra={
+                        "match_id": forwarded_packet["match_id"],
+                        "packet_id": forwarded_packet["packet_id"],
+                    },
+                )
+                return
+
+            session = await osuToken.open_session(forwarded_packet["token_id"])
+            outbox = osuToken.open_outbox()
+            try:
+                if session is not None:
+                    await handler(
+                        session.token,
+                        memoryview(bytes.fromhex(forwarded_packet["packet_data"])),
+                    )
+            finally:
+                await osuToken.close_outbox(outbox)
+                if session is not None:
+                    await osuToken.close_session(session)
+    finally:
+        # reply even if the packet failed, so the sender doesn't wait it out
+        await glob.redis.publish(
+            make_replies_channel(forwarded_packet["reply_to"]),
+            forwarded_packet["reply_id"],
+        )
+
+
+async def _apply_forwarded_packet_safely(
+    forwarded_packet: ForwardedPacket,
+    handler: PacketHandler,
+) -> None:
+    try:
+        await _apply_forwarded_packet(forwarded_packet, handler)
+    except Exception:
+        logger.exception(
+            "Failed to apply a forwarded match packet",
+            extra={
+                "match_id": forwarded_packet["match_id"],
+                "packet_id": forwarded_packet["packet_id"],
+            },
+        )
+
+
+async def process_forwarded_packets(handlers: dict[int, PacketHandler]) -> None:
+    """Apply packets forwarded to us by other processes, for the lifetime of the process."""
+    tasks: set[asyncio.Task[None]] = set()
+    while True:
+        try:
+            item = await glob.redis.blpop(
+                [make_inbox_key(PROCESS_ID)],
+                INBOX_BLOCK_TIME,
+            )
+            if item is None:
+                continue
+
+            forwarded_packet: ForwardedPacket = orjson.loads(item[1])
+
+            # each packet waits for its turn in its own task, in the order
+            # they arrived, so that one busy match doesn't hold up the rest
+            task = asyncio.create_task(
+                _apply_forwarded_packet_safely(
+                    forwarded_packet,
+                    handlers[forwarded_packet["packet_id"]],
+                ),
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Lost connection while reading forwarded match packets")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+def _reset() -> None:
+    global _subscribed
+    _subscribed = False
+    # (anyone whose reply we miss waits it out, and then gives up on the packet)
+
+
+async def listen_for_replies() -> None:
+    """Wake senders as the owners reply to their packets, for the lifetime of the process."""
+    global _subscribed
+    while True:
+        try:
+            async with glob.redis.pubsub() as pubsub:
+                await pubsub.subscribe(make_replies_channel(PROCESS_ID))
+                async for item in pubsub.listen():
+                    if item["type"] == "subscribe":
+                        _subscribed = True
+                    elif item["type"] == "message":
+                        reply = _reply_futures.pop(item["data"].decode(), None)
+                        if reply is not None and not reply.done():
+                            reply.set_result(None)
+        except asyncio.CancelledError:
+            _reset()
+            raise
+        except Exception:
+            logger.exception("Lost subscription to forwarded match packet replies")
+            _reset()
+            await asyncio.sleep(RECONNECT_DELAY)
@@ -0,0 +1,364 @@
+"""\
+Storage of a multiplayer match's state, as a single redis hash.
+
+The match's own fields, and the fields of each of its slots (prefixed with
+"slots:{slot_id}:"), are stored as json values in the same hash, so that a
+match can be read with one command, and changes to any number of its slots
+are applied atomically.
+
+Every change to a match increments its "version" field, and changes to the
+fields its packets are built from also increment its "packet_version", so
+that its encoded packets can be cached until they would next differ (rather
+than e.g. until the next score update).
+
+Matches were previously stored as a json string per match, and per slot (at
+"bancho:matches:{match_id}:slots:{slot_id}"); any left over from before are
+converted to this layout by `migrate_legacy_match` as the service starts.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from typing import Any
+
+import orjson
+
+from objects import glob
+
+if TYPE_CHECKING:
+    from redis.commands.core import AsyncScript
+
+# (hash[field, json value]) bancho:matches:{match_id}
+
+# the layout matches were stored in previously
+LEGACY_NUM_SLOTS = 16
+
+# the fields of a match (and of its slots) which its packets are built from
+# (see match._buildMatchData), along with the slots' tokens, whose liveness
+# decides which users are listed
+PACKET_MATCH_FIELDS = frozenset(
+    {
+        "match_id",
+        "is_in_progress",
+        "mods",
+        "match_name",
+        "match_password",
+        "beatmap_name",
+        "beatmap_id",
+        "beatmap_md5",
+        "host_user_id",
+        "game_mode",
+        "match_scoring_type",
+        "match_team_type",
+        "match_mod_mode",
+        "seed",
+    },
+)
+PACKET_SLOT_FIELDS = frozenset({"status", "team", "user_id", "user_token", "mods"})
+
+
+def make_key(match_id: int) -> str:
+    return f"bancho:matches:{match_id}"
+
+
+def make_slot_field(slot_id: int, field: str) -> str:
+    return f"slots:{slot_id}:{field}"
+
+
+def make_legacy_slot_key(match_id: int, slot_id: int) -> str:
+    return f"bancho:matches:{match_id}:slots:{slot_id}"
+
+
+def is_packet_field(field: str) -> bool:
+    if field.startswith("slots:"):
+        return field.rsplit(":", 1)[1] in PACKET_SLOT_FIELDS
+    return field in PACKET_MATCH_FIELDS
+
+
+def _serialize_fields(fields: dict[str, Any]) -> dict[str, bytes]:
+    return {field: orjson.dumps(value) for field, value in fields.items()}
+
+
+def _deserialize_fields(
+    fields: list[str],
+    raw_values: list[bytes | None],
+) -> dict[str, Any] | None:
+    values: dict[str, Any] = {}
+    for field, raw_value in zip(fields, raw_values):
+        if raw_value is None:
+            return None
+        values[field] = orjson.loads(raw_value)
+    return values
+
+
+# Apply a set of field changes to a match, but only if it still exists,
+# bump its version (and its packet version, if any of the fields its packets
+# are built from now differ), and return some of its fields in the same
+# round trip.
+# KEYS[1]: the match's hash
+# ARGV[1]: the number of fields to return (n)
+# ARGV[2]: the number of changed fields which its packets are built from (m)
+# ARGV[3..n+2]: the fields to return, after the changes are applied
+# ARGV[n+3..]: the changed fields and values, the first m of which are
+#              those its packets are built from
+UPDATE_MATCH_STATE_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return false
+end
+local num_return_fields = tonumber(ARGV[1])
+local num_packet_fields = tonumber(ARGV[2])
+local changes_start = num_return_fields + 3
+if #ARGV >= changes_start then
+    local packet_changed = false
+    for i = changes_start, changes_start + 2 * num_packet_fields - 1, 2 do
+        if redis.call("HGET", KEYS[1], ARGV[i]) ~= ARGV[i + 1] then
+            packet_changed = true
+            break
+        end
+    end
+    redis.call("HSET", KEYS[1], unpack(ARGV, changes_start))
+    redis.call("HINCRBY", KEYS[1], "version", 1)
+    if packet_changed then
+        redis.call("HINCRBY", KEYS[1], "packet_version", 1)
+    end
+end
+if num_return_fields == 0 then
+    return {}
+end
+return redis.call("HMGET", KEYS[1], unpack(ARGV, 3, num_return_fields + 2))
+"""
+
+_update_match_state_script: AsyncScript | None = None
+
+
+def _get_update_match_state_script() -> AsyncScript:
+    global _update_match_state_script
+    if _update_match_state_script is None:
+        _update_match_state_script = glob.redis.register_script(
+            UPDATE_MATCH_STATE_SCRIPT,
+        )
+    return _update_match_state_script
+
+
+# Delete some of a match's fields, and bump its versions if any existed.
+# KEYS[1]: the match's hash
+# ARGV[1..]: the fields to delete
+DELETE_MATCH_FIELDS_SCRIPT = """
+if redis.call("HDEL", KEYS[1], unpack(ARGV)) > 0 then
+    redis.call("HINCRBY", KEYS[1], "version", 1)
+    redis.call("HINCRBY", KEYS[1], "packet_version", 1)
+end
+"""
+
+_delete_match_fields_script: AsyncScript | None = None
+
+
+def _get_delete_match_fields_script() -> AsyncScript:
+    global _delete_match_fields_script
+    if _delete_match_fields_script is None:
+        _delete_match_fields_script = glob.redis.register_script(
+            DELETE_MATCH_FIELDS_SCRIPT,
+        )
+    return _delete_match_fields_script
+
+
+# Bump a match's packet version, but only if it still exists.
+# KEYS[1]: the match's hash
+BUMP_PACKET_VERSION_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+redis.call("HINCRBY", KEYS[1], "packet_version", 1)
+return 1
+"""
+
+_bump_packet_version_script: AsyncScript | None = None
+
+
+def _get_bump_packet_version_script() -> AsyncScript:
+    global _bump_packet_version_script
+    if _bump_packet_version_script is None:
+        _bump_packet_version_script = glob.redis.register_script(
+            BUMP_PACKET_VERSION_SCRIPT,
+        )
+    return _bump_packet_version_script
+
+
+# Replace a match stored in the legacy layout with its hash, but only if
+# it hasn't changed (nor been converted) since it was read.
+# KEYS[1]: the match's key
+# KEYS[2..]: the match's legacy slot keys
+# ARGV[1]: the match's legacy json, as it was read
+# ARGV[2..]: the match's fields and values
+MIGRATE_LEGACY_MATCH_SCRIPT = """
+if redis.call("TYPE", KEYS[1]).ok ~= "string" then
+    return 0
+end
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call("DEL", unpack(KEYS))
+redis.call("HSET", KEYS[1], unpack(ARGV, 2))
+redis.call("HSET", KEYS[1], "version", 1, "packet_version", 1)
+return 1
+"""
+
+_migrate_legacy_match_script: AsyncScript | None = None
+
+
+def _get_migrate_legacy_match_script() -> AsyncScript:
+    global _migrate_legacy_match_script
+    if _migrate_legacy_match_script is None:
+        _migrate_legacy_match_script = glob.redis.register_script(
+            MIGRATE_LEGACY_MATCH_SCRIPT,
+        )
+    return _migrate_legacy_match_script
+
+
+async def set_fields(match_id: int, fields: dict[str, Any]) -> None:
+    """Write fields to a match, creating it if it doesn't exist."""
+    async with glob.redis.pipeline() as pipe:
+        await pipe.hset(make_key(match_id), mapping=_serialize_fields(fields))  # type: ignore[arg-type]
+        await pipe.hincrby(make_key(match_id), "version", 1)
+        await pipe.hincrby(make_key(match_id), "packet_version", 1)
+        await pipe.execute()
+
+
+async def get_packet_version(match_id: int) -> int | None:
+    """Returns None if the match doesn't exist."""
+    raw_packet_version: bytes | None = await glob.redis.hget(
+        make_key(match_id),
+        "packet_version",
+    )
+    if raw_packet_version is None:
+        return None
+    return int(raw_packet_version)
+
+
+async def bump_packet_version(match_id: int) -> bool:
+    """\
+    Invalidate a match's packets, for changes which aren't to its own fields
+    (e.g. one of its slots' tokens being deleted). Returns False if the match
+    doesn't exist.
+    """
+    bump_packet_version_script = _get_bump_packet_version_script()
+    bumped: int = await bump_packet_version_script(keys=[make_key(match_id)])
+    return bumped == 1
+
+
+async def get_fields(match_id: int, fields: list[str]) -> dict[str, Any] | None:
+    raw_values: list[bytes | None] = await glob.redis.hmget(make_key(match_id), fields)
+    return _deserialize_fields(fields, raw_values)
+
+
+async def get_all_fields(match_id: int) -> dict[str, Any] | None:
+    raw_fields: dict[bytes, bytes] = await glob.redis.hgetall(make_key(match_id))
+    if not raw_fields:
+        return None
+    return {field.decode(): orjson.loads(value) for field, value in raw_fields.items()}
+
+
+async def update_fields(
+    match_id: int,
+    changes: dict[str, Any],
+    *,
+    return_fields: list[str],
+) -> dict[str, Any] | None:
+    """\
+    Atomically apply changes to an existing match, and return the requested
+    fields as they are afterwards. Returns None if the match doesn't exist.
+    """
+    serialized_changes = sorted(
+        _serialize_fields(changes).items(),
+        key=lambda item: not is_packet_field(item[0]),
+    )
+    num_packet_fields = sum(
+        1 for field, _ in serialized_changes if is_packet_field(field)
+    )
+
+    update_match_state_script = _get_update_match_state_script()
+    raw_values: list[bytes | None] | None = await update_match_state_script(
+        keys=[make_key(match_id)],
+        args=[
+            len(return_fields),
+            num_packet_fields,
+            *return_fields,
+            *(
+                item
+                for field_and_value in serialized_changes
+                for item in field_and_value
+            ),
+        ],
+    )
+    if raw_values is None:
+        return None
+
+    return _deserialize_fields(return_fields, raw_values)
+
+
+async def delete_fields(match_id: int, fields: list[str]) -> None:
+    delete_match_fields_script = _get_delete_match_fields_script()
+    await delete_match_fields_script(keys=[make_key(match_id)], args=fields)
+
+
+async def is_legacy_match(match_id: int) -> bool:
+    """Whether the match is stored in the legacy layout (see the module docstring)."""
+    key_type: bytes = await glob.redis.type(make_key(match_id))  # type: ignore[no-untyped-call]
+    return key_type == b"string"
+
+
+async def migrate_legacy_match(match_id: int) -> bool:
+    """\
+    Convert a match stored in the legacy layout to a hash. Returns False if
+    it couldn't be converted, e.g. if some of its slots are missing.
+    """
+    legacy_slot_keys = [
+        make_legacy_slot_key(match_id, slot_id) for slot_id in range(LEGACY_NUM_SLOTS)
+    ]
+    async with glob.redis.pipeline() as pipe:
+        await pipe.type(make_key(match_id))
+        await pipe.get(make_key(match_id))
+        await pipe.mget(legacy_slot_keys)
+        raw_key_type, raw_match, raw_slots = await pipe.execute(
+            raise_on_error=False,
+        )
+
+    key_type: bytes = raw_key_type
+    if key_type != b"string":
+        # (already migrated, e.g. by another process starting alongside us)
+        return key_type == b"hash"
+
+    if None in raw_slots:
+        return False
+
+    fields: dict[str, Any] = orjson.loads(raw_match)
+    for slot_id, raw_slot in enumerate(raw_slots):
+        for field, value in orjson.loads(raw_slot).items():
+            fields[make_slot_field(slot_id, field)] = value
+
+    migrate_legacy_match_script = _get_migrate_legacy_match_script()
+    migrated: int = await migrate_legacy_match_script(
+        keys=[make_key(match_id), *legacy_slot_keys],
+        args=[
+            raw_match,
+            *(
+                item
+                for field, value in _serialize_fields(fields).items()
+                for item in (field, value)
+            ),
+        ],
+    )
+    if migrated == 1:
+        return True
+
+    return not await is_legacy_match(match_id)
+
+
+async def delete_legacy_match(match_id: int) -> None:
+    await glob.redis.delete(
+        make_key(match_id),
+        *(
+            make_legacy_slot_key(match_id, slot_id)
+            for slot_id in range(LEGACY_NUM_SLOTS)
+        ),
+    )
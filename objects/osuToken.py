@@ -1,9 +1,15 @@
 from __future__ import annotations
 
 import logging
+from collections.abc import AsyncIterator
+from collections.abc import Iterable
+from contextvars import ContextVar
+from contextvars import Token as ContextToken
 from time import localtime
 from time import strftime
 from time import time
+from typing import TYPE_CHECKING
+from typing import Any
 from typing import TypedDict
 from typing import cast
 from uuid import uuid4
@@ -25,17 +31,29 @@ from helpers import chatHelper as chat
 from objects import channelList
 from objects import glob
 from objects import match
+from objects import match_state
 from objects import stream_messages
+from objects import stream_watermarks
 from objects import streamList
+from objects import user_packet_cache
+
+if TYPE_CHECKING:
+    from redis.commands.core import AsyncScript
 
 # (set) bancho:tokens
-# (json obj) bancho:tokens:{token_id}
+# (set[token_id]) bancho:tokens:user_ids:{user_id}
+# (set[token_id]) bancho:tokens:usernames:{safe_username}
+# (set[userid]) bancho:tokens:online_user_ids (unrestricted users only)
+# (zset[token_id, ping time]) bancho:tokens:ping_times (sessions which can time out)
+# (hash[field, json value]) bancho:tokens:{token_id}
 # (set) bancho:tokens:{token_id}:streams
 # (set) bancho:tokens:{token_id}:channels
 # (set[userid]) bancho:tokens:{token_id}:spectators
 # (list) bancho:tokens:{token_id}:messages
 # (list[userid]) bancho:tokens:{token_id}:sent_away_messages
 # (stream) streams:tokens/{token_id}:messages
+# (string[int]) bancho:spam_rates:{user_id} (expires after SPAM_RATE_WINDOW)
+# (hash[token_id, json obj]) bancho:tokens:json (legacy, see migrate_legacy_tokens)
 
 
 class LastNp(TypedDict):
@@ -55,7 +73,6 @@ class Token(TypedDict):
     # restricted: bool
     kicked: bool
     login_time: float
-    ping_time: float
     utc_offset: int
     # streams: list[stream.Stream]
     tournament: bool
@@ -79,7 +96,6 @@ class Token(TypedDict):
     last_np: LastNp | None
     silence_end_time: int
     protocol_version: int
-    spam_rate: int
 
     # stats
     action_id: int
@@ -100,6 +116,9 @@ class Token(TypedDict):
     amplitude_device_id: str | None
 
 
+TOKEN_FIELDS = list(Token.__annotations__)
+
+
 def safeUsername(username: str) -> str:
     """
     Return `username`'s safe username
@@ -119,6 +138,178 @@ def make_key(token_id: str) -> str:
     return f"bancho:tokens:{token_id}"
 
 
+def make_user_id_index_key(user_id: int) -> str:
+    return f"bancho:tokens:user_ids:{user_id}"
+
+
+def make_username_index_key(username: str) -> str:
+    return f"bancho:tokens:usernames:{safeUsername(username)}"
+
+
+def make_online_user_ids_key() -> str:
+    return "bancho:tokens:online_user_ids"
+
+
+def make_ping_times_key() -> str:
+    return "bancho:tokens:ping_times"
+
+
+def _serialize_token_fields(fields: dict[str, Any]) -> dict[str, bytes]:
+    return {field: orjson.dumps(value) for field, value in fields.items()}
+
+
+def _deserialize_token_fields(raw_fields: dict[bytes, bytes]) -> dict[str, Any]:
+    return {field.decode(): orjson.loads(value) for field, value in raw_fields.items()}
+
+
+# Apply a set of field changes to a token, but only if it still exists,
+# and return some of its fields in the same round trip.
+# KEYS[1]: the token's hash
+# KEYS[2]: the set of unrestricted online user ids
+# ARGV[1]: a channel to announce the token's user id on, or an empty string
+# ARGV[2]: "1" or "0" if the user's privileges changed to unrestricted or
+#          restricted respectively, otherwise an empty string
+# ARGV[3]: the number of fields to return (n)
+# ARGV[4..n+3]: the fields to return, after the changes are applied
+# ARGV[n+4..]: the changed fields and values
+UPDATE_TOKEN_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return false
+end
+local num_return_fields = tonumber(ARGV[3])
+if #ARGV > num_return_fields + 3 then
+    redis.call("HSET", KEYS[1], unpack(ARGV, num_return_fields + 4))
+end
+if ARGV[1] ~= "" or ARGV[2] ~= "" then
+    local user_id = redis.call("HGET", KEYS[1], "user_id")
+    if ARGV[1] ~= "" then
+        redis.call("PUBLISH", ARGV[1], user_id)
+    end
+    if ARGV[2] == "1" then
+        redis.call("SADD", KEYS[2], user_id)
+    elseif ARGV[2] == "0" then
+        redis.call("SREM", KEYS[2], user_id)
+    end
+end
+if num_return_fields == 0 then
+    return {}
+end
+return redis.call("HMGET", KEYS[1], unpack(ARGV, 4, num_return_fields + 3))
+"""
+
+_update_token_script: AsyncScript | None = None
+
+
+def _get_update_token_script() -> AsyncScript:
+    global _update_token_script
+    if _update_token_script is None:
+        _update_token_script = glob.redis.register_script(UPDATE_TOKEN_SCRIPT)
+    return _update_token_script
+
+
+# Resolve many users' token ids, and read a subset of each of their tokens'
+# fields in the same round trip. The keys of the tokens' hashes can only be
+# known once their ids are resolved, so they're built here (see make_key).
+# KEYS[1..]: the users' token id keys
+# ARGV[1..]: the fields to read
+# Returns, for each user: their token id and the fields' values, or false
+# if they're offline.
+GET_TOKEN_FIELDS_BY_USER_IDS_SCRIPT = """
+local results = {}
+for i, key in ipairs(KEYS) do
+    local token_id = redis.call("GET", key)
+    if token_id then
+        local values = redis.call("HMGET", "bancho:tokens:" .. token_id, unpack(ARGV))
+        results[i] = {token_id, values}
+    else
+        results[i] = false
+    end
+end
+return results
+"""
+
+_get_token_fields_by_user_ids_script: AsyncScript | None = None
+
+
+def _get_get_token_fields_by_user_ids_script() -> AsyncScript:
+    global _get_token_fields_by_user_ids_script
+    if _get_token_fields_by_user_ids_script is None:
+        _get_token_fields_by_user_ids_script = glob.redis.register_script(
+            GET_TOKEN_FIELDS_BY_USER_IDS_SCRIPT,
+        )
+    return _get_token_fields_by_user_ids_script
+
+
+# Remove a token from the online presence indexes, and its user from the
+# online user ids once they have no tokens left.
+# KEYS[1]: the user id's token index
+# KEYS[2]: the username's token index
+# KEYS[3]: the set of unrestricted online user ids
+# ARGV[1]: the token's id
+# ARGV[2]: the token's user id
+DELETE_TOKEN_INDEXES_SCRIPT = """
+redis.call("SREM", KEYS[1], ARGV[1])
+redis.call("SREM", KEYS[2], ARGV[1])
+if redis.call("SCARD", KEYS[1]) == 0 then
+    redis.call("SREM", KEYS[3], ARGV[2])
+end
+"""
+
+_delete_token_indexes_script: AsyncScript | None = None
+
+
+def _get_delete_token_indexes_script() -> AsyncScript:
+    global _delete_token_indexes_script
+    if _delete_token_indexes_script is None:
+        _delete_token_indexes_script = glob.redis.register_script(
+            DELETE_TOKEN_INDEXES_SCRIPT,
+        )
+    return _delete_token_indexes_script
+
+
+# Move a token stored in the legacy layout to its own hash, and add it to
+# the indexes, unless another process has already done so.
+# KEYS[1]: the legacy tokens' hash
+# KEYS[2]: the token's hash
+# KEYS[3]: the set of token ids
+# KEYS[4]: the user id's token index
+# KEYS[5]: the username's token index
+# KEYS[6]: the set of unrestricted online user ids
+# KEYS[7]: the tokens' ping times
+# ARGV[1]: the token's id
+# ARGV[2]: the token's user id
+# ARGV[3]: "1" if the user is unrestricted, otherwise "0"
+# ARGV[4]: the token's last ping time, or an empty string if it can't time out
+# ARGV[5..]: the token's fields and values
+MIGRATE_LEGACY_TOKEN_SCRIPT = """
+if redis.call("HDEL", KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call("HSET", KEYS[2], unpack(ARGV, 5))
+redis.call("SADD", KEYS[3], ARGV[1])
+redis.call("SADD", KEYS[4], ARGV[1])
+redis.call("SADD", KEYS[5], ARGV[1])
+if ARGV[3] == "1" then
+    redis.call("SADD", KEYS[6], ARGV[2])
+end
+if ARGV[4] ~= "" then
+    redis.call("ZADD", KEYS[7], ARGV[4], ARGV[1])
+end
+return 1
+"""
+
+_migrate_legacy_token_script: AsyncScript | None = None
+
+
+def _get_migrate_legacy_token_script() -> AsyncScript:
+    global _migrate_legacy_token_script
+    if _migrate_legacy_token_script is None:
+        _migrate_legacy_token_script = glob.redis.register_script(
+            MIGRATE_LEGACY_TOKEN_SCRIPT,
+        )
+    return _migrate_legacy_token_script
+
+
 async def create_token(
     *,
     user_id: int,
@@ -142,7 +333,6 @@ async def create_token(
         "whitelist": whitelist,
         "kicked": False,
         "login_time": creation_time,
-        "ping_time": creation_time,
         "utc_offset": utc_offset,
         "tournament": tournament,
         "block_non_friends_dm": block_non_friends_dm,
@@ -158,7 +348,6 @@ async def create_token(
         "last_np": None,
         "silence_end_time": 0,
         "protocol_version": 0,
-        "spam_rate": 0,
         "action_id": actions.IDLE,
         "action_text": "",
         "action_md5": "",
@@ -179,41 +368,241 @@ async def create_token(
     safe_name = safeUsername(username)
 
     async with glob.redis.pipeline() as pipe:
-        await pipe.hset("bancho:tokens:json", token_id, orjson.dumps(token))
+        await pipe.hset(
+            make_key(token_id),
+            mapping=_serialize_token_fields(dict(token)),  # type: ignore[arg-type]
+        )
+        await pipe.sadd("bancho:tokens", token_id)
         await pipe.set(f"bancho:tokens:ids:{user_id}", token_id)
         await pipe.set(f"bancho:tokens:names:{safe_name}", token_id)
+        await pipe.sadd(make_user_id_index_key(user_id), token_id)
+        await pipe.sadd(make_username_index_key(username), token_id)
+        if not is_restricted(privileges):
+            await pipe.sadd(make_online_user_ids_key(), user_id)
+        # the chatbot & tournament clients never time out
+        if user_id != CHATBOT_USER_ID and not tournament:
+            await pipe.zadd(make_ping_times_key(), {token_id: creation_time})
         await pipe.hset(
             f"{make_key(token_id)}:stream_offsets",
             f"{make_key(token_id)}:packet_queue",
             "0-0",
         )
+        await pipe.publish(user_packet_cache.TOKEN_PACKETS_CHANNEL, str(user_id))
         await pipe.execute()
 
     return token
 
 
+TOKEN_SCAN_BATCH_SIZE = 500
+
+
+async def migrate_legacy_tokens() -> int:
+    """\
+    Move any tokens left in the legacy layout (a json object per token, in
+    bancho:tokens:json) to their own hashes. Returns how many were moved.
+    """
+    migrate_legacy_token_script = _get_migrate_legacy_token_script()
+
+    num_migrated = 0
+    async for raw_token_id, raw_token in glob.redis.hscan_iter(
+        "bancho:tokens:json",
+        count=TOKEN_SCAN_BATCH_SIZE,
+    ):
+        legacy_token: dict[str, Any] = orjson.loads(raw_token)
+        # (dropping fields which have since moved elsewhere, e.g. ping_time)
+        token = {field: legacy_token[field] for field in TOKEN_FIELDS}
+
+        # the chatbot & tournament clients never time out
+        ping_time = ""
+        if token["user_id"] != CHATBOT_USER_ID and not token["tournament"]:
+            ping_time = str(legacy_token.get("ping_time", time()))
+
+        num_migrated += await migrate_legacy_token_script(
+            keys=[
+                "bancho:tokens:json",
+                make_key(raw_token_id.decode()),
+                "bancho:tokens",
+                make_user_id_index_key(token["user_id"]),
+                make_username_index_key(token["username"]),
+                make_online_user_ids_key(),
+                make_ping_times_key(),
+            ],
+            args=[
+                raw_token_id,
+                token["user_id"],
+                "0" if is_restricted(token["privileges"]) else "1",
+                ping_time,
+                *(
+                    item
+                    for field, value in _serialize_token_fields(token).items()
+                    for item in (field, value)
+                ),
+            ],
+        )
+
+    return num_migrated
+
+
 async def get_token_ids() -> set[str]:
-    raw_token_ids: list[bytes] = await glob.redis.hkeys("bancho:tokens:json")
+    raw_token_ids: set[bytes] = await glob.redis.smembers("bancho:tokens")
     return {token_id.decode() for token_id in raw_token_ids}
 
 
+async def get_existing_token_ids(token_ids: list[str]) -> set[str]:
+    """Returns which of the given tokens still exist."""
+    if not token_ids:
+        return set()
+
+    exists: list[int] = await glob.redis.smismember("bancho:tokens", token_ids)  # type: ignore[no-untyped-call]
+    return {token_id for token_id, exist in zip(token_ids, exists) if exist}
+
+
 async def get_online_players_count() -> int:
-    return await glob.redis.hlen("bancho:tokens:json")
+    return await glob.redis.scard("bancho:tokens")
 
 
 async def get_token(token_id: str) -> Token | None:
-    token = await glob.redis.hget("bancho:tokens:json", token_id)
-    if token is None:
+    session = _get_session(token_id)
+    if session is not None:
+        if session.deleted:
+            return None
+        return cast(Token, dict(session.token))
+
+    raw_token: dict[bytes, bytes] = await glob.redis.hgetall(make_key(token_id))
+    if not raw_token:
         return None
-    return cast(Token, orjson.loads(token))
+    return cast(Token, _deserialize_token_fields(raw_token))
+
+
+async def get_token_fields(
+    token_id: str,
+    fields: list[str],
+) -> dict[str, Any] | None:
+    """Fetch only a subset of a token's fields."""
+    session = _get_session(token_id)
+    if session is not None:
+        if session.deleted:
+            return None
+        return {field: session.token[field] for field in fields}  # type: ignore[literal-required]
+
+    raw_values: list[bytes | None] = await glob.redis.hmget(make_key(token_id), fields)
+    values: dict[str, Any] = {}
+    for field, raw_value in zip(fields, raw_values):
+        if raw_value is None:
+            return None
+        values[field] = orjson.loads(raw_value)
+    return values
 
 
 async def get_tokens() -> list[Token]:
-    # TODO: use an iterative approach for these, provide a generator api
-    # to allow callers to reduce memory usage and improve performance.
-    # (If callers really want all the data, they can exhaust the iterator)
-    raw_tokens = (await glob.redis.hgetall("bancho:tokens:json")).values()
-    return cast(list[Token], [orjson.loads(token) for token in raw_tokens])
+    return [token async for token in iter_tokens()]
+
+
+async def _iter_token_id_batches(batch_size: int) -> AsyncIterator[list[str]]:
+    # SSCAN may return a token id more than once; only yield it the first time
+    seen_token_ids: set[str] = set()
+    cursor = 0
+    while True:
+        raw_token_ids: list[bytes]
+        cursor, raw_token_ids = await glob.redis.sscan(
+            "bancho:tokens",
+            cursor,
+            count=batch_size,
+        )
+
+        token_ids = []
+        for raw_token_id in raw_token_ids:
+            token_id = raw_token_id.decode()
+            if token_id not in seen_token_ids:
+                seen_token_ids.add(token_id)
+                token_ids.append(token_id)
+
+        if token_ids:
+            yield token_ids
+
+        if cursor == 0:
+            break
+
+
+async def iter_tokens(
+    *,
+    batch_size: int = TOKEN_SCAN_BATCH_SIZE,
+) -> AsyncIterator[Token]:
+    """Iterate over all tokens, fetching them from redis in batches."""
+    async for token_ids in _iter_token_id_batches(batch_size):
+        for token in await _get_tokens_by_ids(token_ids):
+            yield token
+
+
+async def iter_token_fields(
+    fields: list[str],
+    *,
+    batch_size: int = TOKEN_SCAN_BATCH_SIZE,
+) -> AsyncIterator[dict[str, Any]]:
+    """\
+    Iterate over a subset of the fields of all tokens, fetching them from
+    redis in batches. The token's id is always included in the results.
+    """
+    if "token_id" not in fields:
+        fields = ["token_id", *fields]
+
+    async for token_ids in _iter_token_id_batches(batch_size):
+        async with glob.redis.pipeline() as pipe:
+            for token_id in token_ids:
+                await pipe.hmget(make_key(token_id), fields)
+            raw_tokens: list[list[bytes | None]] = await pipe.execute()
+
+        for token_id, raw_values in zip(token_ids, raw_tokens):
+            # prefer the in-memory copy of the current request's token
+            session = _get_session(token_id)
+            if session is not None:
+                if not session.deleted:
+                    yield {field: session.token[field] for field in fields}  # type: ignore[literal-required]
+                continue
+
+            # the token was deleted while we were iterating
+            if any(raw_value is None for raw_value in raw_values):
+                continue
+
+            yield {
+                field: orjson.loads(raw_value)  # type: ignore[arg-type]
+                for field, raw_value in zip(fields, raw_values)
+            }
+
+
+async def _get_tokens_by_ids(token_ids: Iterable[str]) -> list[Token]:
+    token_ids = list(token_ids)
+    if not token_ids:
+        return []
+
+    async with glob.redis.pipeline() as pipe:
+        for token_id in token_ids:
+            await pipe.hgetall(make_key(token_id))
+        raw_tokens: list[dict[bytes, bytes]] = await pipe.execute()
+
+    tokens: list[Token] = []
+    for raw_token in raw_tokens:
+        if not raw_token:
+            continue
+
+        token = cast(Token, _deserialize_token_fields(raw_token))
+
+        # prefer the in-memory copy of the current request's token
+        session = _get_session(token["token_id"])
+        if session is not None:
+            if session.deleted:
+                continue
+            token = cast(Token, dict(session.token))
+
+        tokens.append(token)
+
+    return tokens
+
+
+async def get_online_user_ids() -> set[int]:
+    """Returns the ids of all online, unrestricted users."""
+    raw_user_ids: set[bytes] = await glob.redis.smembers(make_online_user_ids_key())
+    return {int(raw_user_id) for raw_user_id in raw_user_ids}
 
 
 # TODO: get_limited_tokens with a more basic model
@@ -231,6 +620,52 @@ async def get_token_by_user_id(user_id: int) -> Token | None:
     return None
 
 
+async def get_token_fields_by_user_ids(
+    user_ids: list[int],
+    fields: list[str],
+) -> dict[int, dict[str, Any]]:
+    """\
+    Fetch a subset of the fields of many users' tokens at once, skipping any
+    who are offline. The token's id is always included in the results.
+    """
+    if not user_ids:
+        return {}
+
+    if "token_id" not in fields:
+        fields = ["token_id", *fields]
+
+    get_token_fields_by_user_ids_script = _get_get_token_fields_by_user_ids_script()
+    results: list[list[Any] | None] = await get_token_fields_by_user_ids_script(
+        keys=[f"bancho:tokens:ids:{user_id}" for user_id in user_ids],
+        args=fields,
+    )
+
+    tokens: dict[int, dict[str, Any]] = {}
+    for user_id, result in zip(user_ids, results):
+        if result is None:
+            continue
+
+        raw_token_id, raw_values = result
+
+        # prefer the in-memory copy of the current request's token
+        session = _get_session(raw_token_id.decode())
+        if session is not None:
+            if not session.deleted:
+                tokens[user_id] = {field: session.token[field] for field in fields}  # type: ignore[literal-required]
+            continue
+
+        # the token was deleted before its id index was
+        if any(raw_value is None for raw_value in raw_values):
+            continue
+
+        tokens[user_id] = {
+            field: orjson.loads(raw_value)
+            for field, raw_value in zip(fields, raw_values)
+        }
+
+    return tokens
+
+
 async def get_token_by_username(username: str) -> Token | None:
     token_id: bytes | None = await glob.redis.get(
         f"bancho:tokens:names:{safeUsername(username)}",
@@ -246,12 +681,22 @@ async def get_token_by_username(username: str) -> Token | None:
 
 
 async def get_all_tokens_by_user_id(user_id: int) -> list[Token]:
-    tokens = await get_tokens()
-    return [token for token in tokens if token["user_id"] == user_id]
+    raw_token_ids: set[bytes] = await glob.redis.smembers(
+        make_user_id_index_key(user_id),
+    )
+    return await _get_tokens_by_ids(token_id.decode() for token_id in raw_token_ids)
+
+
+async def is_user_token(user_id: int, token_id: str) -> bool:
+    """Whether the token exists, and belongs to the user."""
+    return await glob.redis.sismember(make_user_id_index_key(user_id), token_id) == 1
 
 
 async def get_all_tokens_by_username(username: str) -> list[Token]:
-    tokens = await get_tokens()
+    raw_token_ids: set[bytes] = await glob.redis.smembers(
+        make_username_index_key(username),
+    )
+    tokens = await _get_tokens_by_ids(token_id.decode() for token_id in raw_token_ids)
     return [token for token in tokens if token["username"] == username]
 
 
@@ -265,7 +710,6 @@ async def update_token(
     whitelist: int | None = None,
     kicked: bool | None = None,
     # login_time: Optional[float] = None,
-    ping_time: float | None = None,
     # utc_offset: Optional[int] = None,
     # tournament: Optional[bool] = None,
     block_non_friends_dm: bool | None = None,
@@ -281,7 +725,6 @@ async def update_token(
     last_np: LastNp | None | Unset = UNSET,
     silence_end_time: int | None = None,
     protocol_version: int | None = None,
-    spam_rate: int | None = None,
     action_id: int | None = None,
     action_text: str | None = None,
     action_md5: str | None = None,
@@ -297,107 +740,294 @@ async def update_token(
     global_rank: int | None = None,
     pp: int | None = None,
     amplitude_device_id: str | None = None,
+    return_token: bool = True,
 ) -> Token | None:
-    token = await get_token(token_id)
-    if token is None:
-        return None
+    """\
+    Apply changes to a token, and return it as it is afterwards (or None if
+    it doesn't exist). Callers which don't use the result can pass
+    `return_token=False` to skip reading the token back (None is returned).
+    """
+    changes: dict[str, Any] = {}
 
     if username is not None:
-        token["username"] = username
+        changes["username"] = username
     if privileges is not None:
-        token["privileges"] = privileges
+        changes["privileges"] = privileges
     if whitelist is not None:
-        token["whitelist"] = whitelist
+        changes["whitelist"] = whitelist
     if kicked is not None:
-        token["kicked"] = kicked
-    if ping_time is not None:
-        token["ping_time"] = ping_time
+        changes["kicked"] = kicked
     if block_non_friends_dm is not None:
-        token["block_non_friends_dm"] = block_non_friends_dm
+        changes["block_non_friends_dm"] = block_non_friends_dm
     if not isinstance(spectating_token_id, Unset):
-        token["spectating_token_id"] = spectating_token_id
+        changes["spectating_token_id"] = spectating_token_id
     if not isinstance(spectating_user_id, Unset):
-        token["spectating_user_id"] = spectating_user_id
+        changes["spectating_user_id"] = spectating_user_id
     if latitude is not None:
-        token["latitude"] = latitude
+        changes["latitude"] = latitude
     if longitude is not None:
-        token["longitude"] = longitude
+        changes["longitude"] = longitude
     if ip is not None:
-        token["ip"] = ip
+        changes["ip"] = ip
     if country is not None:
-        token["country"] = country
+        changes["country"] = country
     if not isinstance(away_message, Unset):
-        token["away_message"] = away_message
+        changes["away_message"] = away_message
     if not isinstance(match_id, Unset):
-        token["match_id"] = match_id
+        changes["match_id"] = match_id
     if not isinstance(match_slot_id, Unset):
-        token["match_slot_id"] = match_slot_id
+        changes["match_slot_id"] = match_slot_id
     if not isinstance(last_np, Unset):
-        token["last_np"] = last_np
+        changes["last_np"] = last_np
     if silence_end_time is not None:
-        token["silence_end_time"] = silence_end_time
+        changes["silence_end_time"] = silence_end_time
     if protocol_version is not None:
-        token["protocol_version"] = protocol_version
-    if spam_rate is not None:
-        token["spam_rate"] = spam_rate
+        changes["protocol_version"] = protocol_version
     if action_id is not None:
-        token["action_id"] = action_id
+        changes["action_id"] = action_id
     if action_text is not None:
-        token["action_text"] = action_text
+        changes["action_text"] = action_text
     if action_md5 is not None:
-        token["action_md5"] = action_md5
+        changes["action_md5"] = action_md5
     if action_mods is not None:
-        token["action_mods"] = action_mods
+        changes["action_mods"] = action_mods
     if game_mode is not None:
-        token["game_mode"] = game_mode
+        changes["game_mode"] = game_mode
     if relax is not None:
-        token["relax"] = relax
+        changes["relax"] = relax
     if autopilot is not None:
-        token["autopilot"] = autopilot
+        changes["autopilot"] = autopilot
     if beatmap_id is not None:
-        token["beatmap_id"] = beatmap_id
+        changes["beatmap_id"] = beatmap_id
     if ranked_score is not None:
-        token["ranked_score"] = ranked_score
+        changes["ranked_score"] = ranked_score
     if accuracy is not None:
-        token["accuracy"] = accuracy
+        changes["accuracy"] = accuracy
     if playcount is not None:
-        token["playcount"] = playcount
+        changes["playcount"] = playcount
     if total_score is not None:
-        token["total_score"] = total_score
+        changes["total_score"] = total_score
     if global_rank is not None:
-        token["global_rank"] = global_rank
+        changes["global_rank"] = global_rank
     if pp is not None:
-        token["pp"] = pp
+        changes["pp"] = pp
     if amplitude_device_id is not None:
-        token["amplitude_device_id"] = amplitude_device_id
+        changes["amplitude_device_id"] = amplitude_device_id
+
+    session = _get_session(token_id)
+    if session is not None:
+        # defer the write until the end of the request
+        if session.deleted:
+            return None
+        session.token.update(changes)  # type: ignore[typeddict-item]
+        session.dirty_fields.update(changes)
+        if not user_packet_cache.PACKET_FIELDS.isdisjoint(changes):
+            # other processes will be told once the changes are written
+            user_packet_cache.invalidate(session.token["user_id"])
+        return cast(Token, dict(session.token))
+
+    token = await _write_token_fields(
+        token_id,
+        changes,
+        return_fields=TOKEN_FIELDS if return_token else [],
+    )
+    if token is None or not return_token:
+        return None
+    return cast(Token, token)
 
-    async with glob.redis.pipeline() as pipe:
-        await pipe.hset("bancho:tokens:json", token_id, orjson.dumps(token))
-        await pipe.execute()
 
-    return token
+async def _write_token_fields(
+    token_id: str,
+    changes: dict[str, Any],
+    *,
+    return_fields: list[str],
+) -> dict[str, Any] | None:
+    """\
+    Write changes to a token, and return the requested fields as they are
+    afterwards. Returns None if the token doesn't exist.
+    """
+    # let every process know if the user's cached packets are outdated
+    if user_packet_cache.PACKET_FIELDS.isdisjoint(changes):
+        notification_channel = ""
+    else:
+        notification_channel = user_packet_cache.TOKEN_PACKETS_CHANNEL
+
+    # keep the online user ids up to date with the user's restriction status
+    if "privileges" not in changes:
+        online_status = ""
+    elif is_restricted(changes["privileges"]):
+        online_status = "0"
+    else:
+        online_status = "1"
+
+    update_token_script = _get_update_token_script()
+    raw_values: list[bytes | None] | None = await update_token_script(
+        keys=[make_key(token_id), make_online_user_ids_key()],
+        args=[
+            notification_channel,
+            online_status,
+            len(return_fields),
+            *return_fields,
+            *(
+                item
+                for field, value in _serialize_token_fields(changes).items()
+                for item in (field, value)
+            ),
+        ],
+    )
+    if raw_values is None:
+        return None
+
+    values: dict[str, Any] = {}
+    for field, raw_value in zip(return_fields, raw_values):
+        if raw_value is None:
+            return None
+        values[field] = orjson.loads(raw_value)
+    return values
 
 
 async def delete_token(token_id: str) -> None:
-    token = await get_token(token_id)
+    token = await get_token_fields(token_id, ["user_id", "username", "match_id"])
     if token is None:
         return
 
+    session = _get_session(token_id)
+    if session is not None:
+        session.deleted = True
+
+    delete_token_indexes_script = _get_delete_token_indexes_script()
+
     token_stream_name = f"tokens/{token_id}:messages"
     async with glob.redis.pipeline() as pipe:
+        await delete_token_indexes_script(
+            keys=[
+                make_user_id_index_key(token["user_id"]),
+                make_username_index_key(token["username"]),
+                make_online_user_ids_key(),
+            ],
+            args=[token_id, token["user_id"]],
+            client=pipe,
+        )
         await pipe.delete(f"bancho:tokens:ids:{token['user_id']}")
         await pipe.delete(f"bancho:tokens:names:{safeUsername(token['username'])}")
-        await pipe.hdel("bancho:tokens:json", token_id)
+        await pipe.srem("bancho:tokens", token_id)
+        await pipe.delete(make_key(token_id))
         await pipe.delete(f"{make_key(token_id)}:channels")
         await pipe.delete(f"{make_key(token_id)}:spectators")
         await pipe.delete(f"{make_key(token_id)}:streams")
         await pipe.delete(f"{make_key(token_id)}:stream_offsets")
         await pipe.delete(f"bancho:streams:{token_stream_name}:messages")
+        await pipe.zrem(stream_messages.make_activity_key(), token_stream_name)
+        await pipe.zrem(make_ping_times_key(), token_id)
         await pipe.delete(f"{make_key(token_id)}:message_history")
         await pipe.delete(f"{make_key(token_id)}:sent_away_messages")
         await pipe.delete(f"{make_key(token_id)}:processing_lock")
+        await pipe.publish(stream_watermarks.TOKEN_STREAMS_CHANNEL, token_id)
+        await pipe.publish(
+            user_packet_cache.TOKEN_PACKETS_CHANNEL,
+            str(token["user_id"]),
+        )
         await pipe.execute()
 
+    # the match's packets only list users whose tokens still exist
+    if token["match_id"] is not None and await match_state.bump_packet_version(
+        token["match_id"],
+    ):
+        await match.sendUpdates(token["match_id"])
+
+
+# request sessions
+
+
+class TokenSession:
+    """\
+    An in-memory copy of a token, scoped to a single client request.
+
+    While a session is open, reads and updates of its token are served from
+    memory, and the changed fields are written back once when it is closed.
+    """
+
+    def __init__(self, token: Token) -> None:
+        self.token = token
+        self.dirty_fields: set[str] = set()
+        self.deleted = False
+        self.closed = False
+        self._context_token: ContextToken[TokenSession | None] | None = None
+
+
+_CURRENT_SESSION: ContextVar[TokenSession | None] = ContextVar(
+    "_CURRENT_SESSION",
+    default=None,
+)
+
+
+def _get_session(token_id: str) -> TokenSession | None:
+    session = _CURRENT_SESSION.get()
+    if session is None or session.closed or session.token["token_id"] != token_id:
+        return None
+    return session
+
+
+async def open_session(token_id: str) -> TokenSession | None:
+    """Load a token into memory for the duration of the current request."""
+    token = await get_token(token_id)
+    if token is None:
+        return None
+
+    session = TokenSession(token)
+    session._context_token = _CURRENT_SESSION.set(session)
+    return session
+
+
+async def close_session(
+    session: TokenSession,
+    *,
+    return_fields: list[str] | None = None,
+) -> dict[str, Any] | None:
+    """\
+    Write the session's changed fields back to redis, and return the latest
+    state of `return_fields` (or None if the token no longer exists).
+    """
+    session.closed = True
+    if session._context_token is not None:
+        _CURRENT_SESSION.reset(session._context_token)
+        session._context_token = None
+
+    if session.deleted:
+        return None
+
+    changes = {field: session.token[field] for field in session.dirty_fields}  # type: ignore[literal-required]
+    return await _write_token_fields(
+        session.token["token_id"],
+        changes,
+        return_fields=return_fields or [],
+    )
+
+
+async def sync_session(token_id: str) -> None:
+    """\
+    Write the current request's changes to a token back to redis, and reload
+    it from there, so that it can be used (and changed) elsewhere mid-request.
+    """
+    session = _get_session(token_id)
+    if session is None or session.deleted:
+        return
+
+    changes = {field: session.token[field] for field in session.dirty_fields}  # type: ignore[literal-required]
+    session.dirty_fields.clear()
+
+    latest_token = await _write_token_fields(
+        token_id,
+        changes,
+        return_fields=TOKEN_FIELDS,
+    )
+    if latest_token is None:
+        session.deleted = True
+        return
+
+    # packet handlers share the session's token, so update it in place
+    session.token.update(cast(Token, latest_token))
+
 
 # joined channels
 
@@ -440,19 +1070,25 @@ async def add_stream(token_id: str, stream_name: str) -> None:
     await glob.redis.sadd(f"{make_key(token_id)}:streams", stream_name)
 
     stream_offset = await stream_messages.get_latest_message_id(stream_name)
-    await glob.redis.hset(
-        f"{make_key(token_id)}:stream_offsets",
-        stream_messages.make_key(stream_name),
-        stream_offset,
-    )
+    async with glob.redis.pipeline() as pipe:
+        await pipe.hset(
+            f"{make_key(token_id)}:stream_offsets",
+            stream_messages.make_key(stream_name),
+            stream_offset,
+        )
+        await pipe.publish(stream_watermarks.TOKEN_STREAMS_CHANNEL, token_id)
+        await pipe.execute()
 
 
 async def remove_stream(token_id: str, stream_name: str) -> None:
     await glob.redis.srem(f"{make_key(token_id)}:streams", stream_name)
-    await glob.redis.hdel(
-        f"{make_key(token_id)}:stream_offsets",
-        stream_messages.make_key(stream_name),
-    )
+    async with glob.redis.pipeline() as pipe:
+        await pipe.hdel(
+            f"{make_key(token_id)}:stream_offsets",
+            stream_messages.make_key(stream_name),
+        )
+        await pipe.publish(stream_watermarks.TOKEN_STREAMS_CHANNEL, token_id)
+        await pipe.execute()
 
 
 # messages
@@ -501,12 +1137,98 @@ def is_restricted(token_privileges: int) -> bool:
 #####
 
 
+# outboxes
+
+
+class Outbox:
+    """\
+    Packets enqueued to tokens during a single client request (or background
+    job), held in memory so that they can be written to redis all at once.
+    """
+
+    def __init__(self) -> None:
+        # (token id -> packets, in the order they were enqueued)
+        self.packets: dict[str, list[bytes]] = {}
+        self.closed = False
+        self._context_token: ContextToken[Outbox | None] | None = None
+
+
+_CURRENT_OUTBOX: ContextVar[Outbox | None] = ContextVar(
+    "_CURRENT_OUTBOX",
+    default=None,
+)
+
+
+def open_outbox() -> Outbox:
+    """Hold packets enqueued by the current request until the outbox is flushed."""
+    outbox = Outbox()
+    outbox._context_token = _CURRENT_OUTBOX.set(outbox)
+    return outbox
+
+
+async def close_outbox(outbox: Outbox) -> None:
+    """Stop holding enqueued packets, and write any that are left to redis."""
+    outbox.closed = True
+    if outbox._context_token is not None:
+        _CURRENT_OUTBOX.reset(outbox._context_token)
+        outbox._context_token = None
+
+    await _flush_outbox(outbox)
+
+
+async def flush_outbox() -> None:
+    """Write the packets held by the current request's outbox to redis."""
+    outbox = _CURRENT_OUTBOX.get()
+    if outbox is None or outbox.closed:
+        return
+
+    await _flush_outbox(outbox)
+
+
+async def _flush_outbox(outbox: Outbox) -> None:
+    packets, outbox.packets = outbox.packets, {}
+    if not packets:
+        return
+
+    token_ids = list(packets)
+    async with glob.redis.pipeline() as pipe:
+        for token_id in token_ids:
+            await pipe.hget(make_key(token_id), "user_id")
+        raw_user_ids: list[bytes | None] = await pipe.execute()
+
+    data_by_stream_name: dict[str, bytes] = {}
+    for token_id, raw_user_id in zip(token_ids, raw_user_ids):
+        if raw_user_id is None:
+            continue
+
+        # Never enqueue data to the chatbot
+        if orjson.loads(raw_user_id) == CHATBOT_USER_ID:
+            continue
+
+        data_by_stream_name[f"tokens/{token_id}:messages"] = b"".join(
+            packets[token_id],
+        )
+
+    await stream_messages.broadcast_data_to_streams(data_by_stream_name)
+
+
 async def enqueue(token_id: str, data: bytes) -> None:
     """
     Add bytes (packets) to queue
 
     :param data: (packet) bytes to enqueue
     """
+    if len(data) >= 10 * 10**6:
+        logger.warning(
+            "Enqueuing very large amount of data to token",
+            extra={"num_bytes": len(data), "token_id": token_id},
+        )
+
+    outbox = _CURRENT_OUTBOX.get()
+    if outbox is not None and not outbox.closed:
+        outbox.packets.setdefault(token_id, []).append(data)
+        return
+
     token = await get_token(token_id)
     if token is None:
         return
@@ -515,12 +1237,6 @@ async def enqueue(token_id: str, data: bytes) -> None:
     if token["user_id"] == CHATBOT_USER_ID:
         return
 
-    if len(data) >= 10 * 10**6:
-        logger.warning(
-            "Enqueuing very large amount of data to token",
-            extra={"num_bytes": len(data), "token_id": token_id},
-        )
-
     await stream_messages.broadcast_data(f"tokens/{token_id}:messages", data)
 
 
@@ -595,14 +1311,11 @@ async def setLocation(token_id: str, latitude: float, longitude: float) -> None:
     :param latitude: latitude
     :param longitude: longitude
     """
-    token = await get_token(token_id)
-    if token is None:
-        return
-
     await update_token(
         token_id,
         latitude=latitude,
         longitude=longitude,
+        return_token=False,
     )
 
 
@@ -630,6 +1343,7 @@ async def startSpectating(token_id: str, host_token_id: str) -> None:
         token_id,
         spectating_token_id=host_token_id,
         spectating_user_id=host_token["user_id"],
+        return_token=False,
     )
 
     # Add us to host's spectator list
@@ -754,6 +1468,7 @@ async def stopSpectating(token_id: str) -> None:
         token_id,
         spectating_token_id=None,
         spectating_user_id=None,
+        return_token=False,
     )
 
 
@@ -763,14 +1478,27 @@ async def updatePingTime(token_id: str) -> None:
 
     :return:
     """
-    token = await get_token(token_id)
-    if token is None:
-        return
+    # xx: only update sessions which are still online & can time out
+    await glob.redis.zadd(make_ping_times_key(), {token_id: time()}, xx=True)
 
-    await update_token(
-        token_id,
-        ping_time=time(),
+
+async def get_inactive_token_ping_times(oldest_ping_time: float) -> dict[str, float]:
+    """\
+    Returns the ids & last ping times of tokens
+    which haven't pinged since `oldest_ping_time`.
+    """
+    raw_ping_times: list[tuple[bytes, float]] = await glob.redis.zrangebyscore(
+        make_ping_times_key(),
+        "-inf",
+        f"({oldest_ping_time}",
+        withscores=True,
     )
+    return {token_id.decode(): ping_time for token_id, ping_time in raw_ping_times}
+
+
+async def remove_ping_time(token_id: str) -> None:
+    """Stop tracking a token's ping time, e.g. if it was left behind by a deleted token."""
+    await glob.redis.zrem(make_ping_times_key(), token_id)
 
 
 async def joinMatch(token_id: str, match_id: int) -> bool:
@@ -807,6 +1535,7 @@ async def joinMatch(token_id: str, match_id: int) -> bool:
         token_id,
         match_id=match_id,
         match_slot_id=match_slot_id,
+        return_token=False,
     )
     await joinStream(token_id, match.create_stream_name(multiplayer_match["match_id"]))
     await chat.join_channel(
@@ -880,6 +1609,7 @@ async def leaveMatch(token_id: str) -> None:
         token_id,
         match_id=None,
         match_slot_id=None,
+        return_token=False,
     )
 
     # Make sure the match exists
@@ -963,6 +1693,7 @@ async def silence(
     await update_token(
         token_id,
         silence_end_time=int(time()) + seconds,
+        return_token=False,
     )
 
     # Send silence packet to user
@@ -975,6 +1706,38 @@ async def silence(
     )
 
 
+SPAM_RATE_WINDOW = 60  # seconds
+ACCEPTABLE_SPAM_RATE = 10
+
+
+def make_spam_rate_key(user_id: int) -> str:
+    return f"bancho:spam_rates:{user_id}"
+
+
+# Count a message towards a user's spam rate, starting a new
+# window with the first message sent after the last one expired.
+# KEYS[1]: the user's spam rate counter
+# ARGV[1]: the window's length, in seconds
+INCREASE_SPAM_RATE_SCRIPT = """
+local spam_rate = redis.call("INCR", KEYS[1])
+if spam_rate == 1 then
+    redis.call("EXPIRE", KEYS[1], ARGV[1])
+end
+return spam_rate
+"""
+
+_increase_spam_rate_script: AsyncScript | None = None
+
+
+def _get_increase_spam_rate_script() -> AsyncScript:
+    global _increase_spam_rate_script
+    if _increase_spam_rate_script is None:
+        _increase_spam_rate_script = glob.redis.register_script(
+            INCREASE_SPAM_RATE_SCRIPT,
+        )
+    return _increase_spam_rate_script
+
+
 async def chat_spam_protection(
     token_id: str,
     *,
@@ -986,18 +1749,21 @@ async def chat_spam_protection(
     :param increaseSpamRate: set to True if the user has sent a new message. Default: True
     :return:
     """
-    token = await get_token(token_id)
+    token = await get_token_fields(token_id, ["user_id"])
     if token is None:
         return
 
-    spam_rate = token["spam_rate"]
+    spam_rate_key = make_spam_rate_key(token["user_id"])
 
     # Increase the spam rate if needed
     if increase_spam_rate:
-        spam_rate += 1
-        await update_token(token_id, spam_rate=spam_rate)
-
-    ACCEPTABLE_SPAM_RATE = 10
+        increase_spam_rate_script = _get_increase_spam_rate_script()
+        spam_rate: int = await increase_spam_rate_script(
+            keys=[spam_rate_key],
+            args=[SPAM_RATE_WINDOW],
+        )
+    else:
+        spam_rate = int(await glob.redis.get(spam_rate_key) or 0)
 
     # Silence the user if they exceed the acceptable rate
     if spam_rate > ACCEPTABLE_SPAM_RATE:
@@ -1069,6 +1835,7 @@ async def updateCachedStats(token_id: str) -> None:
         total_score=stats["total_score"],
         global_rank=stats["global_rank"],
         pp=stats["pp"],
+        return_token=False,
     )
 
 
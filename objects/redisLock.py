@@ -1,34 +1,410 @@
+"""\
+A distributed lock, held in redis.
+
+Each holder of a lock is identified by a random owner token, so that only
+the holder can release or extend it. Contending acquirers queue up in the
+order they arrived, and only the first in line may take the lock once it's
+free; waiters which stop checking in (e.g. whose process died) are dropped
+from the queue after a short time.
+
+Releasing a contended lock announces its key on a redis pubsub channel, so
+that waiters can retry as soon as it's free rather than polling for it.
+Waiters still retry after a while without a notification, in case the
+holder's lease expired, or we aren't subscribed to the channel.
+"""
+
 from __future__ import annotations
 
 import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 from types import TracebackType
+from typing import TYPE_CHECKING
+from typing import TypedDict
 
+from common.log import logger
 from objects import glob
 
+if TYPE_CHECKING:
+    from redis.commands.core import AsyncScript
+
+# (string) {lock_key}
+# (sorted set[owner token, ticket]) {lock_key}:queue
+# (hash[owner token, unix ms deadline]) {lock_key}:waiters
+# (int) {lock_key}:tickets
+
+LOCK_RELEASES_CHANNEL = "bancho:locks:notifications:releases"
+
 DEFAULT_LOCK_EXPIRY = 10  # in seconds
+# how often to retry while unsubscribed from release notifications
 DEFAULT_RETRY_DELAY = 0.05  # in seconds
+# how often waiters check in while waiting for a notification
+WAITER_HEARTBEAT_INTERVAL = 1  # in seconds
+# how long a waiter may go without checking in before being dropped
+WAITER_EXPIRY = 3  # in seconds
+
+MAX_TRACKED_LOCKS = 10_000
+
+RECONNECT_DELAY = 1  # in seconds
+
+
+def make_queue_key(key: str) -> str:
+    return f"{key}:queue"
+
+
+def make_waiters_key(key: str) -> str:
+    return f"{key}:waiters"
+
+
+def make_tickets_key(key: str) -> str:
+    return f"{key}:tickets"
+
+
+class LockStats(TypedDict):
+    acquisitions: int
+    # acquisitions which had to wait for another holder
+    contended_acquisitions: int
+    total_wait_ms: float
+    max_wait_ms: float
+    # releases after the lock had already expired
+    lost_leases: int
+
+
+# (lock key -> stats), for the most recently used locks
+LOCK_STATS: OrderedDict[str, LockStats] = OrderedDict()
+
+
+def _get_lock_stats(key: str) -> LockStats:
+    stats = LOCK_STATS.get(key)
+    if stats is None:
+        stats = LOCK_STATS[key] = {
+            "acquisitions": 0,
+            "contended_acquisitions": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "lost_leases": 0,
+        }
+        if len(LOCK_STATS) > MAX_TRACKED_LOCKS:
+            LOCK_STATS.popitem(last=False)
+    else:
+        LOCK_STATS.move_to_end(key)
+    return stats
+
+
+# Join the lock's queue (if not already in it), and take the lock if
+# it's free and we're first in line, dropping any expired waiters ahead.
+# KEYS[1]: the lock
+# KEYS[2]: the lock's queue
+# KEYS[3]: the lock's waiter deadlines
+# KEYS[4]: the lock's ticket counter
+# ARGV[1]: the owner token
+# ARGV[2]: the lock's expiry, in milliseconds
+# ARGV[3]: the waiter's expiry, in milliseconds
+# Returns whether the lock was acquired, and its remaining ttl in milliseconds.
+ACQUIRE_LOCK_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+
+if not redis.call("ZSCORE", KEYS[2], ARGV[1]) then
+    redis.call("ZADD", KEYS[2], redis.call("INCR", KEYS[4]), ARGV[1])
+end
+redis.call("HSET", KEYS[3], ARGV[1], now + tonumber(ARGV[3]))
+
+local acquired = 0
+while true do
+    local head = redis.call("ZRANGE", KEYS[2], 0, 0)[1]
+    if head == ARGV[1] then
+        if redis.call("SET", KEYS[1], ARGV[1], "NX", "PX", ARGV[2]) then
+            redis.call("ZREM", KEYS[2], ARGV[1])
+            redis.call("HDEL", KEYS[3], ARGV[1])
+            acquired = 1
+        end
+        break
+    end
+    if tonumber(redis.call("HGET", KEYS[3], head) or 0) >= now then
+        break
+    end
+    redis.call("ZREM", KEYS[2], head)
+    redis.call("HDEL", KEYS[3], head)
+end
+
+if redis.call("ZCARD", KEYS[2]) == 0 then
+    redis.call("DEL", KEYS[2], KEYS[3], KEYS[4])
+else
+    redis.call("PEXPIRE", KEYS[2], ARGV[3])
+    redis.call("PEXPIRE", KEYS[3], ARGV[3])
+    redis.call("PEXPIRE", KEYS[4], ARGV[3])
+end
+return {acquired, redis.call("PTTL", KEYS[1])}
+"""
+
+_acquire_lock_script: AsyncScript | None = None
+
+
+def _get_acquire_lock_script() -> AsyncScript:
+    global _acquire_lock_script
+    if _acquire_lock_script is None:
+        _acquire_lock_script = glob.redis.register_script(ACQUIRE_LOCK_SCRIPT)
+    return _acquire_lock_script
+
+
+# Release the lock if we still hold it, and notify any waiters.
+# KEYS[1]: the lock
+# KEYS[2]: the lock's queue
+# ARGV[1]: the owner token
+# ARGV[2]: the release notification channel
+RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call("DEL", KEYS[1])
+if redis.call("EXISTS", KEYS[2]) == 1 then
+    redis.call("PUBLISH", ARGV[2], KEYS[1])
+end
+return 1
+"""
+
+_release_lock_script: AsyncScript | None = None
+
+
+def _get_release_lock_script() -> AsyncScript:
+    global _release_lock_script
+    if _release_lock_script is None:
+        _release_lock_script = glob.redis.register_script(RELEASE_LOCK_SCRIPT)
+    return _release_lock_script
+
+
+# Reset the lock's expiry if we still hold it.
+# KEYS[1]: the lock
+# ARGV[1]: the owner token
+# ARGV[2]: the lock's new expiry, in milliseconds
+EXTEND_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+"""
+
+_extend_lock_script: AsyncScript | None = None
+
+
+def _get_extend_lock_script() -> AsyncScript:
+    global _extend_lock_script
+    if _extend_lock_script is None:
+        _extend_lock_script = glob.redis.register_script(EXTEND_LOCK_SCRIPT)
+    return _extend_lock_script
+
+
+class _ReleaseEvent(asyncio.Event):
+    def __init__(self) -> None:
+        super().__init__()
+        self.watchers = 0
+
+
+# (lock key -> event set when it's next released), for locks being waited on
+_release_events: dict[str, _ReleaseEvent] = {}
+
+_subscribed = False
+
+
+@contextmanager
+def _watch_releases(key: str) -> Iterator[asyncio.Event]:
+    """Listen for the lock's next release, dropping the event once nobody is."""
+    event = _release_events.get(key)
+    if event is None:
+        event = _release_events[key] = _ReleaseEvent()
+
+    event.watchers += 1
+    try:
+        yield event
+    finally:
+        event.watchers -= 1
+        if event.watchers == 0 and _release_events.get(key) is event:
+            del _release_events[key]
+
+
+def _notify_released(key: str) -> None:
+    event = _release_events.pop(key, None)
+    if event is not None:
+        event.set()
+
+
+def _reset() -> None:
+    global _subscribed
+    _subscribed = False
+    # wake every waiter, so they fall back to polling
+    for event in _release_events.values():
+        event.set()
+    _release_events.clear()
+
+
+async def listen_for_releases() -> None:
+    """Wake local waiters as locks are released, for the lifetime of the process."""
+    global _subscribed
+    while True:
+        try:
+            async with glob.redis.pubsub() as pubsub:
+                await pubsub.subscribe(LOCK_RELEASES_CHANNEL)
+                async for item in pubsub.listen():
+                    if item["type"] == "subscribe":
+                        _subscribed = True
+                        # we may have missed releases while unsubscribed
+                        for event in _release_events.values():
+                            event.set()
+                        _release_events.clear()
+                    elif item["type"] == "message":
+                        _notify_released(item["data"].decode())
+        except asyncio.CancelledError:
+            _reset()
+            raise
+        except Exception:
+            logger.exception("Lost subscription to lock release notifications")
+            _reset()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+# keys of locks already held on the current task's behalf (e.g. by the owner
+# of a match, see match_actors), which it may enter without acquiring them
+_HELD_KEYS: ContextVar[frozenset[str]] = ContextVar(
+    "_HELD_KEYS",
+    default=frozenset(),
+)
+
+
+@contextmanager
+def held(key: str) -> Iterator[None]:
+    """Let the current task enter a lock which is held on its behalf."""
+    context_token = _HELD_KEYS.set(_HELD_KEYS.get() | {key})
+    try:
+        yield
+    finally:
+        _HELD_KEYS.reset(context_token)
 
 
 class redisLock:
     def __init__(self, key: str) -> None:
         self.key = key
+        self.token: str | None = None
+        self.reentered = False
 
-    async def _try_acquire(self, expiry: int) -> bool | None:
-        return await glob.redis.set(self.key, "1", ex=expiry, nx=True)
+    async def _try_acquire(self, token: str, expiry: int) -> tuple[bool, int]:
+        """Returns whether the lock was acquired, and its remaining ttl in ms."""
+        acquire_lock_script = _get_acquire_lock_script()
+        acquired, ttl_ms = await acquire_lock_script(
+            keys=[
+                self.key,
+                make_queue_key(self.key),
+                make_waiters_key(self.key),
+                make_tickets_key(self.key),
+            ],
+            args=[token, expiry * 1000, WAITER_EXPIRY * 1000],
+        )
+        return bool(acquired), ttl_ms
+
+    async def _leave_queue(self, token: str) -> None:
+        async with glob.redis.pipeline() as pipe:
+            await pipe.zrem(make_queue_key(self.key), token)
+            await pipe.hdel(make_waiters_key(self.key), token)
+            # in case we took the lock, but didn't hear back in time
+            release_lock_script = _get_release_lock_script()
+            await release_lock_script(
+                keys=[self.key, make_queue_key(self.key)],
+                args=[token, LOCK_RELEASES_CHANNEL],
+                client=pipe,
+            )
+            await pipe.execute()
 
     async def acquire(
         self,
         expiry: int = DEFAULT_LOCK_EXPIRY,
         retry_delay: float = DEFAULT_RETRY_DELAY,
     ) -> None:
-        while not await self._try_acquire(expiry):
-            await asyncio.sleep(retry_delay)
+        if self.key in _HELD_KEYS.get():
+            self.reentered = True
+            return
+
+        token = uuid.uuid4().hex
+        started_at = time.perf_counter()
+        attempts = 1
+        try:
+            acquired, ttl_ms = await self._try_acquire(token, expiry)
+            while not acquired:
+                # listen before trying again, so a release in between isn't missed
+                with _watch_releases(self.key) as release_event:
+                    attempts += 1
+                    acquired, ttl_ms = await self._try_acquire(token, expiry)
+                    if acquired:
+                        break
+
+                    timeout = WAITER_HEARTBEAT_INTERVAL if _subscribed else retry_delay
+                    if ttl_ms > 0:
+                        # the holder's lease may run out without a notification
+                        timeout = min(timeout, ttl_ms / 1000)
+                    try:
+                        await asyncio.wait_for(release_event.wait(), timeout=timeout)
+                    except TimeoutError:
+                        pass
+        except BaseException:
+            await asyncio.shield(self._leave_queue(token))
+            raise
+
+        self.token = token
+
+        wait_ms = (time.perf_counter() - started_at) * 1000
+        stats = _get_lock_stats(self.key)
+        stats["acquisitions"] += 1
+        if attempts > 1:
+            stats["contended_acquisitions"] += 1
+            stats["total_wait_ms"] += wait_ms
+            stats["max_wait_ms"] = max(stats["max_wait_ms"], wait_ms)
+
+    async def extend(self, expiry: int = DEFAULT_LOCK_EXPIRY) -> bool:
+        """\
+        Reset the lock's expiry to `expiry` seconds from now.
+        Returns False if the lock is no longer held by us.
+        """
+        if self.token is None:
+            return False
+
+        extend_lock_script = _get_extend_lock_script()
+        extended = await extend_lock_script(
+            keys=[self.key],
+            args=[self.token, expiry * 1000],
+        )
+        return bool(extended)
+
+    async def is_contended(self) -> bool:
+        """Returns whether anyone is waiting for the lock."""
+        return await glob.redis.exists(make_queue_key(self.key)) == 1
 
     async def release(self) -> None:
-        await glob.redis.delete(self.key)
+        if self.reentered:
+            self.reentered = False
+            return
+
+        if self.token is None:
+            return
+
+        token, self.token = self.token, None
+        release_lock_script = _get_release_lock_script()
+        released = await release_lock_script(
+            keys=[self.key, make_queue_key(self.key)],
+            args=[token, LOCK_RELEASES_CHANNEL],
+        )
+        if not released:
+            _get_lock_stats(self.key)["lost_leases"] += 1
+            logger.warning(
+                "Released a lock after its lease expired",
+                extra={"lock_key": self.key},
+            )
 
-    async def __aenter__(self) -> None:
+    async def __aenter__(self) -> redisLock:
         await self.acquire()
+        return self
 
     async def __aexit__(
         self,
@@ -1,14 +1,12 @@
 from __future__ import annotations
 
-from typing import Literal
+from typing import Any
 from typing import TypedDict
 from typing import cast
 
-import orjson
-
 from constants import matchTeams
 from constants import slotStatuses
-from objects import glob
+from objects import match_state
 
 
 class Slot(TypedDict):
@@ -25,12 +23,44 @@ class Slot(TypedDict):
     passed: bool
 
 
-def make_key(match_id: int, slot_id: int | Literal["*"]) -> str:
-    return f"bancho:matches:{match_id}:slots:{slot_id}"
+SLOT_FIELDS = list(Slot.__annotations__)
 
+NUM_SLOTS = 16
 
-async def create_slot(match_id: int, slot_id: int) -> Slot:
-    slot: Slot = {
+
+def make_fields(slot_id: int) -> list[str]:
+    """The names of a slot's fields, within its match's state."""
+    return [match_state.make_slot_field(slot_id, field) for field in SLOT_FIELDS]
+
+
+def make_all_fields() -> list[str]:
+    return [field for slot_id in range(NUM_SLOTS) for field in make_fields(slot_id)]
+
+
+def _make_slot_changes(slot_id: int, changes: dict[str, Any]) -> dict[str, Any]:
+    return {
+        match_state.make_slot_field(slot_id, field): value
+        for field, value in changes.items()
+    }
+
+
+def _get_slot_from_fields(slot_id: int, fields: dict[str, Any]) -> Slot:
+    return cast(
+        Slot,
+        {
+            field: fields[match_state.make_slot_field(slot_id, field)]
+            for field in SLOT_FIELDS
+        },
+    )
+
+
+def get_slots_from_fields(fields: dict[str, Any]) -> list[Slot]:
+    """Read the slots out of a match's state."""
+    return [_get_slot_from_fields(slot_id, fields) for slot_id in range(NUM_SLOTS)]
+
+
+def make_default_slot() -> Slot:
+    return {
         "status": slotStatuses.FREE,
         "team": matchTeams.NO_TEAM,
         "user_id": -1,
@@ -43,25 +73,26 @@ async def create_slot(match_id: int, slot_id: int) -> Slot:
         "failed": False,
         "passed": True,
     }
-    await glob.redis.set(make_key(match_id, slot_id), orjson.dumps(slot))
+
+
+async def create_slot(match_id: int, slot_id: int) -> Slot:
+    slot = make_default_slot()
+    await match_state.set_fields(match_id, _make_slot_changes(slot_id, dict(slot)))
     return slot
 
 
 async def get_slot(match_id: int, slot_id: int) -> Slot | None:
-    slot = await glob.redis.get(make_key(match_id, slot_id))
-    if slot is None:
+    fields = await match_state.get_fields(match_id, make_fields(slot_id))
+    if fields is None:
         return None
-    return cast(Slot, orjson.loads(slot))
+    return _get_slot_from_fields(slot_id, fields)
 
 
 async def get_slots(match_id: int) -> list[Slot]:
-    keys = [make_key(match_id, slot_id) for slot_id in range(16)]
-    raw_slots = await glob.redis.mget(keys)
-    slots = []
-    for raw_slot in raw_slots:
-        assert raw_slot is not None
-        slots.append(orjson.loads(raw_slot))
-    return cast(list[Slot], slots)
+    fields = await match_state.get_fields(match_id, make_all_fields())
+    if fields is None:
+        return []
+    return get_slots_from_fields(fields)
 
 
 async def update_slot(
@@ -80,42 +111,68 @@ async def update_slot(
     failed: bool | None = None,
     passed: bool | None = None,
 ) -> Slot | None:
-    slot = await get_slot(match_id, slot_id)
-    if slot is None:
-        return None
+    changes: dict[str, Any] = {}
 
     if status is not None:
-        slot["status"] = status
+        changes["status"] = status
     if team is not None:
-        slot["team"] = team
+        changes["team"] = team
     if user_id is not None:
-        slot["user_id"] = user_id
+        changes["user_id"] = user_id
     if user_token != "":
-        slot["user_token"] = user_token
+        changes["user_token"] = user_token
     if mods is not None:
-        slot["mods"] = mods
+        changes["mods"] = mods
     if loaded is not None:
-        slot["loaded"] = loaded
+        changes["loaded"] = loaded
     if skip is not None:
-        slot["skip"] = skip
+        changes["skip"] = skip
     if complete is not None:
-        slot["complete"] = complete
+        changes["complete"] = complete
     if score is not None:
-        slot["score"] = score
+        changes["score"] = score
     if failed is not None:
-        slot["failed"] = failed
+        changes["failed"] = failed
     if passed is not None:
-        slot["passed"] = passed
+        changes["passed"] = passed
+
+    fields = await match_state.update_fields(
+        match_id,
+        _make_slot_changes(slot_id, changes),
+        return_fields=make_fields(slot_id),
+    )
+    if fields is None:
+        return None
+    return _get_slot_from_fields(slot_id, fields)
 
-    await glob.redis.set(make_key(match_id, slot_id), orjson.dumps(slot))
-    return slot
+
+async def update_slots(
+    match_id: int,
+    changes_by_slot_id: dict[int, dict[str, Any]],
+) -> list[Slot] | None:
+    """\
+    Apply changes to any number of a match's slots at once,
+    and return all of its slots as they are afterwards.
+    """
+    changes: dict[str, Any] = {}
+    for slot_id, slot_changes in changes_by_slot_id.items():
+        changes |= _make_slot_changes(slot_id, slot_changes)
+
+    fields = await match_state.update_fields(
+        match_id,
+        changes,
+        return_fields=make_all_fields(),
+    )
+    if fields is None:
+        return None
+    return get_slots_from_fields(fields)
 
 
 async def delete_slot(match_id: int, slot_id: int) -> None:
     # TODO: should we throw error when no slot exists?
-    await glob.redis.delete(make_key(match_id, slot_id))
+    await match_state.delete_fields(match_id, make_fields(slot_id))
 
 
 async def delete_slots(match_id: int) -> None:
     # TODO: should we throw error when no slots exist?
-    await glob.redis.delete(*await glob.redis.keys(make_key(match_id, "*")))
+    await match_state.delete_fields(match_id, make_all_fields())
@@ -1,9 +1,19 @@
 from __future__ import annotations
 
 import logging
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from typing import Any
 from typing import TypedDict
 
+import settings
 from objects import glob
+from objects import stream_mirror
+from objects import stream_watermarks
+
+if TYPE_CHECKING:
+    from redis.commands.core import AsyncScript
 
 
 def make_key(stream_name: str) -> str:
@@ -14,6 +24,146 @@ class StreamMessage(TypedDict):
     stream_key: str
     packet_data: bytes
     excluded_token_ids: str
+    # only deliver to (or never deliver to) these users, if non-empty
+    # (sorted, fixed-width user ids; see stream_mirror.encode_user_ids)
+    included_user_ids: str
+    excluded_user_ids: str
+    # only the latest message with a given coalesce key is kept, if non-empty
+    coalesce_key: str
+
+
+class StreamRetention(TypedDict):
+    max_age: int  # in seconds
+    max_length: int | None  # in messages, approximately
+
+
+SHARED_STREAM_RETENTION: StreamRetention = {"max_age": 5 * 60, "max_length": 10_000}
+TOKEN_STREAM_RETENTION: StreamRetention = {"max_age": 5 * 60, "max_length": None}
+SPECTATOR_STREAM_RETENTION: StreamRetention = {"max_age": 60, "max_length": 2_000}
+DEFAULT_STREAM_RETENTION: StreamRetention = {"max_age": 5 * 60, "max_length": 2_000}
+
+
+def get_stream_retention(stream_name: str) -> StreamRetention:
+    if stream_name in ("main", "lobby", "staff"):
+        return SHARED_STREAM_RETENTION
+    elif stream_name.startswith("tokens/"):
+        return TOKEN_STREAM_RETENTION
+    elif stream_name.startswith("spect/"):
+        return SPECTATOR_STREAM_RETENTION
+    else:
+        return DEFAULT_STREAM_RETENTION
+
+
+# (zset[stream_name, last written time])
+def make_activity_key() -> str:
+    return "bancho:stream_activity"
+
+
+# (hash[coalesce_key, message_id])
+def make_coalesced_key(stream_name: str) -> str:
+    return f"bancho:streams:{stream_name}:coalesced"
+
+
+def make_coalesce_key(packet_id: int, user_id: int) -> str:
+    return f"{packet_id}:{user_id}"
+
+
+# Add a message to a stream, trimming it to its retention as we go,
+# and announce the message's id to other processes. If the message has
+# a coalesce key, the previous message with the same key is deleted.
+# KEYS[1]: the stream's key
+# KEYS[2]: the stream activity zset
+# KEYS[3]: the stream's coalesced messages hash
+# ARGV[1]: the notification channel
+# ARGV[2]: the stream's name
+# ARGV[3]: the current time, in seconds
+# ARGV[4]: the minimum message id to keep
+# ARGV[5]: the maximum number of messages to keep, or an empty string
+# ARGV[6]: the message's coalesce key, or an empty string
+# ARGV[7]: the maximum age of messages to keep, in seconds
+# ARGV[8..]: the message's fields and values
+BROADCAST_DATA_SCRIPT = """
+local message_id
+if ARGV[5] ~= "" then
+    message_id = redis.call("XADD", KEYS[1], "MAXLEN", "~", ARGV[5], "*", unpack(ARGV, 8))
+else
+    message_id = redis.call("XADD", KEYS[1], "*", unpack(ARGV, 8))
+end
+redis.call("XTRIM", KEYS[1], "MINID", "~", ARGV[4])
+if ARGV[6] ~= "" then
+    local previous_message_id = redis.call("HGET", KEYS[3], ARGV[6])
+    if previous_message_id then
+        redis.call("XDEL", KEYS[1], previous_message_id)
+    end
+    redis.call("HSET", KEYS[3], ARGV[6], message_id)
+    redis.call("EXPIRE", KEYS[3], ARGV[7])
+end
+redis.call("ZADD", KEYS[2], ARGV[3], ARGV[2])
+redis.call("PUBLISH", ARGV[1], KEYS[1] .. " " .. message_id)
+return message_id
+"""
+
+_broadcast_data_script: AsyncScript | None = None
+
+
+def _get_broadcast_data_script() -> AsyncScript:
+    global _broadcast_data_script
+    if _broadcast_data_script is None:
+        _broadcast_data_script = glob.redis.register_script(BROADCAST_DATA_SCRIPT)
+    return _broadcast_data_script
+
+
+async def _broadcast(keys: list[str], args: list[Any]) -> None:
+    broadcast_data_script = _get_broadcast_data_script()
+    message_id: bytes = await broadcast_data_script(keys=keys, args=args)
+    stream_watermarks.record_message_id(keys[0], message_id.decode())
+
+
+def _make_broadcast_data_args(
+    stream_name: str,
+    data: bytes,
+    excluded_token_ids: list[str],
+    *,
+    included_user_ids: list[int] | None = None,
+    excluded_user_ids: list[int] | None = None,
+    coalesce_key: str | None = None,
+) -> tuple[list[str], list[Any]]:
+    stream_key = make_key(stream_name)
+    fields: StreamMessage = {
+        "stream_key": stream_key,
+        "packet_data": data,
+        "excluded_token_ids": ",".join(excluded_token_ids),
+        "included_user_ids": stream_mirror.encode_user_ids(included_user_ids or []),
+        "excluded_user_ids": stream_mirror.encode_user_ids(excluded_user_ids or []),
+        "coalesce_key": coalesce_key or "",
+    }
+    current_time = time.time()
+    retention = get_stream_retention(stream_name)
+    min_id = make_min_id(current_time - retention["max_age"])
+
+    keys = [stream_key, make_activity_key(), make_coalesced_key(stream_name)]
+    args = [
+        stream_watermarks.STREAM_MESSAGES_CHANNEL,
+        stream_name,
+        current_time,
+        min_id,
+        retention["max_length"] or "",
+        fields["coalesce_key"],
+        retention["max_age"],
+        "stream_key",
+        fields["stream_key"],
+        "packet_data",
+        fields["packet_data"],
+        "excluded_token_ids",
+        fields["excluded_token_ids"],
+        "included_user_ids",
+        fields["included_user_ids"],
+        "excluded_user_ids",
+        fields["excluded_user_ids"],
+        "coalesce_key",
+        fields["coalesce_key"],
+    ]
+    return keys, args
 
 
 async def broadcast_data(
@@ -26,63 +176,451 @@ async def broadcast_data(
     if excluded_token_ids is None:
         excluded_token_ids = []
 
-    stream_key = make_key(stream_name)
-    fields: StreamMessage = {
-        "stream_key": stream_key,
-        "packet_data": data,
-        "excluded_token_ids": ",".join(excluded_token_ids),
-    }
-    await glob.redis.xadd(stream_key, fields)
+    keys, args = _make_broadcast_data_args(stream_name, data, excluded_token_ids)
+    await _broadcast(keys, args)
 
 
-async def _get_token_stream_offsets(token_id: str) -> dict[str, str]:
-    return {
-        stream_key.decode(): stream_offset.decode()
-        for stream_key, stream_offset in (
-            await glob.redis.hgetall(f"bancho:tokens:{token_id}:stream_offsets")
-        ).items()
-    }
+async def broadcast_latest_data(
+    stream_name: str,
+    data: bytes,
+    *,
+    coalesce_key: str,
+    excluded_token_ids: list[str] | None = None,
+) -> None:
+    """\
+    Send some data to all clients connected to this stream, replacing any
+    data previously sent with the same coalesce key which hasn't been read
+    yet. Used for packets where only the latest value matters (e.g. a user's
+    presence or stats), so that slow readers don't receive outdated copies.
+    """
+    if excluded_token_ids is None:
+        excluded_token_ids = []
 
+    keys, args = _make_broadcast_data_args(
+        stream_name,
+        data,
+        excluded_token_ids,
+        coalesce_key=coalesce_key,
+    )
+    await _broadcast(keys, args)
 
-async def _set_token_stream_offsets(
-    token_id: str,
-    stream_offsets: dict[str, str],
+
+async def multicast_data(
+    stream_name: str,
+    data: bytes,
+    *,
+    included_user_ids: list[int] | None = None,
+    excluded_user_ids: list[int] | None = None,
 ) -> None:
-    await glob.redis.hmset(
-        f"bancho:tokens:{token_id}:stream_offsets",
-        stream_offsets,  # type: ignore[arg-type]
+    """\
+    Send some data to only some of the users connected to this stream, as a
+    single message. Recipients are decided as the message is read, so this
+    costs the same no matter how many users the stream has.
+
+    :param included_user_ids: if given, only these users will receive the data
+    :param excluded_user_ids: if given, these users will not receive the data
+    """
+    if included_user_ids is not None and not included_user_ids:
+        return
+
+    keys, args = _make_broadcast_data_args(
+        stream_name,
+        data,
+        [],
+        included_user_ids=included_user_ids,
+        excluded_user_ids=excluded_user_ids,
     )
+    await _broadcast(keys, args)
 
 
-async def read_all_pending_data(token_id: str) -> bytes:
-    """Read all data sent to these streams, excluding data sent by the client."""
-    stream_offsets = await _get_token_stream_offsets(token_id)
-    if not stream_offsets:
-        logging.warning(
-            "Token is connected to no streams",
-            extra={"token_id": token_id},
+async def broadcast_data_to_streams(data_by_stream_name: dict[str, bytes]) -> None:
+    """Send some data to each of a number of streams, in a single round trip."""
+    if not data_by_stream_name:
+        return
+
+    broadcast_data_script = _get_broadcast_data_script()
+    stream_keys: list[str] = []
+    async with glob.redis.pipeline() as pipe:
+        for stream_name, data in data_by_stream_name.items():
+            keys, args = _make_broadcast_data_args(stream_name, data, [])
+            stream_keys.append(keys[0])
+            await broadcast_data_script(keys=keys, args=args, client=pipe)
+        message_ids: list[bytes] = await pipe.execute()
+
+    for stream_key, message_id in zip(stream_keys, message_ids):
+        stream_watermarks.record_message_id(stream_key, message_id.decode())
+
+
+# Read what a token has not yet seen from the streams it's joined, up to
+# a budget, skipping messages not meant for it, and advance its offsets to
+# match. At least one message is read, however large it is.
+# Every stream read must be passed in KEYS, so the caller passes the
+# streams it expects the token to have joined. If the token has joined
+# any others, nothing is read, and the caller should try again with them.
+# Returns the pending data, the token's resulting offsets, its user id,
+# 1 if the budget was hit (i.e. there may be more to read), else 0, and
+# 1 if the token has joined streams which weren't passed, else 0.
+# KEYS[1]: the token's stream offsets hash
+# KEYS[2]: the token's hash
+# KEYS[3..]: keys of the streams to read
+# ARGV[1]: the token's id
+# ARGV[2]: the maximum number of bytes to read
+# ARGV[3]: the maximum number of messages to read, per stream
+# ARGV[4..]: keys of streams to leave unread (i.e. mirrored in memory)
+READ_ALL_PENDING_DATA_SCRIPT = """
+local offsets = redis.call("HGETALL", KEYS[1])
+if #offsets == 0 then
+    return false
+end
+
+local user_id = redis.call("HGET", KEYS[2], "user_id") or ""
+
+local skipped_stream_keys = {}
+for i = 4, #ARGV do
+    skipped_stream_keys[ARGV[i]] = true
+end
+
+local readable_stream_keys = {}
+for i = 3, #KEYS do
+    readable_stream_keys[KEYS[i]] = true
+end
+
+local stream_keys = {}
+local stream_offsets = {}
+for i = 1, #offsets, 2 do
+    if not skipped_stream_keys[offsets[i]] then
+        if not readable_stream_keys[offsets[i]] then
+            return {"", offsets, user_id, 0, 1}
+        end
+        stream_keys[#stream_keys + 1] = offsets[i]
+        stream_offsets[#stream_offsets + 1] = offsets[i + 1]
+    end
+end
+
+if #stream_keys == 0 then
+    return {"", offsets, user_id, 0, 0}
+end
+
+local max_bytes = tonumber(ARGV[2])
+local max_messages = tonumber(ARGV[3])
+
+local xread_args = {"COUNT", max_messages, "STREAMS"}
+for i = 1, #stream_keys do
+    xread_args[3 + i] = stream_keys[i]
+    xread_args[3 + #stream_keys + i] = stream_offsets[i]
+end
+
+local streams = redis.call("XREAD", unpack(xread_args))
+if not streams then
+    return {"", offsets, user_id, 0, 0}
+end
+
+local function contains(list, item)
+    return string.find("," .. list .. ",", "," .. item .. ",", 1, true) ~= nil
+end
+
+local user_id_width = 10
+local padded_user_id = user_id ~= "" and string.format("%010d", tonumber(user_id)) or ""
+
+-- user id lists are sorted and fixed-width, so they can be binary searched
+local function has_user_id(user_ids)
+    if string.find(user_ids, ",", 1, true) or #user_ids % user_id_width ~= 0 then
+        -- written before user id lists were sorted
+        return contains(user_ids, user_id)
+    end
+    if padded_user_id == "" then
+        return false
+    end
+
+    local low = 0
+    local high = #user_ids / user_id_width - 1
+    while low <= high do
+        local mid = math.floor((low + high) / 2)
+        local candidate = string.sub(
+            user_ids,
+            mid * user_id_width + 1,
+            (mid + 1) * user_id_width
         )
-        return b""
+        if candidate == padded_user_id then
+            return true
+        elseif candidate < padded_user_id then
+            low = mid + 1
+        else
+            high = mid - 1
+        end
+    end
+    return false
+end
 
-    data = await glob.redis.xread(stream_offsets)
+local pending_data = {}
+local num_bytes = 0
+local new_offsets = {}
+local over_budget = false
+local truncated = 0
 
+for _, stream in ipairs(streams) do
+    local messages = stream[2]
+    local last_message_id = nil
+    if #messages >= max_messages then
+        truncated = 1
+    end
+
+    for _, message in ipairs(messages) do
+        local fields = message[2]
+        local packet_data = ""
+        local excluded_token_ids = ""
+        local included_user_ids = ""
+        local excluded_user_ids = ""
+        for i = 1, #fields, 2 do
+            if fields[i] == "packet_data" then
+                packet_data = fields[i + 1]
+            elseif fields[i] == "excluded_token_ids" then
+                excluded_token_ids = fields[i + 1]
+            elseif fields[i] == "included_user_ids" then
+                included_user_ids = fields[i + 1]
+            elseif fields[i] == "excluded_user_ids" then
+                excluded_user_ids = fields[i + 1]
+            end
+        end
+
+        if (excluded_token_ids == "" or not contains(excluded_token_ids, ARGV[1]))
+            and (included_user_ids == "" or has_user_id(included_user_ids))
+            and (excluded_user_ids == "" or not has_user_id(excluded_user_ids)) then
+            if num_bytes > 0 and num_bytes + #packet_data > max_bytes then
+                over_budget = true
+                break
+            end
+            pending_data[#pending_data + 1] = packet_data
+            num_bytes = num_bytes + #packet_data
+        end
+
+        last_message_id = message[1]
+    end
+
+    if last_message_id then
+        new_offsets[#new_offsets + 1] = stream[1]
+        new_offsets[#new_offsets + 1] = last_message_id
+    end
+
+    if over_budget then
+        truncated = 1
+        break
+    end
+end
+
+if #new_offsets > 0 then
+    redis.call("HSET", KEYS[1], unpack(new_offsets))
+    offsets = redis.call("HGETALL", KEYS[1])
+end
+
+return {table.concat(pending_data), offsets, user_id, truncated, 0}
+"""
+
+_read_all_pending_data_script: AsyncScript | None = None
+
+
+def _get_read_all_pending_data_script() -> AsyncScript:
+    global _read_all_pending_data_script
+    if _read_all_pending_data_script is None:
+        _read_all_pending_data_script = glob.redis.register_script(
+            READ_ALL_PENDING_DATA_SCRIPT,
+        )
+    return _read_all_pending_data_script
+
+
+MAX_CACHED_TOKENS = 50_000
+# a token's streams may change between our attempts at reading them
+MAX_READ_ATTEMPTS = 3
+
+# (token id -> keys of the streams it had joined, as of its last read)
+_token_stream_keys: OrderedDict[str, list[str]] = OrderedDict()
+
+
+def _set_token_stream_keys(token_id: str, stream_keys: list[str]) -> None:
+    _token_stream_keys[token_id] = stream_keys
+    _token_stream_keys.move_to_end(token_id)
+    if len(_token_stream_keys) > MAX_CACHED_TOKENS:
+        _token_stream_keys.popitem(last=False)
+
+
+async def _read_stream_directly(
+    stream_key: str,
+    stream_offset: str,
+    token_id: str,
+    user_id: str,
+    *,
+    max_bytes: int,
+    max_messages: int,
+) -> tuple[bytes, str, bool]:
+    data = await glob.redis.xread({stream_key: stream_offset}, count=max_messages)
+    if not data:
+        return b"", stream_offset, False
+
+    stream_data = data[0][1]
+    truncated = len(stream_data) >= max_messages
+
+    pending_data = bytearray()
+    for message_id, fields in stream_data:
+        if stream_mirror.is_recipient(fields, token_id, user_id):
+            packet_data = fields[b"packet_data"]
+            # always send at least one message, however large
+            if pending_data and len(pending_data) + len(packet_data) > max_bytes:
+                truncated = True
+                break
+
+            pending_data += packet_data
+
+        stream_offset = message_id.decode()
+
+    return bytes(pending_data), stream_offset, truncated
+
+
+async def _read_mirrored_streams(
+    token_id: str,
+    user_id: str,
+    stream_offsets: dict[str, str],
+    *,
+    max_bytes: int,
+    max_messages: int,
+) -> tuple[bytes, bool]:
+    """\
+    Read the token's pending data from streams mirrored in memory, up to a
+    budget, and advance its offsets. Offsets which have fallen out of the
+    mirrored window are read from redis directly.
+    """
     pending_data = bytearray()
     new_stream_offsets: dict[str, str] = {}
+    truncated = False
 
-    for stream_key, stream_data in data:
-        message_id: bytes | None = None
-        for message_id, fields in stream_data:
-            excluded_token_ids = fields[b"excluded_token_ids"].decode().split(",")
-            if token_id in excluded_token_ids:
-                continue
+    for stream_key, stream_offset in stream_offsets.items():
+        mirrored_stream = stream_mirror.get_mirrored_stream(stream_key)
+        if mirrored_stream is None:
+            continue
 
-            pending_data += fields[b"packet_data"]
+        remaining_bytes = max_bytes - len(pending_data)
+        if remaining_bytes <= 0:
+            truncated = True
+            break
 
-        if message_id is not None:
-            new_stream_offsets[stream_key.decode()] = message_id.decode()
+        result = mirrored_stream.read_after(
+            stream_watermarks.parse_message_id(stream_offset),
+            token_id,
+            user_id,
+            max_bytes=remaining_bytes,
+            max_messages=max_messages,
+        )
+        if result is not None:
+            stream_data, new_offset, stream_truncated = result
+            new_stream_offset = f"{new_offset[0]}-{new_offset[1]}"
+        else:
+            (
+                stream_data,
+                new_stream_offset,
+                stream_truncated,
+            ) = await _read_stream_directly(
+                stream_key,
+                stream_offset,
+                token_id,
+                user_id,
+                max_bytes=remaining_bytes,
+                max_messages=max_messages,
+            )
+
+        pending_data += stream_data
+        truncated = truncated or stream_truncated
+        if new_stream_offset != stream_offset:
+            new_stream_offsets[stream_key] = new_stream_offset
 
     if new_stream_offsets:
-        await _set_token_stream_offsets(token_id, new_stream_offsets)
+        await glob.redis.hset(
+            f"bancho:tokens:{token_id}:stream_offsets",
+            mapping=new_stream_offsets,  # type: ignore[arg-type]
+        )
+        stream_offsets.update(new_stream_offsets)
+
+    return bytes(pending_data), truncated
+
+
+async def read_all_pending_data(token_id: str) -> bytes:
+    """\
+    Read data sent to these streams, excluding data sent by the client.
+
+    Reads are limited to a budget per poll; anything left
+    over is read on the token's next poll instead.
+    """
+    if not stream_watermarks.has_pending_data(token_id):
+        return b""
+
+    generation = stream_watermarks.get_token_streams_generation()
+    mirrored_stream_keys = stream_mirror.get_mirrored_stream_keys()
+
+    max_bytes = settings.APP_POLL_MAX_BYTES
+    max_messages = settings.APP_POLL_MAX_MESSAGES
+
+    read_all_pending_data_script = _get_read_all_pending_data_script()
+    for _ in range(MAX_READ_ATTEMPTS):
+        result: list[Any] | None = await read_all_pending_data_script(
+            keys=[
+                f"bancho:tokens:{token_id}:stream_offsets",
+                f"bancho:tokens:{token_id}",
+                *_token_stream_keys.get(token_id, []),
+            ],
+            args=[token_id, max_bytes, max_messages, *mirrored_stream_keys],
+        )
+        if result is None:
+            logging.warning(
+                "Token is connected to no streams",
+                extra={"token_id": token_id},
+            )
+            return b""
+
+        raw_stream_offsets: list[bytes] = result[1]
+        stream_offsets = {
+            stream_key.decode(): stream_offset.decode()
+            for stream_key, stream_offset in zip(
+                raw_stream_offsets[::2],
+                raw_stream_offsets[1::2],
+            )
+        }
+        _set_token_stream_keys(
+            token_id,
+            [
+                stream_key
+                for stream_key in stream_offsets
+                if stream_key not in mirrored_stream_keys
+            ],
+        )
+
+        if result[4] == 0:
+            break
+        # otherwise the token has joined streams we didn't know of, so try
+        # again with them
+    else:
+        # (they'll be read on the token's next poll instead)
+        return b""
+
+    pending_data: bytes = result[0]
+    user_id: str = result[2].decode()
+    truncated = result[3] == 1
+
+    if mirrored_stream_keys and not truncated:
+        mirrored_data, truncated = await _read_mirrored_streams(
+            token_id,
+            user_id,
+            stream_offsets,
+            max_bytes=max_bytes - len(pending_data),
+            max_messages=max_messages,
+        )
+        pending_data += mirrored_data
+
+    # the offsets of a token with more left to read aren't the latest
+    # message ids of its streams, so they mustn't be used as such
+    if not truncated:
+        stream_watermarks.record_token_stream_offsets(
+            token_id,
+            stream_offsets,
+            generation=generation,
+        )
 
     return pending_data
 
@@ -95,6 +633,74 @@ async def get_latest_message_id(stream_name: str) -> str:
     return message_id.decode()
 
 
+def make_min_id(oldest_time: float) -> str:
+    return f"{int(oldest_time * 1000)}-0"
+
+
 async def trim_stream_messages(stream_name: str, min_id: str) -> int:
     num_messages: int = await glob.redis.xtrim(make_key(stream_name), minid=min_id)
     return num_messages
+
+
+async def get_idle_stream_names(idle_since: float) -> list[str]:
+    """Get the names of all streams which haven't been written to since `idle_since`."""
+    raw_stream_names: list[bytes] = await glob.redis.zrangebyscore(
+        make_activity_key(),
+        "-inf",
+        idle_since,
+    )
+    return [stream_name.decode() for stream_name in raw_stream_names]
+
+
+STREAM_SCAN_BATCH_SIZE = 500
+
+
+async def track_untracked_streams() -> int:
+    """\
+    Start tracking the activity of streams which aren't tracked (e.g. ones
+    created before activity was tracked, or written to without broadcasting),
+    as of their latest message. Returns the number of streams found.
+    """
+    num_streams = 0
+    stream_keys: list[bytes] = []
+    async for stream_key in glob.redis.scan_iter(
+        match=make_key("*"),
+        count=STREAM_SCAN_BATCH_SIZE,
+        _type="STREAM",
+    ):
+        stream_keys.append(stream_key)
+        if len(stream_keys) >= STREAM_SCAN_BATCH_SIZE:
+            num_streams += await _track_streams(stream_keys)
+            stream_keys = []
+
+    if stream_keys:
+        num_streams += await _track_streams(stream_keys)
+
+    return num_streams
+
+
+async def _track_streams(stream_keys: list[bytes]) -> int:
+    async with glob.redis.pipeline() as pipe:
+        for stream_key in stream_keys:
+            await pipe.xrevrange(stream_key, count=1)
+        latest_messages: list[list[tuple[bytes, Any]]] = await pipe.execute()
+
+    last_written_times: dict[str, float] = {}
+    for stream_key, messages in zip(stream_keys, latest_messages):
+        stream_name = stream_key.decode().removeprefix("bancho:streams:")
+        stream_name = stream_name.removesuffix(":messages")
+
+        last_written_time = 0.0
+        if messages:
+            milliseconds, _, _ = messages[0][0].decode().partition("-")
+            last_written_time = int(milliseconds) / 1000
+        last_written_times[stream_name] = last_written_time
+
+    # streams already tracked were written to more recently
+    await glob.redis.zadd(make_activity_key(), last_written_times, nx=True)  # type: ignore[arg-type]
+    return len(stream_keys)
+
+
+async def forget_idle_streams(idle_since: float) -> None:
+    """Stop tracking streams which haven't been written to since `idle_since`."""
+    await glob.redis.zremrangebyscore(make_activity_key(), "-inf", idle_since)
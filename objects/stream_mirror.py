@@ -0,0 +1,216 @@
+"""\
+A process-local mirror of the busiest shared streams (e.g. main, lobby).
+
+Rather than having every client poll read the same messages from redis,
+each process follows these streams with a single reader, and holds their
+most recent messages in memory for polls to be served from.
+
+Each mirrored stream holds every message after some id (its "start"), up
+to a bounded number of messages. Offsets older than that fall outside of
+the window, and must be read from redis instead.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+from collections import deque
+from collections.abc import Iterable
+
+from common.log import logger
+from objects import glob
+from objects.stream_watermarks import MessageID
+from objects.stream_watermarks import parse_message_id
+
+READ_BLOCK_TIME = 1000  # in milliseconds
+RECONNECT_DELAY = 1  # in seconds
+
+
+USER_ID_WIDTH = 10
+
+
+def encode_user_ids(user_ids: Iterable[int]) -> str:
+    """\
+    Encode a list of user ids for a stream message, as sorted fixed-width
+    numbers, so that each reader can binary search it for their own id.
+    """
+    return "".join(f"{user_id:0{USER_ID_WIDTH}d}" for user_id in sorted(set(user_ids)))
+
+
+def has_user_id(user_ids: bytes, user_id: str) -> bool:
+    if b"," in user_ids or len(user_ids) % USER_ID_WIDTH != 0:
+        # written before user id lists were sorted
+        return user_id.encode() in user_ids.split(b",")
+    if not user_id:
+        return False
+
+    padded_user_id = f"{int(user_id):0{USER_ID_WIDTH}d}".encode()
+    num_user_ids = len(user_ids) // USER_ID_WIDTH
+    i = bisect.bisect_left(
+        range(num_user_ids),
+        padded_user_id,
+        key=lambda i: user_ids[i * USER_ID_WIDTH : (i + 1) * USER_ID_WIDTH],
+    )
+    return (
+        i < num_user_ids
+        and user_ids[i * USER_ID_WIDTH : (i + 1) * USER_ID_WIDTH] == padded_user_id
+    )
+
+
+def is_recipient(fields: dict[bytes, bytes], token_id: str, user_id: str) -> bool:
+    """Whether a stream message should be delivered to the given token."""
+    excluded_token_ids = fields.get(b"excluded_token_ids")
+    if excluded_token_ids and token_id.encode() in excluded_token_ids.split(b","):
+        return False
+
+    included_user_ids = fields.get(b"included_user_ids")
+    if included_user_ids and not has_user_id(included_user_ids, user_id):
+        return False
+
+    excluded_user_ids = fields.get(b"excluded_user_ids")
+    if excluded_user_ids and has_user_id(excluded_user_ids, user_id):
+        return False
+
+    return True
+
+
+class MirroredStream:
+    def __init__(self, start_id: MessageID, max_messages: int) -> None:
+        self.start_id = start_id
+        self.last_id = start_id
+        # (message id, message fields)
+        self.messages: deque[tuple[MessageID, dict[bytes, bytes]]] = deque()
+        self.max_messages = max_messages
+
+    def append(self, message_id: MessageID, fields: dict[bytes, bytes]) -> None:
+        self.messages.append((message_id, fields))
+        self.last_id = message_id
+
+        if len(self.messages) > self.max_messages:
+            evicted_message = self.messages.popleft()
+            self.start_id = evicted_message[0]
+
+    def read_after(
+        self,
+        offset: MessageID,
+        token_id: str,
+        user_id: str,
+        *,
+        max_bytes: int,
+        max_messages: int,
+    ) -> tuple[bytes, MessageID, bool] | None:
+        """\
+        Read messages after `offset` meant for the token, up to a budget, and
+        return them along with the new offset, and whether the budget was
+        hit. Returns None if the offset is outside of the mirrored window.
+        """
+        if offset < self.start_id:
+            return None
+
+        if offset >= self.last_id:
+            return b"", offset, False
+
+        # (message id, packet data if it's meant for the token)
+        unread_messages: list[tuple[MessageID, bytes | None]] = []
+        seen_coalesce_keys: set[bytes] = set()
+        for message_id, fields in reversed(self.messages):
+            if message_id <= offset:
+                break
+
+            packet_data: bytes | None = None
+            if is_recipient(fields, token_id, user_id):
+                # messages deleted from redis after being mirrored are still
+                # here, so only deliver the latest of any coalesced messages
+                coalesce_key = fields.get(b"coalesce_key")
+                if not coalesce_key or coalesce_key not in seen_coalesce_keys:
+                    if coalesce_key:
+                        seen_coalesce_keys.add(coalesce_key)
+                    packet_data = fields[b"packet_data"]
+
+            unread_messages.append((message_id, packet_data))
+
+        unread_messages.reverse()
+
+        pending_messages: list[bytes] = []
+        num_bytes = 0
+        truncated = False
+        for num_messages, (message_id, packet_data) in enumerate(unread_messages):
+            if num_messages >= max_messages:
+                truncated = True
+                break
+
+            if packet_data is not None:
+                # always send at least one message, however large
+                if num_bytes > 0 and num_bytes + len(packet_data) > max_bytes:
+                    truncated = True
+                    break
+
+                pending_messages.append(packet_data)
+                num_bytes += len(packet_data)
+
+            offset = message_id
+
+        return b"".join(pending_messages), offset, truncated
+
+
+# (stream key -> mirrored stream), for streams we're currently following
+_mirrored_streams: dict[str, MirroredStream] = {}
+
+
+def get_mirrored_stream(stream_key: str) -> MirroredStream | None:
+    return _mirrored_streams.get(stream_key)
+
+
+def get_mirrored_stream_keys() -> list[str]:
+    return list(_mirrored_streams)
+
+
+async def _get_latest_message_id(stream_key: str) -> MessageID:
+    data = await glob.redis.xrevrange(stream_key, count=1)
+    if not data:
+        return (0, 0)
+    return parse_message_id(data[0][0].decode())
+
+
+async def follow_streams(stream_keys: list[str], max_messages: int) -> None:
+    """Mirror the given streams into memory, for the lifetime of the process."""
+    while True:
+        try:
+            stream_offsets: dict[str, MessageID] = {}
+            for stream_key in stream_keys:
+                latest_message_id = await _get_latest_message_id(stream_key)
+                stream_offsets[stream_key] = latest_message_id
+                _mirrored_streams[stream_key] = MirroredStream(
+                    start_id=latest_message_id,
+                    max_messages=max_messages,
+                )
+
+            logger.info(
+                "Mirroring shared streams",
+                extra={"stream_keys": stream_keys},
+            )
+
+            while True:
+                data = await glob.redis.xread(
+                    {
+                        stream_key: f"{offset[0]}-{offset[1]}"
+                        for stream_key, offset in stream_offsets.items()
+                    },
+                    block=READ_BLOCK_TIME,
+                )
+                for raw_stream_key, messages in data:
+                    stream_key = raw_stream_key.decode()
+                    mirrored_stream = _mirrored_streams[stream_key]
+
+                    for raw_message_id, fields in messages:
+                        message_id = parse_message_id(raw_message_id.decode())
+                        mirrored_stream.append(message_id, fields)
+
+                    stream_offsets[stream_key] = mirrored_stream.last_id
+        except asyncio.CancelledError:
+            _mirrored_streams.clear()
+            raise
+        except Exception:
+            logger.exception("Lost connection while mirroring shared streams")
+            _mirrored_streams.clear()
+            await asyncio.sleep(RECONNECT_DELAY)
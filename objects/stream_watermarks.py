@@ -0,0 +1,179 @@
+"""\
+A process-local cache of the latest message id ("high-water mark") of each
+stream, used to answer idle client polls without a round trip to redis.
+
+Every message written to a stream is announced on a redis pubsub channel,
+as is every change to a token's set of joined streams. As long as we're
+subscribed, a token whose last-known offsets are all at (or beyond) the
+high-water mark of their streams has nothing new to read.
+
+Everything here errs on the side of reporting pending data; a false
+positive only costs us the redis read we would have done anyway.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+
+from common.log import logger
+from objects import glob
+
+STREAM_MESSAGES_CHANNEL = "bancho:streams:notifications:messages"
+TOKEN_STREAMS_CHANNEL = "bancho:streams:notifications:tokens"
+
+MAX_CACHED_STREAMS = 100_000
+MAX_CACHED_TOKENS = 50_000
+
+RECONNECT_DELAY = 1  # in seconds
+
+MessageID = tuple[int, int]
+
+# (stream key -> latest message id)
+_stream_watermarks: OrderedDict[str, MessageID] = OrderedDict()
+# (token id -> (stream key -> offset))
+_token_stream_offsets: OrderedDict[str, dict[str, MessageID]] = OrderedDict()
+
+# incremented whenever any token's joined streams change, so that we can
+# tell whether offsets read from redis may have been outdated by the time
+# they came back to us
+_token_streams_generation = 0
+
+_subscribed = False
+
+POLL_STATS = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+def parse_message_id(message_id: str) -> MessageID:
+    milliseconds, _, sequence = message_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def get_token_streams_generation() -> int:
+    return _token_streams_generation
+
+
+def _set_stream_watermark(stream_key: str, message_id: MessageID) -> None:
+    current_watermark = _stream_watermarks.get(stream_key)
+    if current_watermark is None or message_id > current_watermark:
+        _stream_watermarks[stream_key] = message_id
+    _stream_watermarks.move_to_end(stream_key)
+
+    if len(_stream_watermarks) > MAX_CACHED_STREAMS:
+        _stream_watermarks.popitem(last=False)
+
+
+def record_message_id(stream_key: str, message_id: str) -> None:
+    """\
+    Advance a stream's high-water mark to a message we've just written, so
+    that polls we answer before its notification arrives don't miss it.
+    """
+    if not _subscribed:
+        return
+
+    _set_stream_watermark(stream_key, parse_message_id(message_id))
+
+
+def record_token_stream_offsets(
+    token_id: str,
+    stream_offsets: dict[str, str],
+    *,
+    generation: int,
+) -> None:
+    """\
+    Remember a token's stream offsets, as they were immediately after
+    it read all of its pending data. The offsets of a drained token are
+    also the latest message ids of its streams at the time of the read.
+    """
+    if not _subscribed or generation != _token_streams_generation:
+        return
+
+    parsed_offsets = {
+        stream_key: parse_message_id(stream_offset)
+        for stream_key, stream_offset in stream_offsets.items()
+    }
+    for stream_key, stream_offset in parsed_offsets.items():
+        _set_stream_watermark(stream_key, stream_offset)
+
+    _token_stream_offsets[token_id] = parsed_offsets
+    _token_stream_offsets.move_to_end(token_id)
+
+    if len(_token_stream_offsets) > MAX_CACHED_TOKENS:
+        _token_stream_offsets.popitem(last=False)
+
+
+def forget_token(token_id: str) -> None:
+    global _token_streams_generation
+    _token_streams_generation += 1
+    _token_stream_offsets.pop(token_id, None)
+
+
+def has_pending_data(token_id: str) -> bool:
+    """\
+    Returns False only if we know for certain that
+    none of the token's streams have unread messages.
+    """
+    pending = _has_pending_data(token_id)
+    if pending:
+        POLL_STATS["misses"] += 1
+    else:
+        POLL_STATS["hits"] += 1
+    return pending
+
+
+def _has_pending_data(token_id: str) -> bool:
+    if not _subscribed:
+        return True
+
+    stream_offsets = _token_stream_offsets.get(token_id)
+    if stream_offsets is None:
+        return True
+
+    for stream_key, stream_offset in stream_offsets.items():
+        stream_watermark = _stream_watermarks.get(stream_key)
+        if stream_watermark is None or stream_watermark > stream_offset:
+            return True
+
+    return False
+
+
+def _reset() -> None:
+    global _subscribed, _token_streams_generation
+    _subscribed = False
+    _token_streams_generation += 1
+    _stream_watermarks.clear()
+    _token_stream_offsets.clear()
+
+
+def _handle_notification(channel: bytes, data: bytes) -> None:
+    if channel == STREAM_MESSAGES_CHANNEL.encode():
+        stream_key, _, message_id = data.decode().partition(" ")
+        _set_stream_watermark(stream_key, parse_message_id(message_id))
+    elif channel == TOKEN_STREAMS_CHANNEL.encode():
+        forget_token(data.decode())
+
+
+async def listen_for_notifications() -> None:
+    """Keep the high-water marks up to date, for the lifetime of the process."""
+    global _subscribed
+    while True:
+        try:
+            async with glob.redis.pubsub() as pubsub:
+                await pubsub.subscribe(STREAM_MESSAGES_CHANNEL, TOKEN_STREAMS_CHANNEL)
+                async for item in pubsub.listen():
+                    if item["type"] == "subscribe" and item["data"] == 2:
+                        # anything cached before now may have missed notifications
+                        _reset()
+                        _subscribed = True
+                    elif item["type"] == "message":
+                        _handle_notification(item["channel"], item["data"])
+        except asyncio.CancelledError:
+            _reset()
+            raise
+        except Exception:
+            logger.exception("Lost subscription to stream notifications")
+            _reset()
+            await asyncio.sleep(RECONNECT_DELAY)
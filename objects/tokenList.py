@@ -107,41 +107,7 @@ async def deleteOldTokens(userID: int) -> None:
     :return:
     """
     # Delete older tokens
-    delete: list[osuToken.Token] = []
-    for token in await osuToken.get_tokens():
-        if token["user_id"] == userID:
-            delete.append(token)
+    delete = await osuToken.get_all_tokens_by_user_id(userID)
 
     for i in delete:
         await logoutEvent.handle(i)
-
-
-async def multipleEnqueue(packet: bytes, who: list[int], but: bool = False) -> None:
-    """
-    Enqueue a packet to multiple users
-
-    :param packet: packet bytes to enqueue
-    :param who: userIDs array
-    :param but: if True, enqueue to everyone but users in `who` array
-    :return:
-    """
-    for value in await osuToken.get_tokens():
-        shouldEnqueue = False
-        if value["user_id"] in who and not but:
-            shouldEnqueue = True
-        elif value["user_id"] not in who and but:
-            shouldEnqueue = True
-
-        if shouldEnqueue:
-            await osuToken.enqueue(value["token_id"], packet)
-
-
-async def enqueueAll(packet: bytes) -> None:
-    """
-    Enqueue packet(s) to every connected user
-
-    :param packet: packet bytes to enqueue
-    :return:
-    """
-    for token_id in await osuToken.get_token_ids():
-        await osuToken.enqueue(token_id, packet)
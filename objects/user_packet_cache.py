@@ -0,0 +1,156 @@
+"""\
+A process-local cache of users' encoded presence (userPanel) and
+stats (userStats) packets, to avoid fetching their tokens from redis
+and re-encoding the packets on every request for them.
+
+Whenever a token field used by these packets changes, its user id is
+announced on a redis pubsub channel, and their cached packets are
+dropped. The cache is only used while we're subscribed to it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from typing import TypedDict
+
+from common.log import logger
+from objects import glob
+
+TOKEN_PACKETS_CHANNEL = "bancho:tokens:notifications:packets"
+
+MAX_CACHED_USERS = 50_000
+MAX_TRACKED_INVALIDATIONS = 100_000
+
+RECONNECT_DELAY = 1  # in seconds
+
+# token fields which userPanel and userStats packets are built from
+PACKET_FIELDS = frozenset(
+    (
+        "username",
+        "privileges",
+        "utc_offset",
+        "tournament",
+        "latitude",
+        "longitude",
+        "country",
+        "action_id",
+        "action_text",
+        "action_md5",
+        "action_mods",
+        "game_mode",
+        "beatmap_id",
+        "ranked_score",
+        "accuracy",
+        "playcount",
+        "total_score",
+        "global_rank",
+        "pp",
+    ),
+)
+
+
+class CachedPacket(TypedDict):
+    packet_data: bytes
+    # needed to decide who may receive the packet
+    privileges: int
+    tournament: bool
+
+
+# (user id -> (packet name -> cached packet))
+_cached_packets: OrderedDict[int, dict[str, CachedPacket]] = OrderedDict()
+
+# incremented on every invalidation, so that packets built from token data
+# read before an invalidation are never cached after it
+_generation = 0
+# (user id -> generation they were last invalidated at)
+_invalidated_at: OrderedDict[int, int] = OrderedDict()
+# every user may have been invalidated at or before this generation
+_min_generation = 0
+
+_subscribed = False
+
+
+def get_generation() -> int:
+    return _generation
+
+
+def get(user_id: int, packet_name: str) -> CachedPacket | None:
+    if not _subscribed:
+        return None
+
+    user_packets = _cached_packets.get(user_id)
+    if user_packets is None:
+        return None
+
+    _cached_packets.move_to_end(user_id)
+    return user_packets.get(packet_name)
+
+
+def store(
+    user_id: int,
+    packet_name: str,
+    packet: CachedPacket,
+    *,
+    generation: int,
+) -> None:
+    """\
+    Cache a packet built from token data read at `generation`,
+    unless the user's token has changed since then.
+    """
+    if not _subscribed:
+        return
+
+    if _invalidated_at.get(user_id, _min_generation) > generation:
+        return
+
+    _cached_packets.setdefault(user_id, {})[packet_name] = packet
+    _cached_packets.move_to_end(user_id)
+
+    if len(_cached_packets) > MAX_CACHED_USERS:
+        _cached_packets.popitem(last=False)
+
+
+def invalidate(user_id: int) -> None:
+    global _generation, _min_generation
+    _generation += 1
+    _cached_packets.pop(user_id, None)
+
+    _invalidated_at[user_id] = _generation
+    _invalidated_at.move_to_end(user_id)
+
+    if len(_invalidated_at) > MAX_TRACKED_INVALIDATIONS:
+        _, oldest_generation = _invalidated_at.popitem(last=False)
+        _min_generation = max(_min_generation, oldest_generation)
+
+
+def _reset() -> None:
+    global _subscribed, _generation, _min_generation
+    _subscribed = False
+    _generation += 1
+    _min_generation = _generation
+    _cached_packets.clear()
+    _invalidated_at.clear()
+
+
+async def listen_for_invalidations() -> None:
+    """Keep the cached packets up to date, for the lifetime of the process."""
+    global _subscribed
+    while True:
+        try:
+            async with glob.redis.pubsub() as pubsub:
+                await pubsub.subscribe(TOKEN_PACKETS_CHANNEL)
+                async for item in pubsub.listen():
+                    if item["type"] == "subscribe":
+                        # anything cached before now may have missed invalidations
+                        _reset()
+                        _subscribed = True
+                    elif item["type"] == "message":
+                        invalidate(int(item["data"]))
+        except asyncio.CancelledError:
+            _reset()
+            raise
+        except Exception:
+            logger.exception("Lost subscription to token packet invalidations")
+            _reset()
+            await asyncio.sleep(RECONNECT_DELAY)
@@ -26,8 +26,6 @@ fi
 
 if [[ $APP_COMPONENT == "api" ]]; then
   exec /scripts/run-api.sh
-elif [[ $APP_COMPONENT == "reset-all-tokens-spam-rate" ]]; then
-  exec /scripts/run-reset-all-tokens-spam-rate.sh
 elif [[ $APP_COMPONENT == "timeout-inactive-tokens" ]]; then
   exec /scripts/run-timeout-inactive-tokens.sh
 elif [[ $APP_COMPONENT == "consume-pubsub-events" ]]; then
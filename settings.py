@@ -16,8 +16,17 @@ APP_COMPONENT = os.environ["APP_COMPONENT"]
 APP_PORT = int(os.environ["APP_PORT"])
 APP_GZIP = read_bool(os.environ["APP_GZIP"])
 APP_GZIP_LEVEL = int(os.environ["APP_GZIP_LEVEL"])
+APP_GZIP_MIN_SIZE = int(os.environ["APP_GZIP_MIN_SIZE"])
+APP_GZIP_THREAD_POOL_MIN_SIZE = int(os.environ["APP_GZIP_THREAD_POOL_MIN_SIZE"])
+APP_GZIP_THREAD_POOL_SIZE = int(os.environ["APP_GZIP_THREAD_POOL_SIZE"])
 APP_CI_KEY = os.environ["APP_CI_KEY"]
 APP_API_KEY = os.environ["APP_API_KEY"]
+APP_STREAM_MIRROR = read_bool(os.environ["APP_STREAM_MIRROR"])
+APP_STREAM_MIRROR_STREAMS = os.environ["APP_STREAM_MIRROR_STREAMS"].split(",")
+APP_STREAM_MIRROR_MAX_MESSAGES = int(os.environ["APP_STREAM_MIRROR_MAX_MESSAGES"])
+APP_POLL_MAX_BYTES = int(os.environ["APP_POLL_MAX_BYTES"])
+APP_POLL_MAX_MESSAGES = int(os.environ["APP_POLL_MAX_MESSAGES"])
+APP_MATCH_ACTORS = read_bool(os.environ["APP_MATCH_ACTORS"])
 
 DB_HOST = os.environ["DB_HOST"]
 DB_PORT = int(os.environ["DB_PORT"])
@@ -0,0 +1,58 @@
+"""\
+Time taken encoding and decoding INT_LIST packets, against the previous codec.
+
+Run with `python -m tests.benchmarks.bench_int_lists`.
+"""
+
+from __future__ import annotations
+
+import random
+import timeit
+
+from constants import dataTypes
+from helpers import packetHelper
+from tests import reference_packet_helper
+
+STRUCTURE = (("users", dataTypes.INT_LIST),)
+
+
+def main() -> None:
+    print(
+        f"{'elements':>8} {'encode before':>14} {'encode after':>13} "
+        f"{'decode before':>14} {'decode after':>13}",
+    )
+    rng = random.Random(14)
+    for num_elements in (10, 1000, 20_000):
+        user_ids = [rng.randrange(1000, 2_000_000) for _ in range(num_elements)]
+        body = packetHelper.packData(user_ids, dataTypes.INT_LIST)
+        number = max(10, 200_000 // num_elements)
+
+        row: list[float] = [num_elements]
+        for encode in (
+            reference_packet_helper.buildPacket,
+            packetHelper.buildPacket,
+        ):
+            timings = timeit.repeat(
+                lambda: encode(96, ((user_ids, dataTypes.INT_LIST),)),
+                number=number,
+                repeat=5,
+            )
+            row.append(min(timings) / number * 1e6)
+
+        for decode in (
+            lambda: reference_packet_helper.readPacketData(
+                body,
+                STRUCTURE,
+                has_packet_header=False,
+            ),
+            lambda: packetHelper.readPacketData(body, STRUCTURE),
+        ):
+            assert decode()["data"]["users"] == user_ids
+            timings = timeit.repeat(decode, number=number, repeat=5)
+            row.append(min(timings) / number * 1e6)
+
+        print("%8d %12.1fus %11.1fus %12.1fus %11.1fus" % tuple(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""\
+Bytes copied (and time taken) splitting a request body into its packets.
+
+Run with `python -m tests.benchmarks.bench_stacked_packets`.
+"""
+
+from __future__ import annotations
+
+import struct
+import timeit
+
+from constants import dataTypes
+from helpers import packetHelper
+
+PACKET_HEADER = struct.Struct("<HxI")
+
+# a typical mix of a status update and pings
+STATUS_PACKET = packetHelper.buildPacket(
+    0,
+    (
+        (2, dataTypes.BYTE),
+        ("playing something", dataTypes.STRING),
+        ("", dataTypes.STRING),
+        (72, dataTypes.UINT32),
+        (0, dataTypes.BYTE),
+        (1234, dataTypes.SINT32),
+    ),
+)
+PING_PACKET = packetHelper.buildPacket(4)
+
+
+def copied_bytes(data: bytes | memoryview, requestData: bytes) -> int:
+    """How many bytes of the request body `data` holds its own copy of."""
+    if isinstance(data, memoryview) and data.obj is requestData:
+        return 0
+    return len(data)
+
+
+def split_by_slicing(requestData: bytes) -> int:
+    """The previous loop in mainHandler; returns the number of bytes copied."""
+    copied = 0
+    pos = 0
+    while pos < len(requestData):
+        leftData = requestData[pos:]
+        copied += copied_bytes(leftData, requestData)
+
+        header = leftData[:7]
+        copied += copied_bytes(header, requestData)
+        _, dataLength = PACKET_HEADER.unpack(header)
+
+        packetData = leftData[: dataLength + 7]
+        copied += copied_bytes(packetData, requestData)
+
+        pos += dataLength + 7
+
+    return copied
+
+
+def split_by_views(requestData: bytes) -> int:
+    """packetHelper.iterPackets; returns the number of bytes copied."""
+    copied = 0
+    for _, packetData in packetHelper.iterPackets(requestData):
+        copied += copied_bytes(packetData, requestData)
+
+    return copied
+
+
+def main() -> None:
+    print(
+        f"{'packets':>8} {'body':>8} "
+        f"{'copied before':>14} {'copied after':>13} "
+        f"{'time before':>12} {'time after':>11}",
+    )
+    for num_packets in (1, 10, 100, 1000):
+        requestData = b"".join(
+            PING_PACKET if i % 2 else STATUS_PACKET for i in range(num_packets)
+        )
+
+        row = [num_packets, len(requestData)]
+        for split in (split_by_slicing, split_by_views):
+            row.append(split(requestData))
+        for split in (split_by_slicing, split_by_views):
+            number = max(10, 10_000 // num_packets)
+            timings = timeit.repeat(lambda: split(requestData), number=number)
+            row.append(min(timings) / number * 1e6)
+
+        print("%8d %8d %14d %13d %10.1fus %9.1fus" % tuple(row))
+
+
+if __name__ == "__main__":
+    main()
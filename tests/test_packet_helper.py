@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import random
+import struct
+from typing import Any
+
+import pytest
+
+from constants import clientPackets
+from constants import dataTypes
+from helpers import packetHelper
+from tests import reference_packet_helper
+
+FIXED_WIDTH_TYPES = (
+    dataTypes.UINT16,
+    dataTypes.SINT16,
+    dataTypes.UINT32,
+    dataTypes.SINT32,
+    dataTypes.UINT64,
+    dataTypes.SINT64,
+    dataTypes.FFLOAT,
+    dataTypes.BYTE,
+)
+READABLE_TYPES = (*FIXED_WIDTH_TYPES, dataTypes.STRING, dataTypes.INT_LIST)
+WRITABLE_TYPES = (*READABLE_TYPES, dataTypes.BBYTES)
+
+FUZZ_ITERATIONS = 5000
+
+
+def random_value(rng: random.Random, dataType: int) -> Any:
+    if dataType == dataTypes.UINT16:
+        return rng.randrange(0, 2**16)
+    elif dataType == dataTypes.SINT16:
+        return rng.randrange(-(2**15), 2**15)
+    elif dataType == dataTypes.UINT32:
+        return rng.randrange(0, 2**32)
+    elif dataType == dataTypes.SINT32:
+        return rng.randrange(-(2**31), 2**31)
+    elif dataType == dataTypes.UINT64:
+        return rng.randrange(0, 2**64)
+    elif dataType == dataTypes.SINT64:
+        return rng.randrange(-(2**63), 2**63)
+    elif dataType == dataTypes.FFLOAT:
+        # only values which survive a round trip through a 32-bit float
+        return struct.unpack("<f", struct.pack("<f", rng.uniform(-1e6, 1e6)))[0]
+    elif dataType == dataTypes.BYTE:
+        return rng.randrange(0, 2**8)
+    elif dataType == dataTypes.STRING:
+        # long enough for multi-byte uleb128 lengths, with non-ascii text
+        length = rng.choice((0, 1, rng.randrange(2, 64), rng.randrange(128, 400)))
+        return "".join(rng.choice("abc xyzü日本🎵") for _ in range(length))
+    elif dataType == dataTypes.INT_LIST:
+        length = rng.choice((0, 1, rng.randrange(2, 100)))
+        return [rng.randrange(-(2**31), 2**31) for _ in range(length)]
+    elif dataType == dataTypes.BBYTES:
+        return rng.randbytes(rng.randrange(0, 32))
+    else:
+        raise NotImplementedError(dataType)
+
+
+def random_layout(
+    rng: random.Random,
+    dataTypes: tuple[int, ...],
+) -> list[int]:
+    return [rng.choice(dataTypes) for _ in range(rng.randrange(0, 12))]
+
+
+def test_build_packet_matches_reference() -> None:
+    rng = random.Random(13)
+    for _ in range(FUZZ_ITERATIONS):
+        packet_id = rng.randrange(0, 2**16)
+        packet_data = tuple(
+            (random_value(rng, dataType), dataType)
+            for dataType in random_layout(rng, WRITABLE_TYPES)
+        )
+
+        assert packetHelper.buildPacket(
+            packet_id,
+            packet_data,
+        ) == reference_packet_helper.buildPacket(packet_id, packet_data)
+
+
+def test_read_packet_data_matches_reference() -> None:
+    rng = random.Random(14)
+    for _ in range(FUZZ_ITERATIONS):
+        layout = random_layout(rng, READABLE_TYPES)
+        packet = reference_packet_helper.buildPacket(
+            0,
+            tuple((random_value(rng, dataType), dataType) for dataType in layout),
+        )
+        structure = tuple((f"field{i}", dataType) for i, dataType in enumerate(layout))
+
+        expected = reference_packet_helper.readPacketData(packet, structure)
+        assert packetHelper.readPacketData(packet, structure, offset=7) == expected
+        assert (
+            packetHelper.readPacketData(memoryview(packet)[7:], structure)["data"]
+            == expected["data"]
+        )
+
+
+def test_read_truncated_packet_data_fails_like_reference() -> None:
+    rng = random.Random(15)
+    for _ in range(FUZZ_ITERATIONS):
+        layout = random_layout(rng, READABLE_TYPES)
+        if not layout:
+            continue
+
+        packet = reference_packet_helper.buildPacket(
+            0,
+            tuple((random_value(rng, dataType), dataType) for dataType in layout),
+        )
+        packet = packet[: rng.randrange(7, len(packet))]
+        structure = tuple((f"field{i}", dataType) for i, dataType in enumerate(layout))
+
+        try:
+            expected = reference_packet_helper.readPacketData(packet, structure)
+        except (IndexError, ValueError, struct.error):
+            with pytest.raises((IndexError, ValueError, struct.error)):
+                packetHelper.readPacketData(packet, structure, offset=7)
+        else:
+            # ascii strings & int lists cut short are read short, rather than failing
+            assert packetHelper.readPacketData(packet, structure, offset=7) == expected
+
+
+def test_read_truncated_int_list_matches_reference() -> None:
+    rng = random.Random(16)
+    structure = (("users", dataTypes.INT_LIST),)
+    for _ in range(FUZZ_ITERATIONS):
+        body = packetHelper.packData(
+            random_value(rng, dataTypes.INT_LIST),
+            dataTypes.INT_LIST,
+        )
+        body = body[: rng.randrange(2, len(body) + 1)]
+
+        assert packetHelper.readPacketData(
+            body,
+            structure,
+        ) == reference_packet_helper.readPacketData(
+            bytes(body),
+            structure,
+            has_packet_header=False,
+        )
+
+
+@pytest.mark.parametrize("length", [10, 1000, 20_000])
+def test_int_lists_match_reference(length: int) -> None:
+    rng = random.Random(length)
+    elements = [rng.randrange(-(2**31), 2**31) for _ in range(length)]
+
+    body = packetHelper.packData(elements, dataTypes.INT_LIST)
+    assert body == reference_packet_helper.packData(elements, dataTypes.INT_LIST)
+
+    structure = (("users", dataTypes.INT_LIST),)
+    assert packetHelper.readPacketData(
+        body,
+        structure,
+    ) == reference_packet_helper.readPacketData(
+        bytes(body),
+        structure,
+        has_packet_header=False,
+    )
+
+
+def test_iter_packets_matches_slicing() -> None:
+    rng = random.Random(12)
+    packets = [
+        (rng.randrange(0, 2**16), rng.randbytes(rng.randrange(0, 64)))
+        for _ in range(100)
+    ]
+    request_data = b"".join(
+        packetHelper.wrapPacketBody(packet_id, body) for packet_id, body in packets
+    )
+
+    assert [
+        (packet_id, bytes(body))
+        for packet_id, body in packetHelper.iterPackets(request_data)
+    ] == packets
+
+
+def test_per_packet_structures_are_compiled_once() -> None:
+    base_structure = clientPackets.MATCH_SETTINGS_FMT_SECOND
+    stream = bytes(1024)
+
+    for _ in range(10):
+        # a new (but equal) structure each time, as in matchSettings
+        packetHelper.readPacketData(stream, tuple(list(base_structure)))
+    num_compiled_readers = len(packetHelper._compiled_readers)
+
+    for _ in range(100):
+        packetHelper.readPacketData(stream, tuple(list(base_structure)))
+    assert len(packetHelper._compiled_readers) == num_compiled_readers
@@ -16,7 +16,6 @@ import lifecycle
 from common import exception_handling
 from common.log import logger
 from common.log import logging_config
-from constants import CHATBOT_USER_ID
 from events import logoutEvent
 from objects import osuToken
 from objects import tokenList
@@ -35,47 +34,41 @@ def handle_shutdown_event(signum: int, frame: FrameType | None) -> None:
 signal.signal(signal.SIGTERM, handle_shutdown_event)
 
 
-async def _revoke_token_if_inactive(token: osuToken.Token) -> None:
-    oldest_ping_time = int(time.time()) - CRON_RUN_INTERVAL
+async def _revoke_token(token_id: str, ping_time: float) -> None:
+    token = await osuToken.get_token(token_id)
+    if token is None:
+        # don't keep rescanning what's left of a token deleted elsewhere
+        await osuToken.remove_ping_time(token_id)
+        return
 
-    if (
-        token["ping_time"] < oldest_ping_time
-        and token["user_id"] != CHATBOT_USER_ID
-        and not token["tournament"]
-    ):
-        logger.info(
-            "Timing out inactive bancho session",
-            extra={
-                "username": token["username"],
-                "seconds_inactive": time.time() - token["ping_time"],
-            },
-        )
+    logger.info(
+        "Timing out inactive bancho session",
+        extra={
+            "username": token["username"],
+            "seconds_inactive": time.time() - ping_time,
+        },
+    )
 
-        await logoutEvent.handle(token)
-        await tokenList.deleteToken(token["token_id"])
+    await logoutEvent.handle(token)
+    await tokenList.deleteToken(token["token_id"])
 
 
 async def _timeout_inactive_users() -> None:
-    for token_id in await osuToken.get_token_ids():
-        token = None
-        try:
-            token = await osuToken.get_token(token_id)
-            if token is None:
-                continue
+    oldest_ping_time = int(time.time()) - CRON_RUN_INTERVAL
 
-            await _revoke_token_if_inactive(token)
+    # the chatbot & tournament clients aren't tracked, so never time out
+    inactive_tokens = await osuToken.get_inactive_token_ping_times(oldest_ping_time)
+    for token_id, ping_time in inactive_tokens.items():
+        try:
+            await _revoke_token(token_id, ping_time)
 
         except Exception:
             logger.exception(
                 "An error occurred while disconnecting a timed out client",
                 extra={
                     "token_id": token_id,
-                    "user_id": token["user_id"] if token else None,
-                    "ping_time": token["ping_time"] if token else None,
-                    "time_since_last_ping": (
-                        time.time() - token["ping_time"] if token else None
-                    ),
-                    "tournament": token["tournament"] if token else None,
+                    "ping_time": ping_time,
+                    "time_since_last_ping": time.time() - ping_time,
                 },
             )
 
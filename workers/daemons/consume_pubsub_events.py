@@ -18,6 +18,7 @@ from common.log import logging_config
 from common.redis import pubSub
 from common.redis.pubsubs import AbstractPubSubHandler
 from objects import glob
+from objects import osuToken
 from pubSubHandlers import banHandler
 from pubSubHandlers import changeUsernameHandler
 from pubSubHandlers import disconnectHandler
@@ -73,8 +74,13 @@ async def main() -> int:
         )
 
         async for item in pubsub.listen():
+            # Write packets enqueued by the handler to redis all at once
+            outbox = osuToken.open_outbox()
             try:
-                await pubsub_listener.processItem(item)
+                try:
+                    await pubsub_listener.processItem(item)
+                finally:
+                    await osuToken.close_outbox(outbox)
             except Exception:
                 logger.exception(
                     "An error occurred while processing a pubsub item",
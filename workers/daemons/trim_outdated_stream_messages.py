@@ -17,13 +17,17 @@ from common import exception_handling
 from common.log import logger
 from common.log import logging_config
 from objects import stream_messages
-from objects import streamList
 
-# TODO: this work should be done JIT when a player sends a message
-# and the cronjob/daemon strategy here should be completely removed
+# Streams are trimmed as they're written to (see stream_messages.broadcast_data),
+# so this only acts as a safety net for streams which have stopped receiving
+# messages, and would otherwise hold on to their last messages indefinitely.
+# Streams whose writes weren't tracked are picked up by a periodic full scan.
 
 FIVE_MINUTES = 5 * 60
 
+DAEMON_RUN_INTERVAL = 60  # seconds
+FULL_SCAN_INTERVAL = 60 * 60  # seconds
+
 SHUTDOWN_EVENT: asyncio.Event | None = None
 
 
@@ -42,28 +46,46 @@ async def main() -> int:
     logger.info("Starting outdated stream message trim loop")
     try:
         await lifecycle.startup()
+        last_full_scan_time = 0.0
         while not SHUTDOWN_EVENT.is_set():
-            for stream_name in await streamList.getStreams():
-                try:
-                    five_minutes_ago = time.time() - FIVE_MINUTES
-                    trimmed_messages = await stream_messages.trim_stream_messages(
-                        stream_name,
-                        min_id=f"{int(five_minutes_ago * 1000)}-0",
-                    )
-                    if trimmed_messages:
-                        logger.info(
-                            "Trimmed outdated stream messages",
-                            extra={
-                                "stream_name": stream_name,
-                                "trimmed_messages": trimmed_messages,
-                            },
-                        )
-                    await asyncio.wait_for(
-                        SHUTDOWN_EVENT.wait(),
-                        timeout=0.25,
+            current_time = time.time()
+            idle_since = current_time - FIVE_MINUTES
+
+            if current_time - last_full_scan_time >= FULL_SCAN_INTERVAL:
+                num_streams = await stream_messages.track_untracked_streams()
+                logger.info(
+                    "Scanned for untracked streams",
+                    extra={"num_streams": num_streams},
+                )
+                last_full_scan_time = current_time
+
+            for stream_name in await stream_messages.get_idle_stream_names(idle_since):
+                retention = stream_messages.get_stream_retention(stream_name)
+                trimmed_messages = await stream_messages.trim_stream_messages(
+                    stream_name,
+                    min_id=stream_messages.make_min_id(
+                        current_time - retention["max_age"],
+                    ),
+                )
+                if trimmed_messages:
+                    logger.info(
+                        "Trimmed outdated stream messages",
+                        extra={
+                            "stream_name": stream_name,
+                            "trimmed_messages": trimmed_messages,
+                        },
                     )
-                except TimeoutError:
-                    pass
+
+            # any stream written to since will be trimmed on write
+            await stream_messages.forget_idle_streams(idle_since)
+
+            try:
+                await asyncio.wait_for(
+                    SHUTDOWN_EVENT.wait(),
+                    timeout=DAEMON_RUN_INTERVAL,
+                )
+            except TimeoutError:
+                pass
     finally:
         await lifecycle.shutdown()
 